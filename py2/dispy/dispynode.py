@@ -17,17 +17,19 @@ import traceback
 import marshal
 import tempfile
 import shutil
-import glob
 import functools
+import itertools
 import cPickle as pickle
 import cStringIO as io
 import signal
 import platform
 import copy
+import collections
 import struct
 import hashlib
 import re
 import errno
+import math
 try:
     import psutil
 except ImportError:
@@ -42,7 +44,8 @@ import dispy
 import dispy.config
 from dispy.config import MsgTimeout, MaxFileSize
 from dispy import _JobReply, DispyJob, DispyNodeAvailInfo, _Compute, _XferFile, \
-     _dispy_version, auth_code, num_min, _same_file
+     _dispy_version, auth_code, num_min, _same_file, RemoteResult, _MsgFrame, \
+     _Serializer, _pack_pulse, _connect
 from pycos import Task, Pycos, AsyncSocket, serialize, deserialize
 
 __author__ = "Giridhar Pemmasani (pgiri@yahoo.com)"
@@ -82,9 +85,12 @@ def dispy_provisional_result(result, relay=False, timeout=MsgTimeout):
     Returns 0 if result was delivered to client.
     """
 
-    __dispy_job_reply.status = DispyJob.ProvisionalResult
-    __dispy_job_reply.result = serialize(result)
-    __dispy_job_reply.end_time = time.time()
+    job_reply = getattr(_dispy_thread_job, 'job_reply', None)
+    if job_reply is None:
+        job_reply = __dispy_job_reply
+    job_reply.status = DispyJob.ProvisionalResult
+    job_reply.result = serialize(result)
+    job_reply.end_time = time.time()
     sock = socket.socket(__dispy_sock_family, socket.SOCK_STREAM)
     sock = AsyncSocket(sock, blocking=True, keyfile=__dispy_keyfile, certfile=__dispy_certfile)
     sock.settimeout(timeout)
@@ -93,7 +99,7 @@ def dispy_provisional_result(result, relay=False, timeout=MsgTimeout):
             sock.connect(__dispy_job_reply_addr)
         else:
             sock.connect(__dispy_client_reply_addr)
-        sock.send_msg('JOB_REPLY:' + serialize(__dispy_job_reply))
+        sock.send_msg(_MsgFrame('JOB_REPLY', serialize(job_reply)).pack(__dispy_frames))
         ack = sock.recv_msg()
         assert ack == 'ACK'
     except Exception:
@@ -104,6 +110,40 @@ def dispy_provisional_result(result, relay=False, timeout=MsgTimeout):
         sock.close()
 
 
+def dispy_result_stream(relay=False, maxlen=16, timeout=MsgTimeout):
+    """Returns a stream computations can use to send provisional
+    results (e.g., progress) back to the client frequently.
+
+    Unlike 'dispy_provisional_result', which connects to the client
+    for each result and waits for it to be delivered, results given to
+    'send' method of stream are queued and sent by a thread over one
+    connection that is kept open while the job runs, so 'send' doesn't
+    block. If 'maxlen' results are waiting to be sent, the oldest of
+    them is dropped. When the job is done, the stream is closed after
+    sending results queued. Calling this function again in a job
+    returns the same stream.
+
+    'relay' and 'timeout' are same as in 'dispy_provisional_result'.
+
+    The client gets these results as provisional results (with
+    callback or 'iter_provisional' method of job).
+    """
+
+    job_reply = getattr(_dispy_thread_job, 'job_reply', None)
+    if job_reply is None:
+        job_reply = __dispy_job_reply
+    stream = _dispy_result_streams.get(job_reply.uid, None)
+    if stream is None:
+        if relay:
+            addr = __dispy_job_reply_addr
+        else:
+            addr = __dispy_client_reply_addr
+        stream = _DispyResultStream(job_reply, addr, __dispy_sock_family, __dispy_keyfile,
+                                    __dispy_certfile, maxlen, timeout, __dispy_frames)
+        _dispy_result_streams[job_reply.uid] = stream
+    return stream
+
+
 def dispy_send_file(path, relay=False, timeout=MsgTimeout):
     """Computations may use this function to send files back to the client.
 
@@ -146,7 +186,10 @@ def dispy_send_file(path, relay=False, timeout=MsgTimeout):
         else:
             sock.connect(__dispy_client_reply_addr)
         sock.send_msg('FILEXFER:'.encode() + serialize(xf))
-        sock.send_msg(serialize(__dispy_job_reply))
+        job_reply = getattr(_dispy_thread_job, 'job_reply', None)
+        if job_reply is None:
+            job_reply = __dispy_job_reply
+        sock.send_msg(serialize(job_reply))
         recvd = sock.recv_msg()
         recvd = deserialize(recvd)
         with open(path, 'rb') as fd:
@@ -180,6 +223,185 @@ class _DispyJobInfo(object):
         self.addrinfo = None
         self.pid = None
         self.proc = None
+        self.keep_result = False
+
+
+# job being run by current thread when computation's jobs are run in
+# threads of setup process
+_dispy_thread_job = threading.local()
+# result streams of jobs, indexed by uid
+_dispy_result_streams = {}
+
+
+class _DispyResultStream(object):
+    """Stream of provisional results of a job; see 'dispy_result_stream'.
+    """
+    def __init__(self, job_reply, addr, sock_family, keyfile, certfile, maxlen, timeout,
+                 frames):
+        self._job_reply = job_reply
+        self._addr = addr
+        self._sock_family = sock_family
+        self._keyfile = keyfile
+        self._certfile = certfile
+        self._timeout = timeout
+        self._frames = frames
+        self._msgs = collections.deque(maxlen=maxlen)
+        self._cv = threading.Condition()
+        self._closed = False
+        # number of results not sent (dropped or failed)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._send_proc)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, result):
+        """Queue 'result' to be sent to client as provisional result
+        of job. Returns 0 if result is queued, -1 if stream is closed.
+        """
+        job_reply = copy.copy(self._job_reply)
+        job_reply.status = DispyJob.ProvisionalResult
+        job_reply.result = serialize(result)
+        job_reply.end_time = time.time()
+        msg = _MsgFrame('JOB_REPLY', serialize(job_reply)).pack(self._frames)
+        self._cv.acquire()
+        if self._closed:
+            self._cv.release()
+            return -1
+        if len(self._msgs) == self._msgs.maxlen:
+            self.dropped += 1
+        self._msgs.append(msg)
+        self._cv.notify()
+        self._cv.release()
+        return 0
+
+    def close(self, timeout=None):
+        """Send queued results (waiting up to 'timeout' seconds) and
+        close stream.
+        """
+        self._cv.acquire()
+        self._closed = True
+        self._cv.notify()
+        self._cv.release()
+        self._thread.join(timeout)
+
+    def _send_proc(self):
+        sock = None
+        while 1:
+            self._cv.acquire()
+            while not self._msgs and not self._closed:
+                self._cv.wait()
+            if self._msgs:
+                msg = self._msgs.popleft()
+            else:
+                msg = None
+            self._cv.release()
+            if not msg:
+                break
+            try:
+                if not sock:
+                    sock = AsyncSocket(socket.socket(self._sock_family, socket.SOCK_STREAM),
+                                       blocking=True, keyfile=self._keyfile,
+                                       certfile=self._certfile)
+                    sock.settimeout(self._timeout)
+                    sock.connect(self._addr)
+                sock.send_msg(msg)
+                assert sock.recv_msg() == 'ACK'
+            except Exception:
+                self.dropped += 1
+                if sock:
+                    sock.close()
+                    sock = None
+        if sock:
+            sock.close()
+
+
+def _dispy_close_result_stream(job_reply):
+    """Internal use only.
+    """
+    stream = _dispy_result_streams.pop(job_reply.uid, None)
+    if stream:
+        stream.close(MsgTimeout)
+
+
+class _DispyThreadOutput(object):
+    """Internal use only.
+
+    When jobs are run in threads, this is used as sys.stdout /
+    sys.stderr of setup process so output of each job is saved in that
+    job's buffer.
+    """
+    def __init__(self, stream, name):
+        self._stream = stream
+        self._name = name
+
+    def write(self, data):
+        buf = getattr(_dispy_thread_job, self._name, None)
+        if buf is None:
+            return self._stream.write(data)
+        return buf.write(data)
+
+    def flush(self):
+        if getattr(_dispy_thread_job, self._name, None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _dispy_fetch_results(args, kwargs):
+    """Internal use only.
+
+    Returns 'args' and 'kwargs' with RemoteResult elements replaced by
+    results they refer to, fetched from nodes keeping them.
+    """
+    if any(isinstance(arg, RemoteResult) for arg in args):
+        args = tuple(arg.fetch(keyfile=__dispy_keyfile, certfile=__dispy_certfile)
+                     if isinstance(arg, RemoteResult) else arg for arg in args)
+    if any(isinstance(arg, RemoteResult) for arg in kwargs.itervalues()):
+        kwargs = dict((key, arg.fetch(keyfile=__dispy_keyfile, certfile=__dispy_certfile))
+                      if isinstance(arg, RemoteResult) else (key, arg)
+                      for key, arg in kwargs.iteritems())
+    return args, kwargs
+
+
+def _dispy_run_batch(func, batch_args):
+    """Internal use only.
+
+    Calls 'func' with each tuple of arguments in 'batch_args' and
+    returns list of (status, result, exception, stdout, stderr,
+    start_time, end_time) for each call.
+    """
+    stdout = getattr(_dispy_thread_job, 'stdout', None)
+    if stdout is None:
+        stdout, stderr = sys.stdout, sys.stderr
+    else:
+        stderr = _dispy_thread_job.stderr
+    out_start, err_start = stdout.tell(), stderr.tell()
+    results = []
+    positions = []
+    for args in batch_args:
+        start_time = time.time()
+        try:
+            result = func(*_dispy_fetch_results(args, {})[0])
+        except Exception:
+            results.append([DispyJob.Terminated, None, traceback.format_exc(), '', '',
+                            start_time, time.time()])
+        else:
+            results.append([DispyJob.Finished, result, None, '', '', start_time, time.time()])
+        positions.append((stdout.tell(), stderr.tell()))
+
+    # split output among calls and remove it from output of job
+    out, err = stdout.getvalue(), stderr.getvalue()
+    out_pos, err_pos = out_start, err_start
+    for result, (out_end, err_end) in zip(results, positions):
+        result[3] = out[out_pos:out_end]
+        result[4] = err[err_pos:err_end]
+        out_pos, err_pos = out_end, err_end
+    stdout.seek(out_start)
+    stdout.truncate()
+    stderr.seek(err_start)
+    stderr.truncate()
+    return [tuple(result) for result in results]
 
 
 def _dispy_job_func(__dispy_job_name, __dispy_job_code, __dispy_job_globals,
@@ -204,22 +426,30 @@ def _dispy_job_func(__dispy_job_name, __dispy_job_code, __dispy_job_globals,
     globals()['_dispy_job_func'] = None
     sys.stdout = io.StringIO()
     sys.stderr = io.StringIO()
+    __dispy_job_reply.exec_start_time = time.time()
     try:
         if __dispy_job_code[0]:
             exec(marshal.loads(__dispy_job_code[0])) in globals()
         if __dispy_job_code[1]:
             exec(__dispy_job_code[1]) in globals()
-        localvars = {'dispy_job_args': deserialize(__dispy_job_args),
-                     'dispy_job_kwargs': deserialize(__dispy_job_kwargs)}
-        exec('__dispy_job_reply.result = %s(*dispy_job_args, **dispy_job_kwargs)' %
-             __dispy_job_name) in globals(), localvars
+        localvars = {'dispy_job_args': _Serializer.loads(__dispy_job_args),
+                     'dispy_job_kwargs': _Serializer.loads(__dispy_job_kwargs)}
+        if __dispy_job_batch:
+            __dispy_job_reply.result = _dispy_run_batch(eval(__dispy_job_name, globals()),
+                                                        localvars['dispy_job_args'])
+        else:
+            localvars['dispy_job_args'], localvars['dispy_job_kwargs'] = _dispy_fetch_results(
+                localvars['dispy_job_args'], localvars['dispy_job_kwargs'])
+            exec('__dispy_job_reply.result = %s(*dispy_job_args, **dispy_job_kwargs)' %
+                 __dispy_job_name) in globals(), localvars
         __dispy_job_reply.status = DispyJob.Finished
     except Exception:
         __dispy_job_reply.exception = traceback.format_exc()
         __dispy_job_reply.status = DispyJob.Terminated
         __dispy_job_reply.result = None
 
-    __dispy_job_reply.result = serialize(__dispy_job_reply.result)
+    _dispy_close_result_stream(__dispy_job_reply)
+    __dispy_job_reply.result = _Serializer.dumps(__dispy_job_reply.result, __dispy_serializer)
     __dispy_job_reply.stdout = sys.stdout.getvalue()
     __dispy_job_reply.stderr = sys.stderr.getvalue()
     __dispy_job_reply.end_time = time.time()
@@ -350,7 +580,7 @@ def _dispy_terminate_proc(proc_pid, task=None):
     raise StopIteration(-1)
 
 
-def _dispy_setup_process(compute, pipe, client_globals):
+def _dispy_setup_process(compute, num_cpus, pipe, client_globals):
     """
     Internal use only.
     """
@@ -406,11 +636,14 @@ def _dispy_setup_process(compute, pipe, client_globals):
     else:
         _dispy_setup_status = 0
 
+    if compute.execution == 'thread' and _dispy_setup_status == 1:
+        # jobs are run in this process, so globals are kept here
+        _dispy_setup_status = 0
     pipe.send({'setup_status': _dispy_setup_status})
     setup_globals = {var: value for var, value in globals().iteritems() if var not in init_vars}
 
     if _dispy_setup_status == 0:
-        if setup_globals:
+        if setup_globals or compute.execution == 'thread':
             pipe.send({'use_setup_proc': True})
             if os.name == 'nt':
                 client_globals.update(setup_globals)
@@ -461,20 +694,100 @@ def _dispy_setup_process(compute, pipe, client_globals):
             return
 
         dispynode_logger.debug('Job %s terminated', job_reply.uid)
+        # status (Terminated or TimedOut) is set by node
         job_reply.result = serialize(None)
-        job_reply.status = DispyJob.Terminated
         job_reply.end_time = time.time()
         reply_Q.put(job_reply)
 
+    if compute.execution == 'thread':
+        from multiprocessing.pool import ThreadPool
+        # node runs at most 'num_cpus' * 'jobs_per_cpu' jobs of computation
+        job_pool = ThreadPool(num_cpus * compute.jobs_per_cpu)
+        sys.stdout = _DispyThreadOutput(sys.stdout, 'stdout')
+        sys.stderr = _DispyThreadOutput(sys.stderr, 'stderr')
+    else:
+        job_pool = None
+    # job replies of jobs running in threads, indexed by uid
+    thread_jobs = {}
+
+    def job_thread(job_reply, code, args, kwargs, batch):
+        if job_reply.uid not in thread_jobs:
+            # terminated before it started
+            return
+        _dispy_thread_job.job_reply = job_reply
+        _dispy_thread_job.stdout = io.StringIO()
+        _dispy_thread_job.stderr = io.StringIO()
+        job_reply.exec_start_time = time.time()
+        try:
+            if code:
+                exec(code) in globals()
+            if batch:
+                job_reply.result = _dispy_run_batch(globals()[compute.name],
+                                                    _Serializer.loads(args))
+            else:
+                args, kwargs = _dispy_fetch_results(_Serializer.loads(args),
+                                                    _Serializer.loads(kwargs))
+                job_reply.result = globals()[compute.name](*args, **kwargs)
+            job_reply.status = DispyJob.Finished
+        except Exception:
+            job_reply.exception = traceback.format_exc()
+            job_reply.status = DispyJob.Terminated
+            job_reply.result = None
+
+        try:
+            _dispy_close_result_stream(job_reply)
+            job_reply.result = _Serializer.dumps(job_reply.result, compute.serializer)
+            job_reply.stdout = _dispy_thread_job.stdout.getvalue()
+            job_reply.stderr = _dispy_thread_job.stderr.getvalue()
+        except Exception:
+            # reply must be sent, or job would remain running at client
+            job_reply.exception = traceback.format_exc()
+            job_reply.status = DispyJob.Terminated
+            job_reply.result = serialize(None)
+        job_reply.end_time = time.time()
+        _dispy_thread_job.job_reply = _dispy_thread_job.stdout = _dispy_thread_job.stderr = None
+        # if job has been terminated, its reply has already been sent
+        if thread_jobs.pop(job_reply.uid, None):
+            reply_Q.put(job_reply)
+
+    def job_thread_error(exc):
+        dispynode_logger.warning('Job thread failed: %s', exc)
+
+    def run_job_thread(*args):
+        # ThreadPool in Python 2 doesn't have 'error_callback'
+        try:
+            job_thread(*args)
+        except Exception as exc:
+            job_thread_error(exc)
+
+    def terminate_thread_job(msg):
+        job_reply = msg['job_reply']
+        # threads can't be terminated; thread continues to run, but its
+        # result is discarded
+        if thread_jobs.pop(job_reply.uid, None):
+            dispynode_logger.debug('Job %s terminated (its thread is still running)',
+                                   job_reply.uid)
+            job_reply.result = serialize(None)
+            job_reply.end_time = time.time()
+            reply_Q.put(job_reply)
+
     while 1:
         try:
             msg = pipe.recv()
         except EOFError:
             break
 
-        if msg['req'] == 'job':
+        if msg['req'] == 'job' and job_pool:
+            job_reply = msg['job_reply']
+            thread_jobs[job_reply.uid] = job_reply
+            job_pool.apply_async(run_job_thread, (job_reply, msg['code'], msg['args'],
+                                                  msg['kwargs'], msg['batch']))
+            msg = None
+
+        elif msg['req'] == 'job':
             job_reply = msg['job_reply']
             client_globals['__dispy_job_reply'] = job_reply
+            client_globals['__dispy_job_batch'] = msg['batch']
             args = (compute.name, (compute.code, msg['code']), client_globals,
                     msg['args'], msg['kwargs'])
             job_proc = multiprocessing.Process(target=_dispy_job_func, args=args)
@@ -484,9 +797,12 @@ def _dispy_setup_process(compute, pipe, client_globals):
             msg = args = None
 
         elif msg['req'] == 'terminate_job':
-            thread = threading.Thread(target=terminate_job, args=(msg,))
-            thread.daemon = True
-            thread.start()
+            if job_pool:
+                terminate_thread_job(msg)
+            else:
+                thread = threading.Thread(target=terminate_job, args=(msg,))
+                thread.daemon = True
+                thread.start()
 
         elif msg['req'] == 'wait_pid':
             pid = msg.get('pid', None)
@@ -499,7 +815,8 @@ def _dispy_setup_process(compute, pipe, client_globals):
                     pass
                 else:
                     if job_reply:
-                        job_reply.status = DispyJob.Terminated
+                        if job_reply.status != DispyJob.TimedOut:
+                            job_reply.status = DispyJob.Terminated
                         job_reply.result = serialize(None)
                         job_reply.end_time = time.time()
                         reply_Q.put(job_reply)
@@ -507,6 +824,8 @@ def _dispy_setup_process(compute, pipe, client_globals):
         elif msg['req'] == 'quit':
             break
 
+    if job_pool:
+        job_pool.close()
     if isinstance(compute.cleanup, str):
         localvars = {'_dispy_cleanup_args': setup_args}
         try:
@@ -519,6 +838,363 @@ def _dispy_setup_process(compute, pipe, client_globals):
     exit(0)
 
 
+class _ReplyOutbox(object):
+    """
+    Internal use only.
+
+    Job replies (serialized) that couldn't be sent to client are
+    appended to a segment file, with an in-memory index of where each
+    reply is in the file. Removing a reply appends a marker for it; the
+    file is compacted when it is mostly removed replies and deleted
+    when all replies are removed. Total size of replies is limited to
+    'MaxSize' bytes.
+    """
+
+    MaxSize = 1 << 30
+    MaxWindow = 64
+    MaxBackoff = 300
+    _header = struct.Struct('>qL')
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self.size = 0
+        self.end = 0
+        self._fd = None
+        # state for resending replies to client
+        self.resending = False
+        self.resend_time = 0
+        self.backoff = 0
+        self.window = 1
+        if os.path.isfile(path):
+            self._load()
+
+    def _load(self):
+        header = _ReplyOutbox._header
+        file_size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as fd:
+            while self.end + header.size <= file_size:
+                uid, length = header.unpack(fd.read(header.size))
+                if (self.end + header.size + length) > file_size:
+                    # partially written record
+                    break
+                if length:
+                    self.index[uid] = (self.end + header.size, length)
+                    self.size += length
+                    fd.seek(length, os.SEEK_CUR)
+                else:
+                    self.size -= self.index.pop(uid, (0, 0))[1]
+                self.end += header.size + length
+        if self.end < file_size:
+            with open(self.path, 'r+b') as fd:
+                fd.truncate(self.end)
+
+    def _file(self):
+        if not self._fd:
+            self._fd = open(self.path, 'ab+')
+        return self._fd
+
+    def put(self, uid, data):
+        if self.size + len(data) > _ReplyOutbox.MaxSize:
+            raise Exception('outbox "%s" is full' % self.path)
+        header = _ReplyOutbox._header
+        fd = self._file()
+        fd.write(header.pack(uid, len(data)) + data)
+        fd.flush()
+        self.size += len(data) - self.index.get(uid, (0, 0))[1]
+        self.index[uid] = (self.end + header.size, len(data))
+        self.end += header.size + len(data)
+
+    def get(self, uid):
+        loc = self.index.get(uid, None)
+        if not loc:
+            return None
+        fd = self._file()
+        fd.seek(loc[0])
+        return fd.read(loc[1])
+
+    def remove(self, uid):
+        loc = self.index.pop(uid, None)
+        if not loc:
+            return False
+        self.size -= loc[1]
+        if not self.index:
+            self.close()
+            try:
+                os.remove(self.path)
+            except Exception:
+                pass
+            self.size = self.end = 0
+            return True
+        header = _ReplyOutbox._header
+        fd = self._file()
+        fd.write(header.pack(uid, 0))
+        fd.flush()
+        self.end += header.size
+        if self.end > (1 << 20) and self.end > 2 * (self.size + len(self.index) * header.size):
+            self._compact()
+        return True
+
+    def _compact(self):
+        header = _ReplyOutbox._header
+        index = {}
+        end = 0
+        with open(self.path + '.tmp', 'wb') as fd:
+            for uid in sorted(self.index):
+                data = self.get(uid)
+                fd.write(header.pack(uid, len(data)) + data)
+                index[uid] = (end + header.size, len(data))
+                end += header.size + len(data)
+        self.close()
+        if os.name == 'nt':
+            os.remove(self.path)
+        os.rename(self.path + '.tmp', self.path)
+        self.index = index
+        self.end = end
+
+    def uids(self, limit=None):
+        if limit is None:
+            return sorted(self.index)
+        return list(itertools.islice(self.index, limit))
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        if self._fd:
+            self._fd.close()
+            self._fd = None
+
+
+class _ResultStore(object):
+    """
+    Internal use only.
+
+    Results of jobs submitted with 'dispy_keep_result' are kept in
+    files in 'path', up to 'max_size' bytes in total; oldest results
+    are removed to make room for new ones. Results are named with
+    random keys, which also authorize fetching them (see
+    RemoteResult).
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        # key -> (compute_id, size), in the order results are added
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # results of earlier run are not valid
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    def put(self, compute_id, data):
+        """Saves 'data' (serialized result) and returns its key, or
+        None if it can't be saved.
+        """
+        size = len(data)
+        if size > self.max_size:
+            return None
+        key = hashlib.sha1(os.urandom(20)).hexdigest()
+        try:
+            with open(os.path.join(self.path, key), 'wb') as fd:
+                fd.write(data)
+        except Exception:
+            dispynode_logger.warning('Could not save result: %s', traceback.format_exc())
+            return None
+        self.lock.acquire()
+        self.results[key] = (compute_id, size)
+        self.size += size
+        while self.size > self.max_size:
+            old_key, (_, old_size) = self.results.popitem(last=False)
+            self.size -= old_size
+            self._remove(old_key)
+        self.lock.release()
+        return key
+
+    def get(self, key):
+        self.lock.acquire()
+        found = key in self.results
+        self.lock.release()
+        if not found:
+            return None
+        try:
+            with open(os.path.join(self.path, key), 'rb') as fd:
+                return fd.read()
+        except Exception:
+            return None
+
+    def remove_compute(self, compute_id):
+        self.lock.acquire()
+        keys = [key for key, (cid, _) in self.results.iteritems() if cid == compute_id]
+        for key in keys:
+            self.size -= self.results.pop(key)[1]
+            self._remove(key)
+        self.lock.release()
+
+    def _remove(self, key):
+        try:
+            os.remove(os.path.join(self.path, key))
+        except Exception:
+            pass
+
+    def close(self):
+        self.lock.acquire()
+        self.results.clear()
+        self.size = 0
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.lock.release()
+
+
+class _PidTable(object):
+    """
+    Internal use only.
+
+    PIDs of job processes are appended to a file (instead of saving them
+    in a file for each job) so they can be terminated with 'clean'
+    option if dispynode is killed. Removing a job appends a record with
+    PID 0; file is truncated when there are no jobs and compacted when
+    it is mostly removed records.
+    """
+
+    _record = struct.Struct('>Qqq')
+
+    def __init__(self, path):
+        self.path = path
+        self.pids = {}
+        self.records = 0
+        self.lock = threading.Lock()
+        self._fd = open(path, 'ab', 0)
+
+    @staticmethod
+    def load(path):
+        """Returns dictionary of uid to (pid, ppid) of jobs in table in
+        given file.
+        """
+        pids = {}
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        except Exception:
+            return pids
+        record = _PidTable._record
+        for offset in range(0, len(data) - record.size + 1, record.size):
+            uid, pid, ppid = record.unpack_from(data, offset)
+            if pid:
+                pids[uid] = (pid, ppid)
+            else:
+                pids.pop(uid, None)
+        return pids
+
+    def add(self, uid, pid, ppid):
+        self.lock.acquire()
+        self.pids[uid] = (pid, ppid)
+        self._fd.write(_PidTable._record.pack(uid, pid, ppid))
+        self.records += 1
+        self.lock.release()
+
+    def remove(self, uid):
+        self.lock.acquire()
+        if self.pids.pop(uid, None):
+            if self.pids:
+                self._fd.write(_PidTable._record.pack(uid, 0, 0))
+                self.records += 1
+                if self.records > 1024 and self.records > 4 * len(self.pids):
+                    self._compact()
+            else:
+                self._fd.truncate(0)
+                self.records = 0
+        self.lock.release()
+
+    def _compact(self):
+        record = _PidTable._record
+        with open(self.path + '.tmp', 'wb') as fd:
+            fd.write(b''.join(record.pack(uid, pid, ppid)
+                              for uid, (pid, ppid) in self.pids.items()))
+        self._fd.close()
+        if os.name == 'nt':
+            os.remove(self.path)
+        os.rename(self.path + '.tmp', self.path)
+        self._fd = open(self.path, 'ab', 0)
+        self.records = len(self.pids)
+
+    def close(self):
+        self.lock.acquire()
+        if self._fd:
+            self._fd.close()
+            self._fd = None
+        self.lock.release()
+
+
+class _JobTimerWheel(object):
+    """
+    Internal use only.
+
+    Deadlines of running jobs are kept in a (hashed) timer wheel: a job
+    is put in the slot for the tick of its deadline, so adding or
+    removing a job takes constant time and finding expired jobs only
+    looks at slots of ticks elapsed since last check, instead of all
+    running jobs.
+    """
+
+    Tick = 1.0
+    Slots = 512
+
+    def __init__(self):
+        # each slot maps uid of job to its deadline
+        self.slots = [{} for i in range(_JobTimerWheel.Slots)]
+        # slot of each job
+        self.jobs = {}
+        self.tick = int(time.time() / _JobTimerWheel.Tick)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, uid, deadline):
+        self.lock.acquire()
+        tick = max(int(math.ceil(deadline / _JobTimerWheel.Tick)), self.tick + 1)
+        slot = tick % _JobTimerWheel.Slots
+        self.remove_locked(uid)
+        self.slots[slot][uid] = deadline
+        self.jobs[uid] = slot
+        self.lock.release()
+
+    def remove(self, uid):
+        self.lock.acquire()
+        self.remove_locked(uid)
+        self.lock.release()
+
+    def remove_locked(self, uid):
+        slot = self.jobs.pop(uid, None)
+        if slot is not None:
+            self.slots[slot].pop(uid, None)
+
+    def expired(self, now):
+        """Removes jobs with deadlines up to 'now' and returns their uids.
+        """
+        uids = []
+        self.lock.acquire()
+        tick = int(now / _JobTimerWheel.Tick)
+        if (tick - self.tick) >= _JobTimerWheel.Slots:
+            ticks = range(_JobTimerWheel.Slots)
+        else:
+            ticks = range(self.tick + 1, tick + 1)
+        for tick_ in ticks:
+            slot = self.slots[tick_ % _JobTimerWheel.Slots]
+            if not slot:
+                continue
+            # jobs with later deadlines (in later rounds of wheel) stay
+            for uid, deadline in list(slot.items()):
+                if deadline <= now:
+                    del slot[uid]
+                    del self.jobs[uid]
+                    uids.append(uid)
+        self.tick = max(self.tick, tick)
+        self.lock.release()
+        return uids
+
+
 class _Client(object):
     """
     Internal use only.
@@ -549,7 +1225,7 @@ class _DispyNode(object):
                  secret='', keyfile=None, certfile=None, admin_secret='', zombie_interval=60,
                  ping_interval=None, force_cleanup=False, serve=-1,
                  service_start=None, service_stop=None, service_end=None, safe_setup=True,
-                 daemon=False, client_shutdown=False):
+                 daemon=False, client_shutdown=False, keep_results_size=1024):
         assert 0 < cpus <= multiprocessing.cpu_count()
         self.num_cpus = cpus
         if name:
@@ -665,34 +1341,17 @@ class _DispyNode(object):
             else:
                 print('\n    WARNING: Using "clean" without "psutil" module may be dangerous!\n')
 
-            for name in glob.glob(os.path.join(self.dest_path_prefix, '*.pkl')):
-                if name.startswith('_dispy_job_reply_'):
-                    # job results may be retrieved by clients with
-                    # 'recover_jobs' function, so keep them
-                    continue
-                if not config or not name.startswith('job_') or not os.path.isfile(name):
-                    try:
-                        if os.path.isdir(name):
-                            shutil.rmtree(name, ignore_errors=True)
-                        else:
-                            os.remove(name)
-                    except Exception:
-                        print('Could not remove "%s"' % name)
-                    continue
-                with open(name, 'rb') as fd:
-                    info = pickle.load(fd)
-                    pid = info['pid']
-                try:
-                    os.remove(name)
-                except Exception:
-                    # print(traceback.format_exc())
-                    pass
+            if config:
+                job_pids = _PidTable.load(os.path.join(self.dest_path_prefix, 'job_pids'))
+            else:
+                job_pids = {}
+            for pid, ppid in job_pids.values():
                 dispynode_logger.debug('Killing process with ID %s', pid)
                 if psutil:
                     try:
                         proc = psutil.Process(pid)
                         assert proc.is_running()
-                        assert proc.ppid() == info['ppid']
+                        assert proc.ppid() == ppid
                         if os.name == 'nt':
                             assert any(arg.startswith('from multiprocessing.')
                                        for arg in proc.cmdline())
@@ -729,6 +1388,15 @@ class _DispyNode(object):
         self.avail_cpus = self.num_cpus
         self.clients = {}
         self.job_infos = {}
+        self.pid_table = _PidTable(os.path.join(self.dest_path_prefix, 'job_pids'))
+        # replies that couldn't be sent to clients, indexed by computation id
+        self.reply_outboxes = {}
+        # semaphores limiting bulk transfers, indexed by client's address
+        self.bulk_streams = {}
+        # results kept at node (for 'dispy_keep_result')
+        self.result_store = _ResultStore(os.path.join(self.dest_path_prefix, '_dispy_results'),
+                                         keep_results_size * 1024 * 1024)
+        self.result_pool = pycos.AsyncThreadPool(1)
         self.terminate = False
         self.sign = hashlib.sha1(os.urandom(20))
         for ext_ip_addr in self.addrinfos:
@@ -751,7 +1419,7 @@ class _DispyNode(object):
         scheduler_port = eval(dispy.config.ClientPort)
 
         self.scheduler = {'ip_addr': dispy._node_ipaddr(scheduler_node) if scheduler_node else None,
-                          'port': scheduler_port, 'auth': set(), 'addrinfo': None}
+                          'port': scheduler_port, 'auth': set(), 'addrinfo': None, 'frames': 0}
         self.cpu_time = 0
         self.jobs_done = 0
         self.clients_done = 0
@@ -797,6 +1465,8 @@ class _DispyNode(object):
 
         self.serve = serve
         self.timer_task = Task(self.timer_proc)
+        self.job_timers = _JobTimerWheel()
+        self.job_timer_task = Task(self.job_timer_proc)
         self.service_start = self.service_stop = self.service_end = None
         if isinstance(service_start, int):
             self.service_start = service_start
@@ -828,7 +1498,7 @@ class _DispyNode(object):
         dispynode_logger.info('"%s" serving %s cpus', self.name, self.num_cpus)
 
     def broadcast_ping_msg(self, addrinfos=[], task=None):
-        if (self.scheduler['auth'] or self.job_infos or not self.avail_cpus or
+        if (self.scheduler['auth'] or self.job_infos or self.avail_cpus <= 0 or
             not self.service_available()):
             raise StopIteration
         if not addrinfos:
@@ -889,10 +1559,14 @@ class _DispyNode(object):
         scheduler_port = info['port']
         if (not info.get('relay', None) and isinstance(addr, tuple) and isinstance(addr[0], str)):
             scheduler_ip_addrs.append(addr[0])
-        msg = {'port': self.port, 'sign': self.sign, 'version': _dispy_version}
+        msg = {'port': self.port, 'sign': self.sign, 'version': _dispy_version,
+               'frames': _MsgFrame.Version}
         sign = info.get('sign', '')
         if sign:
-            msg.update({'name': self.name, 'cpus': self.avail_cpus, 'platform': platform.platform(),
+            # with 'jobs_per_cpu' > 1, 'avail_cpus' is negative when more jobs than
+            # cpus are running
+            msg.update({'name': self.name, 'cpus': max(0, self.avail_cpus),
+                        'platform': platform.platform(),
                         'auth': auth_code(self.secret, sign)})
             if psutil:
                 msg['avail_info'] = DispyNodeAvailInfo(
@@ -1072,7 +1746,11 @@ class _DispyNode(object):
             #                            compute.scheduler_ip_addr, compute.scheduler_port,
             #                            self.scheduler['ip_addr'], self.scheduler['port'])
             #     raise StopIteration
-            if self.avail_cpus == 0:
+            # computations for I/O bound jobs may run more than one job per
+            # cpu; each computation is limited by its own 'jobs_per_cpu'
+            jobs_per_cpu = max(_client.compute.jobs_per_cpu for _client in self.clients.values())
+            if (client.pending_jobs >= (self.num_cpus * compute.jobs_per_cpu) or
+                (self.num_cpus - self.avail_cpus) >= (self.num_cpus * jobs_per_cpu)):
                 try:
                     yield conn.send_msg('NAK (all cpus busy)'.encode())
                 except Exception:
@@ -1096,9 +1774,16 @@ class _DispyNode(object):
             job_info.addrinfo = self.addrinfos.get(compute.node_ip_addr, None)
             job_info.job_reply.start_time = time.time()
             job_info.job_reply.status = DispyJob.Running
+            job_info.keep_result = _job.keep_result
             self.thread_lock.acquire()
             self.job_infos[_job.uid] = job_info
             self.thread_lock.release()
+            timeout = _job.timeout or compute.job_timeout
+            if timeout:
+                timers_idle = not len(self.job_timers)
+                self.job_timers.add(_job.uid, job_info.job_reply.start_time + timeout)
+                if timers_idle:
+                    self.job_timer_task.resume()
 
             if compute.type == _Compute.func_type:
                 try:
@@ -1113,19 +1798,18 @@ class _DispyNode(object):
                 try:
                     if client.use_setup_proc:
                         args = {'req': 'job', 'job_reply': job_info.job_reply, 'code': _job.code,
-                                'args': _job._args, 'kwargs': _job._kwargs}
+                                'args': _job._args, 'kwargs': _job._kwargs, 'batch': _job.batch}
                         client.parent_pipe.send(args)
                     else:
                         client.globals['__dispy_job_reply'] = job_info.job_reply
+                        client.globals['__dispy_job_batch'] = _job.batch
                         args = (compute.name, (compute.code, _job.code),
                                 client.globals, _job._args, _job._kwargs)
                         os.chdir(compute.dest_path)
                         job_info.proc = multiprocessing.Process(target=_dispy_job_func, args=args)
                         job_info.proc.start()
                         os.chdir(self.dest_path_prefix)
-                        job_pkl = os.path.join(self.dest_path_prefix, 'job_%s.pkl' % reply.uid)
-                        with open(job_pkl, 'wb') as fd:
-                            pickle.dump({'pid': job_info.proc.pid, 'ppid': self.pid}, fd)
+                        self.pid_table.add(reply.uid, job_info.proc.pid, self.pid)
                 except Exception:
                     job_info.job_reply.result = serialize(None)
                     job_info.job_reply.status = DispyJob.Terminated
@@ -1157,7 +1841,17 @@ class _DispyNode(object):
             except Exception:
                 reply = ('Invalid computation request ignored').encode()
             else:
-                if self.scheduler['auth']:
+                # clients of earlier versions don't send these
+                compute.jobs_per_cpu = getattr(compute, 'jobs_per_cpu', 1)
+                compute.execution = getattr(compute, 'execution', 'process')
+                compute.job_timeout = getattr(compute, 'job_timeout', None)
+                compute.serializer = getattr(compute, 'serializer', 'pickle')
+                compute.frames = getattr(compute, 'frames', 0)
+                if compute.serializer not in _Serializer.registry:
+                    dispynode_logger.warning('Ignoring computation "%s": serializer "%s" is not '
+                                             'available', compute.name, compute.serializer)
+                    reply = ('Serializer "%s" is not available' % compute.serializer).encode()
+                elif self.scheduler['auth']:
                     if (self.scheduler['ip_addr'] == compute.scheduler_ip_addr and
                         self.scheduler['port'] == compute.scheduler_port):
                         if compute.id in self.clients:
@@ -1253,6 +1947,7 @@ class _DispyNode(object):
             self.scheduler['port'] = compute.scheduler_port
             self.scheduler['auth'].add(compute.auth)
             self.scheduler['addrinfo'] = addrinfo
+            self.scheduler['frames'] = compute.frames
 
             try:
                 yield conn.send_msg(serialize(self.avail_cpus))
@@ -1362,6 +2057,8 @@ class _DispyNode(object):
             client.globals['__dispy_sock_family'] = client.sock_family
             client.globals['__dispy_certfile'] = self.certfile
             client.globals['__dispy_keyfile'] = self.keyfile
+            client.globals['__dispy_serializer'] = compute.serializer
+            client.globals['__dispy_frames'] = compute.frames
             client.globals['__dispy_job_reply_addr'] = (compute.scheduler_ip_addr,
                                                         compute.job_result_port)
             if compute.client_reply_addr:
@@ -1375,13 +2072,13 @@ class _DispyNode(object):
 
             setup_status = 0
             if (self._safe_setup and (compute.setup or (not isinstance(compute.cleanup, bool))) or
-                self.suid is not None):
+                self.suid is not None or compute.execution == 'thread'):
 
                 # TODO: use this only for function computations?
                 client.globals['loglevel'] = dispynode_logger.level
                 client.globals['setup_args'] = client.setup_args
                 client.parent_pipe, client.child_pipe = multiprocessing.Pipe(duplex=True)
-                args = (client.compute, client.child_pipe, client.globals)
+                args = (client.compute, self.num_cpus, client.child_pipe, client.globals)
                 client.setup_proc = multiprocessing.Process(target=_dispy_setup_process, args=args)
                 client.setup_proc.start()
                 compute.setup = None
@@ -1465,56 +2162,6 @@ class _DispyNode(object):
                 compute.cleanup = True
             raise StopIteration(None, 'ACK')
 
-        def terminate_job(client, job_info, task=None):
-            compute = client.compute
-            if job_info.proc:
-                proc = job_info.proc
-                pid = proc.pid
-            else:
-                proc = None
-                pid = job_info.pid
-            if not pid or job_info.job_reply.status != DispyJob.Running:
-                raise StopIteration
-            dispynode_logger.debug('Terminating job %s of "%s" (%s)',
-                                   job_info.job_reply.uid, compute.name, pid)
-            job_info.job_reply.status = DispyJob.Terminated
-            if client.use_setup_proc:
-                client.parent_pipe.send({'req': 'terminate_job', 'pid': job_info.pid,
-                                         'job_reply': job_info.job_reply})
-                raise StopIteration
-
-            if not proc and psutil:
-                try:
-                    proc = psutil.Process(pid)
-                    assert proc.is_running()
-                    assert proc.ppid() == self.pid
-                except (psutil.NoSuchProcess, psutil.ZombieProcess, Exception):
-                    dispynode_logger.debug(traceback.format_exc())
-                    raise StopIteration
-
-            if proc:
-                proc_pid = proc
-            else:
-                proc_pid = pid
-
-            suid = client.globals.get('suid', None)
-            if suid is None:
-                status = yield _dispy_terminate_proc(proc_pid, task=task)
-            else:
-                # TODO: terminating process must be parent of process being
-                # killed, so creating suid process won't work!
-                status = -1
-
-            if status:
-                dispynode_logger.debug('Terminating job %s (PID %s) failed',
-                                       job_info.job_reply.uid, pid)
-                raise StopIteration
-
-            job_reply = copy.copy(job_info.job_reply)
-            job_reply.result = serialize(None)
-            job_reply.end_time = time.time()
-            self.reply_Q.put(job_reply)
-
         def retrieve_job(msg):
             # generator
 
@@ -1550,23 +2197,22 @@ class _DispyNode(object):
                 yield send_reply(None)
                 raise StopIteration
 
-            info_file = os.path.join(compute.dest_path, '_dispy_job_reply_%s.pkl' % uid)
-            if not os.path.isfile(info_file):
+            data = self.reply_outbox(compute).get(uid)
+            if not data:
                 yield send_reply(None)
                 raise StopIteration
             try:
-                with open(info_file, 'rb') as fd:
-                    job_reply = pickle.load(fd)
+                job_reply = deserialize(data)
                 assert job_reply.hash == job_hash
             except Exception:
                 yield send_reply(None)
                 raise StopIteration
 
             try:
-                yield conn.send_msg(serialize(job_reply))
+                yield conn.send_msg(data)
                 ack = yield conn.recv_msg()
                 assert ack == 'ACK'
-                client.pending_results -= 1
+                self.reply_delivered(client, uid)
                 pkl_path = os.path.join(self.dest_path_prefix, '%s_%s.pkl' % (compute_id, auth))
                 with open(pkl_path, 'wb') as fd:
                     if 'reply_Q' in client.globals:
@@ -1579,9 +2225,82 @@ class _DispyNode(object):
             except Exception:
                 pass
             else:
-                client.file_uses.pop(info_file, None)
+                if client.pending_results == 0:
+                    Task(self.cleanup_computation, client)
+
+        def retrieve_jobs(msg):
+            # generator
+
+            # replies are sent in the order of uids so client can
+            # resume with 'cursor' (uid of last reply received) if
+            # connection is broken; up to 'window' replies are sent
+            # before waiting for acknowledgements
+            try:
+                req = deserialize(msg)
+                compute_id = req['compute_id']
+                auth = req['auth']
+                cursor = req.get('cursor', None)
+            except Exception:
+                yield conn.send_msg(serialize(None))
+                raise StopIteration
+
+            client = self.clients.get(compute_id, None)
+            if client:
+                compute = client.compute
+            else:
+                pkl_path = os.path.join(self.dest_path_prefix, '%s_%s.pkl' % (compute_id, auth))
+                try:
+                    with open(pkl_path, 'rb') as fd:
+                        client = pickle.load(fd)
+                        compute = client.compute
+                except Exception:
+                    compute = None
+            if not compute or compute.auth != auth:
+                yield conn.send_msg(serialize(None))
+                raise StopIteration
+
+            outbox = self.reply_outbox(compute)
+
+            def reply_acked(uid):
+                # generator
+                ack = yield conn.recv_msg()
+                if ack != b'ACK':
+                    # client doesn't know about this job; keep reply
+                    raise StopIteration(0)
+                self.reply_delivered(client, uid)
+                raise StopIteration(1)
+
+            uids = [uid for uid in outbox.uids() if cursor is None or uid > cursor]
+            window = 16
+            sent = []
+            retrieved = 0
+            try:
+                for uid in uids:
+                    data = outbox.get(uid)
+                    if not data:
+                        continue
+                    yield conn.send_msg(data)
+                    sent.append(uid)
+                    if len(sent) >= window:
+                        retrieved += yield reply_acked(sent.pop(0))
+                while sent:
+                    retrieved += yield reply_acked(sent.pop(0))
+                yield conn.send_msg(serialize(None))
+            except Exception:
+                dispynode_logger.debug('Could not send saved replies of %s to %s',
+                                       compute_id, addr[0])
+
+            if retrieved:
+                pkl_path = os.path.join(self.dest_path_prefix, '%s_%s.pkl' % (compute_id, auth))
                 try:
-                    os.remove(info_file)
+                    with open(pkl_path, 'wb') as fd:
+                        if 'reply_Q' in client.globals:
+                            info = copy.copy(client)
+                            info.globals = dict(client.globals)
+                            info.globals.pop('reply_Q', None)
+                        else:
+                            info = client
+                        pickle.dump(info, fd)
                 except Exception:
                     pass
                 if client.pending_results == 0:
@@ -1595,11 +2314,12 @@ class _DispyNode(object):
             conn.close()
             raise StopIteration
         msg = yield conn.recv_msg()
+        frame = _MsgFrame.parse(msg)
         if req != self.auth:
-            if msg.startswith('PING:'):
+            if frame.name == 'PING':
                 pass
 
-            elif msg == 'NODE_STATUS:':
+            elif frame.name == 'NODE_STATUS':
                 if req == self.admin_auth:
                     info = self.status_info()
                 else:
@@ -1608,14 +2328,15 @@ class _DispyNode(object):
                 conn.close()
                 raise StopIteration
 
-            elif msg.startswith('NODE_INFO:'):
+            elif frame.name == 'NODE_INFO':
                 if req == self.admin_auth:
                     info = self.status_info()
                     info.update({'name': self.name, 'service_start': self.service_start,
                                  'service_stop': self.service_stop, 'service_end': self.service_end,
-                                 'cpus': self.avail_cpus, 'max_cpus': multiprocessing.cpu_count()})
+                                 'cpus': max(0, self.avail_cpus),
+                                 'max_cpus': multiprocessing.cpu_count()})
                     info = serialize(info)
-                    msg = deserialize(msg[len('NODE_INFO:'):])
+                    msg = deserialize(frame.payload)
                     self.admin_sign = msg.get('sign', None)
                 else:
                     info = self.sign.encode()
@@ -1623,9 +2344,9 @@ class _DispyNode(object):
                 conn.close()
                 raise StopIteration
 
-            elif msg.startswith('SET_CPUS:'):
+            elif frame.name == 'SET_CPUS':
                 if req == self.admin_auth:
-                    msg = deserialize(msg[len('SET_CPUS:'):])
+                    msg = deserialize(frame.payload)
                     resp = self.set_cpus(msg.get('cpus', None))
                     if resp == 0:
                         resp = {'cpus': self.num_cpus}
@@ -1635,9 +2356,9 @@ class _DispyNode(object):
                 conn.close()
                 raise StopIteration
 
-            elif msg.startswith('SERVICE_TIME:'):
+            elif frame.name == 'SERVICE_TIME':
                 if req == self.admin_auth:
-                    msg = deserialize(msg[len('SERVICE_TIME:'):])
+                    msg = deserialize(frame.payload)
                     resp = self.service_control(msg.get('control', None), msg.get('time', None))
                 else:
                     resp = -1
@@ -1645,9 +2366,21 @@ class _DispyNode(object):
                 conn.close()
                 raise StopIteration
 
-            elif msg.startswith('SERVE_CLIENTS:'):
+            elif frame.name == 'FETCH_RESULT':
+                # 'req' is key of result kept at this node
+                data = yield self.result_pool.async_task(self.result_store.get, req)
+                if data is None:
+                    data = 'NAK'
+                try:
+                    yield conn.send_msg(data)
+                except Exception:
+                    dispynode_logger.warning('Failed to send result to %s', str(addr))
+                conn.close()
+                raise StopIteration
+
+            elif frame.name == 'SERVE_CLIENTS':
                 if req == self.admin_auth:
-                    msg = deserialize(msg[len('SERVE_CLIENTS:'):])
+                    msg = deserialize(frame.payload)
                     serve = msg.get('serve', None)
                     if isinstance(serve, int):
                         self.serve = serve
@@ -1667,28 +2400,28 @@ class _DispyNode(object):
         if not msg:
             conn.close()
             raise StopIteration
-        if msg.startswith('JOB:'):
-            msg = msg[len('JOB:'):]
+        if frame.name == 'JOB':
+            msg = frame.payload
             yield job_request(msg)
             conn.close()
-        elif msg.startswith('COMPUTE:'):
-            msg = msg[len('COMPUTE:'):]
+        elif frame.name == 'COMPUTE':
+            msg = frame.payload
             yield add_computation(msg)
             conn.close()
-        elif msg.startswith('FILEXFER:'):
-            msg = msg[len('FILEXFER:'):]
+        elif frame.name == 'FILEXFER':
+            msg = frame.payload
             yield xfer_file_req(msg)
             conn.close()
-        elif msg.startswith('SETUP:'):
-            msg = msg[len('SETUP:'):]
+        elif frame.name == 'SETUP':
+            msg = frame.payload
             client, resp = yield setup_computation(msg, task=task)
             if client:
                 client.zombie = True
                 Task(self.cleanup_computation, client)
             yield conn.send_msg(resp.encode())
             conn.close()
-        elif msg.startswith('CLOSE:'):
-            msg = msg[len('CLOSE:'):]
+        elif frame.name == 'CLOSE':
+            msg = frame.payload
             try:
                 info = deserialize(msg)
                 compute_id = info['compute_id']
@@ -1714,12 +2447,12 @@ class _DispyNode(object):
                                      if job_info.compute_id == compute_id]
                         self.thread_lock.release()
                         for job_info in job_infos:
-                            Task(terminate_job, client, job_info)
+                            Task(self.terminate_job, client, job_info)
                     Task(self.cleanup_computation, client)
             yield conn.send_msg('ACK')
             conn.close()
-        elif msg.startswith('TERMINATE_JOB:'):
-            msg = msg[len('TERMINATE_JOB:'):]
+        elif frame.name == 'TERMINATE_JOB':
+            msg = frame.payload
             try:
                 _job = deserialize(msg)
                 client = self.clients[_job.compute_id]
@@ -1732,10 +2465,10 @@ class _DispyNode(object):
                 dispynode_logger.debug('Invalid terminate job request from %s, %s',
                                        addr[0], client.compute.scheduler_ip_addr)
             else:
-                Task(terminate_job, client, job_info)
+                Task(self.terminate_job, client, job_info)
             conn.close()
-        elif msg.startswith('RESEND_JOB_RESULTS:'):
-            msg = msg[len('RESEND_JOB_RESULTS:'):]
+        elif frame.name == 'RESEND_JOB_RESULTS':
+            msg = frame.payload
             try:
                 info = deserialize(msg)
                 compute_id = info['compute_id']
@@ -1763,17 +2496,19 @@ class _DispyNode(object):
             yield conn.send_msg(serialize(reply))
             conn.close()
             if reply > 0:
+                # client is reachable, so don't wait for backoff
+                self.reply_outbox(client.compute).resend_time = 0
                 yield self.resend_job_results(client, task=task)
-        elif msg.startswith('PING:'):
+        elif frame.name == 'PING':
             try:
-                info = deserialize(msg[len('PING:'):])
+                info = deserialize(frame.payload)
                 if info['version'] == _dispy_version:
                     Task(self.send_pong_msg, info, addr)
             except Exception:
                 dispynode_logger.debug(traceback.format_exc())
             conn.close()
 
-        elif msg == 'NODE_STATUS:':
+        elif frame.name == 'NODE_STATUS':
             if self.admin_auth:
                 info = -1
             else:
@@ -1782,25 +2517,26 @@ class _DispyNode(object):
             conn.close()
             raise StopIteration
 
-        elif msg.startswith('NODE_INFO:'):
+        elif frame.name == 'NODE_INFO':
             if self.admin_auth:
                 info = self.sign.encode()
             else:
                 info = self.status_info()
                 info.update({'name': self.name, 'service_start': self.service_start,
                              'service_stop': self.service_stop, 'service_end': self.service_end,
-                             'cpus': self.avail_cpus, 'max_cpus': multiprocessing.cpu_count()})
+                             'cpus': max(0, self.avail_cpus),
+                             'max_cpus': multiprocessing.cpu_count()})
                 info = serialize(info)
             yield conn.send_msg(info)
             conn.close()
             raise StopIteration
 
-        elif msg.startswith('SERVICE_TIME:') or msg.startswith('SERVE_CLIENTS'):
+        elif frame.name == 'SERVICE_TIME' or frame.name == 'SERVE_CLIENTS':
             yield conn.send_msg(b'')
             conn.close()
 
-        elif msg.startswith('JOBS:'):
-            msg = msg[len('JOBS:'):]
+        elif frame.name == 'JOBS':
+            msg = frame.payload
             try:
                 info = deserialize(msg)
                 compute_id = info['compute_id']
@@ -1821,8 +2557,8 @@ class _DispyNode(object):
                 yield conn.send_msg(serialize(reply))
             conn.close()
 
-        elif msg.startswith('PENDING_JOBS:'):
-            msg = msg[len('PENDING_JOBS:'):]
+        elif frame.name == 'PENDING_JOBS':
+            msg = frame.payload
             reply = {'done': [], 'pending': 0}
             try:
                 info = deserialize(msg)
@@ -1847,26 +2583,21 @@ class _DispyNode(object):
                 if compute is not None:
                     done = []
                     if client.pending_results:
-                        for result_file in glob.glob(os.path.join(compute.dest_path,
-                                                                  '_dispy_job_reply_*')):
-                            result_file = os.path.basename(result_file)
-                            try:
-                                uid = int(result_file[len('_dispy_job_reply_'):])
-                            except Exception:
-                                pass
-                            else:
-                                done.append(uid)
-                                # limit so as not to take up too much time
-                                if len(done) > 50:
-                                    break
+                        # limit so as not to take up too much time; clients
+                        # retrieve all results with 'RETRIEVE_JOBS'
+                        done = self.reply_outbox(compute).uids(limit=50)
                     reply['done'] = done
                     reply['pending'] = client.pending_jobs
             yield conn.send_msg(serialize(reply))
             conn.close()
-        elif msg.startswith('RETRIEVE_JOB:'):
-            msg = msg[len('RETRIEVE_JOB:'):]
+        elif frame.name == 'RETRIEVE_JOB':
+            msg = frame.payload
             yield retrieve_job(msg)
             conn.close()
+        elif frame.name == 'RETRIEVE_JOBS':
+            msg = frame.payload
+            yield retrieve_jobs(msg)
+            conn.close()
         else:
             dispynode_logger.warning('Invalid request "%s" from %s',
                                      msg[:min(10, len(msg))], addr[0])
@@ -1877,28 +2608,198 @@ class _DispyNode(object):
                 dispynode_logger.warning('Failed to send reply to %s', str(addr))
             conn.close()
 
+    def reply_outbox(self, compute):
+        """Returns outbox with job replies (for given computation) that
+        couldn't be sent to client. Replies saved in files by earlier
+        versions are moved to outbox.
+        """
+        outbox = self.reply_outboxes.get(compute.id, None)
+        if outbox is None:
+            outbox = _ReplyOutbox(os.path.join(compute.dest_path, '_dispy_job_replies'))
+            try:
+                names = os.listdir(compute.dest_path)
+            except Exception:
+                names = []
+            for name in names:
+                if name.startswith('_dispy_job_reply_') and name.endswith('.pkl'):
+                    path = os.path.join(compute.dest_path, name)
+                    try:
+                        with open(path, 'rb') as fd:
+                            job_reply = pickle.load(fd)
+                        outbox.put(job_reply.uid, serialize(job_reply))
+                        os.remove(path)
+                    except Exception:
+                        dispynode_logger.warning('Could not move "%s" to outbox', path)
+            self.reply_outboxes[compute.id] = outbox
+        return outbox
+
+    def reply_delivered(self, client, uid):
+        # reply in outbox has been received by client
+        outbox = self.reply_outbox(client.compute)
+        if outbox.remove(uid):
+            client.pending_results -= 1
+            if not outbox:
+                client.file_uses.pop(outbox.path, None)
+
+    def bulk_stream(self, addr, task=None):
+        # generator
+        """Waits until bulk data can be sent to 'addr' and returns semaphore
+        that must be released when done.
+        """
+        sem = self.bulk_streams.get(addr, None)
+        if sem is None:
+            sem = pycos.Semaphore(max(1, dispy.config.BulkStreams))
+            self.bulk_streams[addr] = sem
+        yield sem.acquire()
+        raise StopIteration(sem)
+
     def resend_job_results(self, client, task=None):
-        # TODO: limit number queued so as not to take up too much space/time
+        # generator
+        # Replies in outbox are sent to client over one connection, with
+        # up to 'window' replies sent before waiting for
+        # acknowledgements. Window grows as client acknowledges replies
+        # and shrinks when connection fails. If client can't be reached,
+        # resending is retried after exponentially increasing delay.
         compute = client.compute
-        if not os.path.isdir(compute.dest_path):
+        outbox = self.reply_outbox(compute)
+        if outbox.resending or not outbox or time.time() < outbox.resend_time:
             raise StopIteration
-        reply_files = [f for f in os.listdir(compute.dest_path)
-                       if f.startswith('_dispy_job_reply_') and f.endswith('.pkl')]
-        if len(reply_files) > 64:
-            reply_files = reply_files[:64]
-        for reply_file in reply_files:
-            reply_file = os.path.join(compute.dest_path, reply_file)
+        outbox.resending = True
+        reply_addr = client.globals['__dispy_job_reply_addr']
+        # uids in reverse order so next one to send can be popped
+        uids = outbox.uids()
+        uids.reverse()
+        sent = []
+        failed = False
+        bulk = yield self.bulk_stream(reply_addr)
+        try:
+            while uids and not failed:
+                sock = None
+                acked = 0
+                try:
+                    sock = yield _connect(reply_addr, client.sock_family,
+                                          self.keyfile, self.certfile)
+                    while uids or sent:
+                        if uids and len(sent) < outbox.window:
+                            uid = uids.pop()
+                            data = outbox.get(uid)
+                            if data:
+                                yield sock.send_msg(_MsgFrame('JOB_REPLY', data).pack(
+                                    compute.frames))
+                                sent.append(uid)
+                            continue
+                        ack = yield sock.recv_msg()
+                        uid = sent.pop(0)
+                        acked += 1
+                        if ack == 'ACK':
+                            self.reply_delivered(client, uid)
+                        if outbox.window < _ReplyOutbox.MaxWindow:
+                            outbox.window += 1
+                except Exception:
+                    # replies not acknowledged are sent again
+                    uids.extend(reversed(sent))
+                    sent = []
+                    outbox.window = max(1, outbox.window // 2)
+                    failed = acked == 0
+                finally:
+                    if sock is not None:
+                        sock.close()
+        finally:
+            bulk.release()
+            outbox.resending = False
+
+        if failed:
+            outbox.backoff = min(max(1, 2 * outbox.backoff), _ReplyOutbox.MaxBackoff)
+            outbox.resend_time = time.time() + outbox.backoff
+            dispynode_logger.debug('Could not send %s replies to %s; retrying in %s seconds',
+                                   len(outbox), str(reply_addr), outbox.backoff)
+        else:
+            outbox.backoff = outbox.resend_time = 0
+        if client.pending_results == 0:
+            pkl_path = os.path.join(self.dest_path_prefix,
+                                    '%s_%s.pkl' % (compute.id, compute.auth))
+            if os.path.exists(pkl_path):
+                try:
+                    os.remove(pkl_path)
+                except Exception:
+                    dispynode_logger.warning('Could not remove file "%s"', pkl_path)
+        elif client.pending_results < 0:
+            dispynode_logger.warning('Invalid pending results for "%s": %s',
+                                     compute.id, client.pending_results)
+
+    def terminate_job(self, client, job_info, status=DispyJob.Terminated, task=None):
+        # generator
+        compute = client.compute
+        if job_info.proc:
+            proc = job_info.proc
+            pid = proc.pid
+        else:
+            proc = None
+            pid = job_info.pid
+        if job_info.job_reply.status != DispyJob.Running:
+            raise StopIteration
+        # jobs run in threads don't have PIDs
+        if not pid and compute.execution != 'thread':
+            raise StopIteration
+        dispynode_logger.debug('Terminating job %s of "%s" (%s)',
+                               job_info.job_reply.uid, compute.name, pid)
+        job_info.job_reply.status = status
+        if client.use_setup_proc:
+            client.parent_pipe.send({'req': 'terminate_job', 'pid': job_info.pid,
+                                     'job_reply': job_info.job_reply})
+            raise StopIteration
+
+        if not proc and psutil:
             try:
-                with open(reply_file, 'rb') as fd:
-                    job_reply = pickle.load(fd)
-            except Exception:
-                dispynode_logger.debug('Could not load "%s"', reply_file)
-                # dispynode_logger.debug(traceback.format_exc())
-                continue
-            job_info = _DispyJobInfo(job_reply, compute, [])
-            status = yield self._send_job_reply(job_info, resending=True)
-            if status:
-                break
+                proc = psutil.Process(pid)
+                assert proc.is_running()
+                assert proc.ppid() == self.pid
+            except (psutil.NoSuchProcess, psutil.ZombieProcess, Exception):
+                dispynode_logger.debug(traceback.format_exc())
+                raise StopIteration
+
+        if proc:
+            proc_pid = proc
+        else:
+            proc_pid = pid
+
+        suid = client.globals.get('suid', None)
+        if suid is None:
+            res = yield _dispy_terminate_proc(proc_pid, task=task)
+        else:
+            # TODO: terminating process must be parent of process being
+            # killed, so creating suid process won't work!
+            res = -1
+
+        if res:
+            dispynode_logger.debug('Terminating job %s (PID %s) failed',
+                                   job_info.job_reply.uid, pid)
+            raise StopIteration
+
+        job_reply = copy.copy(job_info.job_reply)
+        job_reply.result = serialize(None)
+        job_reply.end_time = time.time()
+        self.reply_Q.put(job_reply)
+
+    def job_timer_proc(self, task=None):
+        # terminates jobs that run longer than their timeouts
+        task.set_daemon()
+        while 1:
+            if len(self.job_timers):
+                yield task.suspend(_JobTimerWheel.Tick)
+            else:
+                yield task.suspend()
+            for uid in self.job_timers.expired(time.time()):
+                self.thread_lock.acquire()
+                job_info = self.job_infos.get(uid, None)
+                self.thread_lock.release()
+                if not job_info:
+                    continue
+                client = self.clients.get(job_info.compute_id, None)
+                if not client:
+                    continue
+                dispynode_logger.debug('Job %s timed out', uid)
+                Task(self.terminate_job, client, job_info, DispyJob.TimedOut)
 
     def timer_proc(self, task=None):
         task.set_daemon()
@@ -1934,7 +2835,8 @@ class _DispyNode(object):
                     continue
 
                 job_reply = job_info.job_reply
-                job_reply.status = DispyJob.Terminated
+                if job_reply.status != DispyJob.TimedOut:
+                    job_reply.status = DispyJob.Terminated
                 job_reply.result = serialize(None)
                 job_reply.end_time = time.time()
                 self.reply_Q.put(job_reply)
@@ -1960,18 +2862,18 @@ class _DispyNode(object):
                     else:
                         info['avail_info'] = None
 
-                    sock = AsyncSocket(socket.socket(addrinfo.family, socket.SOCK_STREAM),
-                                       keyfile=self.keyfile, certfile=self.certfile)
-                    sock.settimeout(MsgTimeout)
+                    sock = None
                     try:
-                        yield sock.connect((self.scheduler['ip_addr'], self.scheduler['port']))
-                        yield sock.send_msg('PULSE:' + serialize(info))
+                        sock = yield _connect((self.scheduler['ip_addr'], self.scheduler['port']),
+                                              addrinfo.family, self.keyfile, self.certfile)
+                        yield sock.send_msg(_pack_pulse(info, self.scheduler['frames']))
                         if (yield sock.recv_msg()) == 'PULSE':
                             for client in self.clients.itervalues():
                                 client.last_pulse = now
                     except Exception:
                         pass
-                    sock.close()
+                    if sock is not None:
+                        sock.close()
 
                 resend = [client for client in self.clients.itervalues()
                           if client.pending_results and not client.zombie]
@@ -2223,9 +3125,10 @@ class _DispyNode(object):
             program = [sys.executable, compute.name]
         else:
             program = [compute.name]
-        args = deserialize(_job._args)
+        args = _Serializer.loads(_job._args)
         program.extend(args)
         reply = job_info.job_reply
+        reply.exec_start_time = time.time()
         try:
             os.chdir(compute.dest_path)
             env = {}
@@ -2236,7 +3139,6 @@ class _DispyNode(object):
                     env[k] = v
                 elif isinstance(v, int):
                     env[k] = repr(v)
-            job_pkl = os.path.join(self.dest_path_prefix, 'job_%s.pkl' % (reply.uid))
             suid = client.globals.get('suid', None)
             if suid is not None:
                 pipe = multiprocessing.Pipe(duplex=False)
@@ -2244,8 +3146,7 @@ class _DispyNode(object):
                 job_info.proc = multiprocessing.Process(target=suid_program, args=args)
                 job_info.proc.start()
                 os.chdir(self.dest_path_prefix)
-                with open(job_pkl, 'wb') as fd:
-                    pickle.dump({'pid': job_info.proc.pid, 'ppid': self.pid}, fd)
+                self.pid_table.add(reply.uid, job_info.proc.pid, self.pid)
                 job_info.proc.join()
                 reply.stdout, reply.stderr = pipe[0].recv()
                 pipe[0].close()
@@ -2254,8 +3155,7 @@ class _DispyNode(object):
                 job_info.proc = subprocess.Popen(program, stdout=subprocess.PIPE,
                                                  stderr=subprocess.PIPE, env=env)
                 os.chdir(self.dest_path_prefix)
-                with open(job_pkl, 'wb') as fd:
-                    pickle.dump({'pid': job_info.proc.pid, 'ppid': self.pid}, fd)
+                self.pid_table.add(reply.uid, job_info.proc.pid, self.pid)
                 reply.stdout, reply.stderr = job_info.proc.communicate()
                 reply.result = serialize(job_info.proc.returncode)
 
@@ -2281,9 +3181,7 @@ class _DispyNode(object):
                 if not job_info:
                     continue
                 job_info.pid = item.get('pid', None)
-                job_pkl = os.path.join(self.dest_path_prefix, 'job_%s.pkl' % item['uid'])
-                with open(job_pkl, 'wb') as fd:
-                    pickle.dump({'pid': job_info.pid, 'ppid': item['ppid']}, fd)
+                self.pid_table.add(item['uid'], job_info.pid, item['ppid'])
                 if psutil:
                     try:
                         proc = psutil.Process(job_info.pid)
@@ -2305,15 +3203,18 @@ class _DispyNode(object):
             self.thread_lock.release()
             if not job_info:
                 continue
-            job_pkl = os.path.join(self.dest_path_prefix, 'job_%s.pkl' % (job_reply.uid))
-            try:
-                os.remove(job_pkl)
-            except Exception:
-                pass
+            self.pid_table.remove(job_reply.uid)
+            self.job_timers.remove(job_reply.uid)
+            if (job_info.keep_result and job_reply.status == DispyJob.Finished and
+                isinstance(job_reply.result, bytes)):
+                key = self.result_store.put(job_info.compute_id, job_reply.result)
+                if key:
+                    job_reply.result = serialize(RemoteResult(job_reply.ip_addr, self.port, key,
+                                                              len(job_reply.result)))
             job_info.job_reply = job_reply
             self.jobs_done += 1
             self.cpu_time += (job_reply.end_time - job_reply.start_time)
-            Task(self._send_job_reply, job_info, resending=False)
+            Task(self._send_job_reply, job_info)
             proc, job_info.proc = job_info.proc, None
             if proc:
                 if isinstance(proc, multiprocessing.Process):
@@ -2336,7 +3237,7 @@ class _DispyNode(object):
                     dispynode_logger.warning('Invalid file "%s" ignored', path)
                     continue
 
-    def _send_job_reply(self, job_info, resending=False, task=None):
+    def _send_job_reply(self, job_info, task=None):
         """Internal use only.
         """
         job_reply = job_info.job_reply
@@ -2357,71 +3258,50 @@ class _DispyNode(object):
                 raise StopIteration
 
         reply_addr = client.globals['__dispy_job_reply_addr']
-        if not resending:
-            self.avail_cpus += 1
-            # assert self.avail_cpus <= self.num_cpus
-            client.pending_jobs -= 1
-
-        sock = socket.socket(client.sock_family, socket.SOCK_STREAM)
-        sock = AsyncSocket(sock, keyfile=self.keyfile, certfile=self.certfile)
-        sock.settimeout(MsgTimeout)
+        self.avail_cpus += 1
+        # assert self.avail_cpus <= self.num_cpus
+        client.pending_jobs -= 1
+
+        sock = None
+        data = serialize(job_reply)
+        if len(data) > dispy.config.BulkMsgSize:
+            bulk = yield self.bulk_stream(reply_addr)
+        else:
+            bulk = None
         try:
-            yield sock.connect(reply_addr)
-            yield sock.send_msg('JOB_REPLY:' + serialize(job_reply))
+            sock = yield _connect(reply_addr, client.sock_family,
+                                  self.keyfile, self.certfile)
+            yield sock.send_msg(_MsgFrame('JOB_REPLY', data).pack(client.compute.frames))
             ack = yield sock.recv_msg()
             assert ack == 'ACK'
         except Exception:
             status = -1
-            if not resending and job_reply.status != DispyJob.Terminated:
+            if job_reply.status not in (DispyJob.Terminated, DispyJob.TimedOut):
                 # store job result so it can be sent when client is
                 # reachable or recovered by user
-                f = os.path.join(job_info.compute_dest_path,
-                                 '_dispy_job_reply_%s.pkl' % job_reply.uid)
+                outbox = self.reply_outbox(client.compute)
                 dispynode_logger.error('Could not send reply for job %s to %s; saving it in "%s"',
-                                       job_reply.uid, str(reply_addr), f)
+                                       job_reply.uid, str(reply_addr), outbox.path)
                 try:
-                    with open(f, 'wb') as fd:
-                        pickle.dump(job_reply, fd)
-                except Exception:
-                    dispynode_logger.debug('Could not save reply for job %s', job_reply.uid)
+                    outbox.put(job_reply.uid, data)
+                except Exception as exc:
+                    dispynode_logger.warning('Could not save reply for job %s: %s',
+                                             job_reply.uid, str(exc))
                 else:
-                    client.file_uses[f] = 2
+                    client.file_uses[outbox.path] = 2
                     client.pending_results += 1
         else:
             status = 0
-
             client.last_pulse = time.time()
-            if resending:
-                client.pending_results -= 1
-            elif client.pending_results:
+            if client.pending_results:
+                # client is reachable, so don't wait for backoff
+                self.reply_outbox(client.compute).resend_time = 0
                 Task(self.resend_job_results, client)
-
-            if resending:
-                pkl_path = os.path.join(job_info.compute_dest_path,
-                                        '_dispy_job_reply_%s.pkl' % job_reply.uid)
-                if os.path.isfile(pkl_path):
-                    try:
-                        os.remove(pkl_path)
-                    except Exception:
-                        # print(traceback.format_exc())
-                        dispynode_logger.warning('Could not remove file "%s"', pkl_path)
-                client.pending_results -= 1
-                if client.pending_results == 0:
-                    pkl_path = os.path.join(self.dest_path_prefix,
-                                            '%s_%s.pkl' % (job_info.compute_id,
-                                                           job_info.compute_auth))
-                    if os.path.exists(pkl_path):
-                        try:
-                            os.remove(pkl_path)
-                        except Exception:
-                            # print(traceback.format_exc())
-                            dispynode_logger.warning('Could not remove file "%s"', pkl_path)
-                elif client.pending_results < 0:
-                    dispynode_logger.warning('Invalid pending results for job %s of "%s": %s',
-                                             job_reply.uid, job_info.compute_id,
-                                             client.pending_results)
         finally:
-            sock.close()
+            if sock is not None:
+                sock.close()
+            if bulk:
+                bulk.release()
 
         if client.pending_jobs == 0 and client.zombie:
             Task(self.cleanup_computation, client)
@@ -2445,6 +3325,7 @@ class _DispyNode(object):
 
         self.clients_done += 1
         self.scheduler['auth'].discard(compute.auth)
+        self.result_store.remove_compute(compute.id)
 
         if isinstance(compute.cleanup, str):
             os.chdir(compute.dest_path)
@@ -2515,7 +3396,7 @@ class _DispyNode(object):
             self.serve -= 1
         if self.serve == 0:
             Task(self.send_terminate)
-            if self.avail_cpus:
+            if self.avail_cpus >= self.num_cpus:
                 self.shutdown('terminate')
         else:
             if ((not self.clients) and (not self.scheduler['auth']) and
@@ -2579,6 +3460,9 @@ class _DispyNode(object):
                                 dispynode_logger.warning('Could not remove "%s"', dirpath)
 
         if client.pending_results == 0:
+            outbox = self.reply_outboxes.pop(compute.id, None)
+            if outbox:
+                outbox.close()
             pkl_path = os.path.join(self.dest_path_prefix, '%s_%s.pkl' % (compute.id, compute.auth))
             try:
                 os.remove(pkl_path)
@@ -2672,6 +3556,12 @@ class _DispyNode(object):
             except Exception:
                 # print(traceback.format_exc())
                 pass
+            self.pid_table.close()
+            try:
+                os.remove(self.pid_table.path)
+            except Exception:
+                pass
+            self.result_store.close()
             if os.name == 'nt':
                 os.kill(self.pid, signal.SIGTERM)
             else:
@@ -2696,12 +3586,11 @@ class _DispyNode(object):
                 else:
                     info['avail_info'] = None
 
-                sock = AsyncSocket(socket.socket(addrinfo.family, socket.SOCK_STREAM),
-                                   keyfile=self.keyfile, certfile=self.certfile)
-                sock.settimeout(MsgTimeout)
+                sock = None
                 try:
-                    yield sock.connect((self.scheduler['ip_addr'], self.scheduler['port']))
-                    yield sock.send_msg('PULSE:' + serialize(info))
+                    sock = yield _connect((self.scheduler['ip_addr'], self.scheduler['port']),
+                                          addrinfo.family, self.keyfile, self.certfile)
+                    yield sock.send_msg(_pack_pulse(info, self.scheduler['frames']))
                     assert (yield sock.recv_msg()) == 'PULSE'
                 except Exception:
                     for client in self.clients.values():
@@ -2712,7 +3601,8 @@ class _DispyNode(object):
                     print('   Scheduler (client) at %s is active, so computations are not closed' %
                           self.scheduler['ip_addr'])
                 finally:
-                    sock.close()
+                    if sock is not None:
+                        sock.close()
 
         task.set_daemon()
         thread_pool = pycos.AsyncThreadPool(1)
@@ -2800,6 +3690,9 @@ if __name__ == '__main__':
                         help='name or IP address of scheduler to announce when starting')
     parser.add_argument('--max_file_size', dest='max_file_size', default=str(MaxFileSize),
                         help='maximum file size of any file transferred (use 0 for unlimited size)')
+    parser.add_argument('--keep_results_size', dest='keep_results_size', type=int, default=1024,
+                        help='maximum size in MB of job results kept at node '
+                        '(for jobs submitted with dispy_keep_result)')
     parser.add_argument('--zombie_interval', dest='zombie_interval', type=float, default=60.0,
                         help='interval in minutes to presume unresponsive scheduler is zombie')
     parser.add_argument('--ping_interval', dest='ping_interval', type=int, default=0,
@@ -2906,6 +3799,9 @@ if __name__ == '__main__':
         if _dispy_config['zombie_interval'] < 1:
             raise Exception('zombie_interval must be at least 1')
 
+    if _dispy_config['keep_results_size'] < 0:
+        raise Exception('keep_results_size must be >= 0')
+
     if _dispy_config['ping_interval']:
         if _dispy_config['ping_interval'] < 10:
             raise Exception('ping_interval must be at least 10')
@@ -34,7 +34,7 @@ import dispy.config
 from dispy.config import MsgTimeout, MaxFileSize
 from dispy import _Compute, DispyJob, _DispyJob_, _Node, DispyNode, NodeAllocate, \
     _JobReply, auth_code, num_min, _parse_node_allocs, _XferFile, _dispy_version, \
-    _same_file, _node_ipaddr, logger
+    _same_file, _node_ipaddr, _JobStats, _MsgFrame, _unpack_pulse, logger
 
 __author__ = "Giridhar Pemmasani (pgiri@yahoo.com)"
 __email__ = "pgiri@yahoo.com"
@@ -81,10 +81,12 @@ class _Cluster(object):
         self.ip_addr = None
         self.dest_path = None
         self.file_uses = {}
+        self.job_stats = _JobStats()
 
     def __getstate__(self):
         state = dict(self.__dict__)
-        for var in ('_node_allocs', 'scheduler', 'status_callback', '_jobs', '_dispy_nodes'):
+        for var in ('_node_allocs', 'scheduler', 'status_callback', '_jobs', '_dispy_nodes',
+                    'job_stats'):
             state.pop(var, None)
         return state
 
@@ -201,6 +203,8 @@ class _Scheduler(object):
         self.unsched_clusters = []
         self.pending_clusters = {}
         self._sched_jobs = {}
+        # uids of scheduled jobs, indexed by IP address of node
+        self._node_jobs = {}
         self._sched_event = pycos.Event()
         # once a _job is done (i.e., final result for it is
         # received from node), it is added to done_jobs, so same
@@ -376,27 +380,36 @@ class _Scheduler(object):
         # generator
         conn.settimeout(MsgTimeout)
         msg = yield conn.recv_msg()
-        if msg.startswith('JOB_REPLY:'):
-            try:
-                info = deserialize(msg[len('JOB_REPLY:'):])
-            except Exception:
-                logger.warning('Invalid job reply from %s:%s ignored', addr[0], addr[1])
-            else:
+        frame = _MsgFrame.parse(msg)
+        if frame.name == 'JOB_REPLY':
+            # node may send more than one reply (e.g., when resending
+            # saved replies) over same connection
+            while frame.name == 'JOB_REPLY':
+                try:
+                    info = deserialize(frame.payload)
+                except Exception:
+                    logger.warning('Invalid job reply from %s:%s ignored', addr[0], addr[1])
+                    break
                 yield self.job_reply_process(info, len(msg), conn, addr)
+                try:
+                    msg = yield conn.recv_msg()
+                    frame = _MsgFrame.parse(msg)
+                except Exception:
+                    break
             conn.close()
 
-        elif msg.startswith('PULSE:'):
-            msg = msg[len('PULSE:'):]
+        elif frame.name == 'PULSE':
             try:
-                info = deserialize(msg)
+                info = _unpack_pulse(frame)
             except Exception:
                 logger.warning('Ignoring pulse message from %s', addr[0])
                 conn.close()
                 raise StopIteration
             node = self._nodes.get(info['ip_addr'], None)
             if node:
-                # assert 0 <= info['cpus'] <= node.cpus
+                # assert 0 <= info['cpus'] <= node.job_slots()
                 node.last_pulse = time.time()
+                node.pulses.pulse(node.last_pulse, self.pulse_interval)
                 yield conn.send_msg('PULSE')
                 if info['avail_info']:
                     node.avail_info = info['avail_info']
@@ -410,21 +423,21 @@ class _Scheduler(object):
                                 cluster.status_callback(DispyNode.AvailInfo, dispy_node, None)
             conn.close()
 
-        elif msg.startswith('PONG:'):
+        elif frame.name == 'PONG':
             conn.close()
             try:
-                info = deserialize(msg[len('PONG:'):])
+                info = deserialize(frame.payload)
                 assert info['auth'] == self.node_auth
             except Exception:
                 logger.warning('Ignoring node %s due to "secret" mismatch', addr[0])
             else:
                 self.add_node(info)
 
-        elif msg.startswith('PING:'):
+        elif frame.name == 'PING':
             sock_family = conn.family
             conn.close()
             try:
-                info = deserialize(msg[len('PING:'):])
+                info = deserialize(frame.payload)
                 if info['version'] != _dispy_version:
                     logger.warning('Ignoring node %s due to version mismatch', addr[0])
                     raise Exception('')
@@ -454,9 +467,9 @@ class _Scheduler(object):
                 finally:
                     sock.close()
 
-        elif msg.startswith('FILEXFER:'):
+        elif frame.name == 'FILEXFER':
             try:
-                xf = deserialize(msg[len('FILEXFER:'):])
+                xf = deserialize(frame.payload)
                 msg = yield conn.recv_msg()
                 job_reply = deserialize(msg)
                 yield self.xfer_to_client(job_reply, xf, conn, addr)
@@ -464,10 +477,10 @@ class _Scheduler(object):
                 logger.debug(traceback.format_exc())
             conn.close()
 
-        elif msg.startswith('TERMINATED:'):
+        elif frame.name == 'TERMINATED':
             conn.close()
             try:
-                info = deserialize(msg[len('TERMINATED:'):])
+                info = deserialize(frame.payload)
                 node = self._nodes.get(info['ip_addr'], None)
                 if not node:
                     raise StopIteration
@@ -478,8 +491,7 @@ class _Scheduler(object):
                 logger.debug('Removing node %s', node.ip_addr)
                 del self._nodes[node.ip_addr]
                 if node.clusters:
-                    dead_jobs = [_job for _job in self._sched_jobs.itervalues()
-                                 if _job.node is not None and _job.node.ip_addr == node.ip_addr]
+                    dead_jobs = self.node_sched_jobs(node.ip_addr)
                     clusters = list(node.clusters)
                     node.clusters.clear()
                     for cluster in clusters:
@@ -492,10 +504,10 @@ class _Scheduler(object):
                 # logger.debug(traceback.format_exc())
                 pass
 
-        elif msg.startswith('NODE_CPUS:'):
+        elif frame.name == 'NODE_CPUS':
             conn.close()
             try:
-                info = deserialize(msg[len('NODE_CPUS:'):])
+                info = deserialize(frame.payload)
                 node = self._nodes.get(info['ip_addr'], None)
                 if not node:
                     raise StopIteration
@@ -540,9 +552,9 @@ class _Scheduler(object):
                 if dispy_node:
                     dispy_node.cpus = cpus
 
-        elif msg.startswith('RELAY_INFO:'):
+        elif frame.name == 'RELAY_INFO':
             try:
-                info = deserialize(msg[len('RELAY_INFO:'):])
+                info = deserialize(frame.payload)
                 assert info['version'] == _dispy_version
                 msg = {'sign': self.sign, 'ip_addrs': [info['scheduler_ip_addr']],
                        'port': self.port}
@@ -686,6 +698,7 @@ class _Scheduler(object):
             cluster.client_port = compute.scheduler_port
             cluster.client_sock_family = conn.family
             cluster.client_auth = compute.auth
+            cluster.client_frames = getattr(compute, 'frames', 0)
             compute.job_result_port = self.port
             compute.scheduler_port = self.port
             compute.auth = hashlib.sha1(os.urandom(10)).hexdigest()
@@ -825,16 +838,18 @@ class _Scheduler(object):
 
         if req != self.cluster_auth:
             msg = yield conn.recv_msg()
-            if msg.startswith('CLIENT:'):
+            frame = _MsgFrame.parse(msg)
+            if frame.name == 'CLIENT':
                 try:
-                    req = deserialize(msg[len('CLIENT:'):])
+                    req = deserialize(frame.payload)
                     if req['version'] != _dispy_version:
                         logger.warning('Ignoring %s due to version mismatch', addr[0])
                         raise Exception('')
                     if not req['ip_addr']:
                         req['ip_addr'] = addr[0]
                     reply = {'ip_addr': req['ip_addr'], 'port': self.scheduler_port,
-                             'sign': self.sign, 'version': _dispy_version}
+                             'sign': self.sign, 'version': _dispy_version,
+                             'frames': _MsgFrame.Version}
                     yield conn.send_msg(serialize(reply))
                 except Exception:
                     pass
@@ -843,13 +858,14 @@ class _Scheduler(object):
             conn.close()
             raise StopIteration
         msg = yield conn.recv_msg()
+        frame = _MsgFrame.parse(msg)
         if not msg:
             logger.info('Closing connection')
             conn.close()
             raise StopIteration
 
-        if msg.startswith('JOB:'):
-            msg = msg[len('JOB:'):]
+        if frame.name == 'JOB':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 _job = req['job']
@@ -864,8 +880,8 @@ class _Scheduler(object):
                 yield _job_request(self, cluster, node, _job)
             resp = None
 
-        elif msg.startswith('PULSE:'):
-            msg = msg[len('PULSE:'):]
+        elif frame.name == 'PULSE':
+            msg = frame.payload
             try:
                 info = deserialize(msg)
             except Exception:
@@ -879,12 +895,12 @@ class _Scheduler(object):
                         cluster.last_pulse = time.time()
             conn.close()
 
-        elif msg.startswith('COMPUTE:'):
-            msg = msg[len('COMPUTE:'):]
+        elif frame.name == 'COMPUTE':
+            msg = frame.payload
             resp = _compute_req(self, msg)
 
-        elif msg.startswith('SCHEDULE:'):
-            msg = msg[len('SCHEDULE:'):]
+        elif frame.name == 'SCHEDULE':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 cluster = self.pending_clusters[req['compute_id']]
@@ -900,8 +916,8 @@ class _Scheduler(object):
                 resp = 'ACK'.encode()
                 Task(self.schedule_cluster)
 
-        elif msg.startswith('CLOSE:'):
-            msg = msg[len('CLOSE:'):]
+        elif frame.name == 'CLOSE':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 auth = req['auth']
@@ -918,16 +934,16 @@ class _Scheduler(object):
             terminate_pending = req.get('terminate_pending', False)
             Task(self.cleanup_computation, cluster, terminate_pending=bool(terminate_pending))
 
-        elif msg.startswith('FILEXFER:'):
-            msg = msg[len('FILEXFER:'):]
+        elif frame.name == 'FILEXFER':
+            msg = frame.payload
             resp = yield xfer_from_client(self, msg)
 
-        elif msg.startswith('SENDFILE:'):
-            msg = msg[len('SENDFILE:'):]
+        elif frame.name == 'SENDFILE':
+            msg = frame.payload
             resp = yield send_file(self, msg)
 
-        elif msg.startswith('NODE_JOBS:'):
-            msg = msg[len('NODE_JOBS:'):]
+        elif frame.name == 'NODE_JOBS':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 cluster = self._clusters.get(req['compute_id'], None)
@@ -943,8 +959,8 @@ class _Scheduler(object):
                 job_uids = []
             resp = serialize(job_uids)
 
-        elif msg.startswith('TERMINATE_JOB:'):
-            msg = msg[len('TERMINATE_JOB:'):]
+        elif frame.name == 'TERMINATE_JOB':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 uid = req['uid']
@@ -956,8 +972,8 @@ class _Scheduler(object):
                 raise StopIteration
             self.cancel_job(cluster, uid)
 
-        elif msg.startswith('RESEND_JOB_RESULTS:'):
-            msg = msg[len('RESEND_JOB_RESULTS:'):]
+        elif frame.name == 'RESEND_JOB_RESULTS':
+            msg = frame.payload
             try:
                 info = deserialize(msg)
                 compute_id = info['compute_id']
@@ -983,8 +999,8 @@ class _Scheduler(object):
                 yield self.resend_job_results(cluster, task=task)
             raise StopIteration
 
-        elif msg.startswith('PENDING_JOBS:'):
-            msg = msg[len('PENDING_JOBS:'):]
+        elif frame.name == 'PENDING_JOBS':
+            msg = frame.payload
             reply = {'done': [], 'pending': 0}
             try:
                 info = deserialize(msg)
@@ -1017,12 +1033,12 @@ class _Scheduler(object):
                     reply['pending'] = cluster.pending_jobs
             resp = serialize(reply)
 
-        elif msg.startswith('RETRIEVE_JOB:'):
-            msg = msg[len('RETRIEVE_JOB:'):]
+        elif frame.name == 'RETRIEVE_JOB':
+            msg = frame.payload
             yield self.retrieve_job_req(conn, msg)
 
-        elif msg.startswith('ALLOCATE_NODE:'):
-            req = msg[len('ALLOCATE_NODE:'):]
+        elif frame.name == 'ALLOCATE_NODE':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1032,8 +1048,8 @@ class _Scheduler(object):
             except Exception:
                 resp = serialize(-1)
 
-        elif msg.startswith('DEALLOCATE_NODE:'):
-            req = msg[len('DEALLOCATE_NODE:'):]
+        elif frame.name == 'DEALLOCATE_NODE':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1043,8 +1059,8 @@ class _Scheduler(object):
             except Exception:
                 resp = serialize(-1)
 
-        elif msg.startswith('CLOSE_NODE:'):
-            req = msg[len('CLOSE_NODE:'):]
+        elif frame.name == 'CLOSE_NODE':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1055,8 +1071,8 @@ class _Scheduler(object):
             except Exception:
                 resp = serialize(-1)
 
-        elif msg.startswith('SET_NODE_CPUS:'):
-            req = msg[len('SET_NODE_CPUS:'):]
+        elif frame.name == 'SET_NODE_CPUS':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1100,6 +1116,27 @@ class _Scheduler(object):
                 if status:
                     break
 
+    def probe_node(self, node, task=None):
+        # generator
+        # node is suspected to have failed; it is removed (and its jobs
+        # rescheduled) only if it doesn't respond to probe either
+        node.probing = True
+        alive = yield node.probe(task=task)
+        node.probing = False
+        if alive or self._nodes.get(node.ip_addr, None) != node:
+            raise StopIteration
+        logger.warning('Node %s is not responding; removing it (%s, %s, %s)',
+                       node.ip_addr, node.busy, node.last_pulse, time.time())
+        del self._nodes[node.ip_addr]
+        clusters = list(node.clusters)
+        node.clusters.clear()
+        for cluster in clusters:
+            dispy_node = cluster._dispy_nodes.pop(node.ip_addr, None)
+            if not dispy_node:
+                continue
+            Task(self.send_node_status, cluster, dispy_node, DispyNode.Closed)
+        self.reschedule_jobs(self.node_sched_jobs(node.ip_addr))
+
     def timer_proc(self, task=None):
         task.set_daemon()
         reset = True
@@ -1115,25 +1152,10 @@ class _Scheduler(object):
             now = time.time()
             if self.pulse_interval and (now - last_pulse_time) >= self.pulse_interval:
                 last_pulse_time = now
-                dead_nodes = {}
                 for node in self._nodes.itervalues():
-                    if node.busy and (node.last_pulse + (5 * self.pulse_interval)) < now:
-                        logger.warning('Node %s is not responding; removing it (%s, %s, %s)',
-                                       node.ip_addr, node.busy, node.last_pulse, now)
-                        dead_nodes[node.ip_addr] = node
-                for ip_addr in dead_nodes:
-                    node = self._nodes.pop(ip_addr, None)
-                    clusters = list(node.clusters)
-                    node.clusters.clear()
-                    for cluster in clusters:
-                        dispy_node = cluster._dispy_nodes.pop(node.ip_addr, None)
-                        if not dispy_node:
-                            continue
-                        Task(self.send_node_status, cluster, dispy_node, DispyNode.Closed)
-
-                dead_jobs = [_job for _job in self._sched_jobs.itervalues()
-                             if _job.node is not None and _job.node.ip_addr in dead_nodes]
-                self.reschedule_jobs(dead_jobs)
+                    if node.busy and not node.probing and \
+                       node.suspected(now, self.pulse_interval):
+                        Task(self.probe_node, node)
                 resend = [resend_cluster for resend_cluster in self._clusters.itervalues()
                           if resend_cluster.pending_results and not resend_cluster.zombie]
                 for cluster in resend:
@@ -1202,6 +1224,7 @@ class _Scheduler(object):
                 data = yield conn.recvall(min(xf.stat_buf.st_size-recvd, 1024000))
                 if not data:
                     break
+                node.last_pulse = time.time()
                 yield client_sock.sendall(data)
                 recvd = yield client_sock.recv_msg()
                 recvd = deserialize(recvd)
@@ -1411,6 +1434,7 @@ class _Scheduler(object):
                          keyfile=self.node_keyfile, certfile=self.node_certfile)
             node.name = info['name']
             node.avail_info = info['avail_info']
+            node.frames = info.get('frames', 0)
             self._nodes[node.ip_addr] = node
         else:
             node.last_pulse = time.time()
@@ -1425,8 +1449,7 @@ class _Scheduler(object):
             logger.debug('Node %s rediscovered', info['ip_addr'])
             node.port = info['port']
             if node.auth is not None:
-                dead_jobs = [_job for _job in self._sched_jobs.itervalues()
-                             if _job.node is not None and _job.node.ip_addr == node.ip_addr]
+                dead_jobs = self.node_sched_jobs(node.ip_addr)
                 node.busy = 0
                 node.auth = auth
                 clusters = list(node.clusters)
@@ -1464,7 +1487,8 @@ class _Scheduler(object):
         sock.settimeout(MsgTimeout)
         try:
             yield sock.connect((cluster.client_ip_addr, cluster.client_job_result_port))
-            yield sock.send_msg('JOB_REPLY:' + serialize(result))
+            yield sock.send_msg(_MsgFrame('JOB_REPLY', serialize(result)).pack(
+                cluster.client_frames))
             ack = yield sock.recv_msg()
             assert ack == 'ACK'
         except Exception:
@@ -1632,7 +1656,8 @@ class _Scheduler(object):
         job.end_time = reply.end_time
         if reply.status != DispyJob.ProvisionalResult:
             self.done_jobs[_job.uid] = _job
-            del self._sched_jobs[_job.uid]
+            self.pop_sched_job(_job.uid)
+            cluster.job_stats.job_done(_job, job.submit_time, reply)
             node.busy -= 1
             node.cpu_time += reply.end_time - reply.start_time
             if cluster.status_callback:
@@ -1659,12 +1684,45 @@ class _Scheduler(object):
                     logger.warning('Could not remove "%s"', xf.name)
         Task(self.send_job_result, _job.uid, cluster, reply, resending=False)
 
+    def add_sched_job(self, _job):
+        self._sched_jobs[_job.uid] = _job
+        if _job.node:
+            self._node_jobs.setdefault(_job.node.ip_addr, set()).add(_job.uid)
+
+    def pop_sched_job(self, uid):
+        _job = self._sched_jobs.pop(uid, None)
+        if _job and _job.node:
+            uids = self._node_jobs.get(_job.node.ip_addr, None)
+            if uids:
+                uids.discard(uid)
+                if not uids:
+                    del self._node_jobs[_job.node.ip_addr]
+        return _job
+
+    def node_sched_jobs(self, ip_addr):
+        # jobs scheduled on node; this doesn't go through all scheduled jobs
+        return [self._sched_jobs[uid] for uid in self._node_jobs.get(ip_addr, ())]
+
+    def job_slot_free(self, node, cluster):
+        """Returns True if job of 'cluster' can run on 'node' now; jobs of
+        each computation are limited by its own 'jobs_per_cpu', even if
+        other computations on node run more jobs per CPU.
+        """
+        slots = node.job_slots(cluster)
+        if slots >= node.job_slots():
+            # checked with node's slots already
+            return True
+        compute_id = cluster._compute.id
+        busy = sum(1 for _job in self.node_sched_jobs(node.ip_addr)
+                   if _job.compute_id == compute_id)
+        return busy < slots
+
     def reschedule_jobs(self, dead_jobs):
         if not dead_jobs:
             return
         for _job in dead_jobs:
             cluster = self._clusters[_job.compute_id]
-            del self._sched_jobs[_job.uid]
+            self.pop_sched_job(_job.uid)
             if cluster._compute.reentrant and not _job.pinned:
                 logger.debug('Rescheduling job %s from %s', _job.uid, _job.node.ip_addr)
                 _job.job.status = DispyJob.Created
@@ -1688,15 +1746,17 @@ class _Scheduler(object):
         node = None
         load = 1.0
         for host in self._nodes.itervalues():
-            if host.busy >= host.cpus:
+            slots = host.job_slots()
+            if host.busy >= slots:
                 continue
             if host.pending_jobs:
                 return host
-            if not any(cluster._jobs for cluster in host.clusters):
+            if not any(cluster._jobs and self.job_slot_free(host, cluster)
+                       for cluster in host.clusters):
                 continue
-            if (host.busy / host.cpus) < load:
+            if (host.busy / slots) < load:
                 node = host
-                load = host.busy / host.cpus
+                load = host.busy / slots
         return node
 
     def fsfs_job_schedule(self):
@@ -1708,8 +1768,8 @@ class _Scheduler(object):
             return (None, None, None)
         _job = cluster = lrs = None
         for cluster in node.clusters:
-            if cluster._jobs and (not lrs or
-                                  cluster._jobs[0].job.submit_time < lrs._jobs[0].job.submit_time):
+            if (cluster._jobs and self.job_slot_free(node, cluster) and
+                (not lrs or cluster._jobs[0].job.submit_time < lrs._jobs[0].job.submit_time)):
                 lrs = cluster
         if lrs:
             if node.pending_jobs:
@@ -1733,7 +1793,8 @@ class _Scheduler(object):
             return (None, None, None)
         _job = cluster = lrs = None
         for cluster in node.clusters:
-            if cluster._jobs and (not lrs or cluster.job_sched_time < lrs.job_sched_time):
+            if (cluster._jobs and self.job_slot_free(node, cluster) and
+                (not lrs or cluster.job_sched_time < lrs.job_sched_time)):
                 lrs = cluster
         if lrs:
             if node.pending_jobs:
@@ -1763,7 +1824,8 @@ class _Scheduler(object):
             return (None, None, None)
         _job = cluster = lrs = None
         for cluster in node.clusters:
-            if cluster._jobs and (not lrs or cluster.start_time < lrs.start_time):
+            if (cluster._jobs and self.job_slot_free(node, cluster) and
+                (not lrs or cluster.start_time < lrs.start_time)):
                 lrs = cluster
         if lrs:
             if node.pending_jobs:
@@ -1795,7 +1857,7 @@ class _Scheduler(object):
             logger.warning('Failed to run job %s on %s for computation %s; removing this node',
                            _job.uid, node.ip_addr, cluster._compute.name)
             self.delete_node(node)
-            if self._sched_jobs.pop(_job.uid, None) == _job:
+            if self.pop_sched_job(_job.uid) == _job:
                 if not _job.pinned:
                     cluster._jobs.insert(0, _job)
                 node.busy -= 1
@@ -1806,7 +1868,7 @@ class _Scheduler(object):
             # logger.debug(traceback.format_exc())
             # TODO: delay executing again for some time?
             # this job might have been deleted already due to timeout
-            if self._sched_jobs.pop(_job.uid, None) == _job:
+            if self.pop_sched_job(_job.uid) == _job:
                 if cluster.status_callback:
                     if dispy_node:
                         dispy_node.update_time = time.time()
@@ -1819,8 +1881,9 @@ class _Scheduler(object):
                 logger.debug('Running job %s on %s (busy: %d / %d)',
                              _job.uid, node.ip_addr, node.busy, node.cpus)
                 _job.job.status = DispyJob.Running
-                _job.job.start_time = time.time()
+                _job.job.start_time = _job.sent_time = time.time()
                 cluster = self._clusters[_job.compute_id]
+                cluster.job_stats.job_sent(_job, _job.job.submit_time)
                 # TODO/Note: It is likely that this job status may arrive at
                 # the client before the job is done and the node's status
                 # arrives. Either use queing for messages (ideally with
@@ -1842,8 +1905,9 @@ class _Scheduler(object):
                 yield self._sched_event.wait()
                 continue
             _job.node = node
+            _job.dispatch_time = time.time()
             # assert node.busy < node.cpus
-            self._sched_jobs[_job.uid] = _job
+            self.add_sched_job(_job)
             node.busy += 1
             Task(self.run_job, _job, cluster)
 
@@ -1867,6 +1931,7 @@ class _Scheduler(object):
             yield self.cleanup_computation(cluster)
         self._clusters = {}
         self._sched_jobs = {}
+        self._node_jobs = {}
         self.done_jobs = {}
         logger.debug('Scheduler quit')
 
@@ -2033,10 +2098,10 @@ class _Scheduler(object):
                         ]
         else:
             if get_uids:
-                jobs = [_job.uid for _job in self._sched_jobs.itervalues() if _job.node == node
+                jobs = [_job.uid for _job in self.node_sched_jobs(node.ip_addr) if _job.node == node
                         and _job.compute_id == cluster._compute.id]
             else:
-                jobs = [_job.job for _job in self._sched_jobs.itervalues() if _job.node == node
+                jobs = [_job.job for _job in self.node_sched_jobs(node.ip_addr) if _job.node == node
                         and _job.compute_id == cluster._compute.id]
 
         raise StopIteration(jobs)
@@ -2119,6 +2184,9 @@ class _Scheduler(object):
         if self.unsched_clusters:
             print('Pending clients: %s' % (len(self.unsched_clusters)))
         print('')
+        for cluster in self._clusters.values():
+            print('Job latencies for %s:\n' % cluster.name)
+            cluster.job_stats.print_stats()
         yield 0
 
 
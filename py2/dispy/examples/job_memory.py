@@ -0,0 +1,44 @@
+# Program to measure memory used at client for submitted jobs: it creates
+# jobs as 'submit' does (without sending them to nodes, so no nodes are needed)
+# and prints memory used per million jobs. Memory is measured with maximum
+# resident set size, so this works only on Unix-like systems.
+
+import sys, gc, resource
+
+
+def max_rss():
+    # ru_maxrss is in kilobytes on Linux, bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+
+if __name__ == '__main__':
+    import dispy
+    # number of jobs (in millions) can be given as argument
+    if len(sys.argv) > 1:
+        millions = float(sys.argv[1])
+    else:
+        millions = 1
+    n = int(millions * 1000000)
+
+    # memory of DispyJob instances alone (as given to user programs)
+    gc.collect()
+    start = max_rss()
+    jobs = [dispy.DispyJob(1, (i,), {}) for i in range(n)]
+    gc.collect()
+    print('%s DispyJob: %.1f MB per million jobs' %
+          (n, (max_rss() - start) / (millions * 1024 * 1024)))
+
+    # memory of jobs as kept by client while pending (_DispyJob_ with its
+    # DispyJob and serialized arguments)
+    start = max_rss()
+    _jobs = []
+    for i in range(n):
+        _job = dispy._DispyJob_(1, None, (i,), {})
+        _job.serialize_args()
+        _jobs.append(_job)
+    gc.collect()
+    print('%s _DispyJob_: %.1f MB per million jobs' %
+          (n, (max_rss() - start) / (millions * 1024 * 1024)))
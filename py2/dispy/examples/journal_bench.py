@@ -0,0 +1,43 @@
+# Program to measure job journal (used for fault recovery and
+# 'JobCluster.resume'): it appends Submit, Dispatch and Finish records for
+# given number of jobs (as client does), waits for them to be written (and
+# synced) to disk and prints events recorded per second, and then time to
+# read the journal back. No nodes are needed.
+
+import sys, os, time, tempfile
+
+
+if __name__ == '__main__':
+    import dispy
+    from dispy import _JobJournal
+    # number of jobs can be given as argument; each job has 3 events
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    else:
+        n = 100000
+    path = os.path.join(tempfile.mkdtemp(prefix='dispy_journal_'), 'bench.jobs')
+    args = dispy.serialize(((17, 'compute', 3.5), {}))
+    result = dispy.serialize(42)
+    journal = _JobJournal(path)
+    start = time.time()
+    journal.append((_JobJournal.Compute, 1, 'compute'))
+    for uid in range(n):
+        journal.append((_JobJournal.Submit, 1, uid, uid, args, b'', [], False))
+        journal.append((_JobJournal.Dispatch, 1, uid, '192.168.10.20'))
+        journal.append((_JobJournal.Finish, 1, uid, dispy.DispyJob.Finished, result, '', '',
+                        '', start, start, '192.168.10.20'))
+    append_time = time.time() - start
+    journal.close()
+    write_time = time.time() - start
+    size = os.path.getsize(path)
+
+    start = time.time()
+    count = sum(1 for record in _JobJournal.records(path))
+    read_time = time.time() - start
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+    events = 3 * n
+    print('%d events (%.1f MB): append: %.0f events/sec, written and synced: %.0f events/sec' %
+          (events, size / 1e6, events / append_time, events / write_time))
+    print('read %d records: %.0f records/sec' % (count, count / read_time))
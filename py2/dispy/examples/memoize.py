@@ -0,0 +1,28 @@
+# Program to check result cache ('memoize' option of JobCluster): jobs are
+# submitted twice with same arguments; second time, results are served from
+# cache (without running jobs on nodes), so jobs are finished as soon as they
+# are submitted. The cache is kept in file 'memoize_cache' (which is removed at
+# the end), so results would also be reused by another run of this program.
+
+def compute(n):  # executed on nodes
+    import time
+    time.sleep(1)
+    return n * n
+
+if __name__ == '__main__':
+    import dispy, os, glob
+    cache = 'memoize_cache'
+    cluster = dispy.JobCluster(compute, memoize=cache)
+    first = [cluster.submit(i) for i in range(8)]
+    cluster.wait()
+    assert all(job.status == dispy.DispyJob.Finished for job in first)
+
+    second = [cluster.submit(i) for i in range(8)]
+    # cached jobs are finished by 'submit' itself
+    assert all(job.status == dispy.DispyJob.Finished for job in second)
+    assert [job() for job in second] == [job.result for job in first]
+    assert cluster._result_cache.hits == len(second)
+    cluster.print_status()
+    cluster.close()
+    for path in glob.glob(cache + '*'):
+        os.remove(path)
@@ -0,0 +1,55 @@
+# Program to compare serializers that can be used for job arguments and
+# results (with 'serializer' option of JobCluster): for each workload, it
+# prints size of serialized data and time to serialize and deserialize.
+# No nodes are needed. If numpy is available, large array is numpy array,
+# otherwise it is list of floats.
+
+import time
+
+
+def bench(name, obj, count):
+    data = _Serializer.dumps(obj, name)
+    start = time.time()
+    for i in range(count):
+        _Serializer.dumps(obj, name)
+    dumps_time = (time.time() - start) / count
+    start = time.time()
+    for i in range(count):
+        _Serializer.loads(data)
+    loads_time = (time.time() - start) / count
+    return len(data), dumps_time, loads_time
+
+
+if __name__ == '__main__':
+    import dispy
+    from dispy import _Serializer
+    try:
+        import numpy
+        large = numpy.random.random(1000000)
+    except ImportError:
+        large = [float(i) for i in range(1000000)]
+
+    workloads = [('small args', ((17, 'compute', 3.5), {'verbose': False}), 100000),
+                 ('large array', ((large,), {}), 10),
+                 ('mixed', (([{'id': i, 'name': 'job-%s' % i, 'values': list(range(20))}
+                              for i in range(1000)], 'summary'), {'limit': 1.0e6}), 100)]
+
+    # PULSE messages (encoded with struct) compared with pickle
+    info = {'ip_addr': '192.168.10.20', 'port': 51348, 'cpus': 3,
+            'scheduler_ip_addr': '192.168.10.1',
+            'avail_info': dispy.DispyNodeAvailInfo(75.5, 8 * 1024**3, 100 * 1024**3, 100.0)}
+    count = 100000
+    start = time.time()
+    for i in range(count):
+        msg = dispy._pack_pulse(info)
+    pack_time = (time.time() - start) / count
+    pickled = dispy.serialize(info)
+
+    for workload, obj, count in workloads:
+        print('%s:' % workload)
+        for name in sorted(_Serializer.registry):
+            size, dumps_time, loads_time = bench(name, obj, count)
+            print('  %-8s %10d bytes, dumps: %10.1f us, loads: %10.1f us' %
+                  (name, size, dumps_time * 1e6, loads_time * 1e6))
+    print('pulse: %d bytes (pickle: %d bytes), pack: %.1f us' %
+          (len(msg), len(pickled), pack_time * 1e6))
@@ -54,8 +54,15 @@ class DispyHTTPServer(object):
             self.cluster = cluster
             self.jobs_submitted = 0
             self.jobs_done = 0
+            self.jobs_failed = 0
             self.jobs_pending = 0
             self.jobs = {}
+            # JobCluster and dispyscheduler's cluster keep latencies and
+            # callbacks queue with different names
+            self.job_stats = getattr(cluster, '_job_stats', None) or \
+                             getattr(cluster, 'job_stats', None)
+            worker = getattr(cluster, '_cluster', None) or getattr(cluster, 'scheduler', None)
+            self.worker_Q = getattr(worker, 'worker_Q', None)
             self.status = {}
             # TODO: maintain updates for each client separately, so
             # multiple clients can view the status?
@@ -113,6 +120,14 @@ class DispyHTTPServer(object):
                 self.wfile.write(json.dumps(clusters).encode())
                 return
 
+            elif self.path == '/metrics':
+                data = self._ctx.metrics()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.end_headers()
+                self.wfile.write(data.encode())
+                return
+
             elif self.path == '/nodes':
                 self._ctx._cluster_lock.acquire()
                 nodes = [
@@ -415,9 +430,12 @@ class DispyHTTPServer(object):
             cluster_info.jobs[job._uid] = job
             self._cluster_lock.release()
         elif (status == DispyJob.Finished or status == DispyJob.Terminated or
-              status == DispyJob.Cancelled or status == DispyJob.Abandoned):
+              status == DispyJob.Cancelled or status == DispyJob.Abandoned or
+              status == DispyJob.TimedOut):
             self._cluster_lock.acquire()
             cluster_info.jobs_done += 1
+            if status != DispyJob.Finished:
+                cluster_info.jobs_failed += 1
             cluster_info.jobs.pop(job._uid, None)
             self._cluster_lock.release()
 
@@ -428,6 +446,82 @@ class DispyHTTPServer(object):
             cluster_info.updates[node.ip_addr] = node
             self._cluster_lock.release()
 
+    def metrics(self):
+        """Returns status of clusters in Prometheus text format (this is
+        served at '/metrics'). Counters are updated by 'cluster_status'
+        as jobs / nodes change status, so this doesn't copy jobs or nodes.
+        """
+        metrics = [
+            ('dispy_jobs_submitted_total', 'counter', 'Jobs scheduled to run on nodes'),
+            ('dispy_jobs_done_total', 'counter',
+             'Jobs finished, terminated, cancelled or abandoned'),
+            ('dispy_jobs_failed_total', 'counter', 'Jobs terminated, cancelled or abandoned'),
+            ('dispy_jobs_running', 'gauge', 'Jobs currently running on nodes'),
+            ('dispy_jobs_queued', 'gauge', 'Jobs waiting to be scheduled'),
+            ('dispy_callback_backlog', 'gauge', 'Callbacks waiting to be called'),
+            ('dispy_node_cpus', 'gauge', 'CPUs of node used by cluster'),
+            ('dispy_node_busy', 'gauge', 'Jobs running on node'),
+            ('dispy_node_jobs_done_total', 'counter', 'Jobs done by node'),
+            ('dispy_node_tx_bytes_total', 'counter', 'Bytes sent to node'),
+            ('dispy_node_rx_bytes_total', 'counter', 'Bytes received from node'),
+            ('dispy_job_stage_seconds', 'summary', 'Latency of stages of jobs'),
+        ]
+        samples = dict((metric[0], []) for metric in metrics)
+
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def add(metric, labels, value, suffix=''):
+            samples[metric].append('%s%s{%s} %s' % (
+                metric, suffix, ','.join('%s="%s"' % (key, label(val)) for key, val in labels),
+                repr(float(value)) if isinstance(value, float) else value))
+
+        job_stats = []
+        self._cluster_lock.acquire()
+        for name, cluster_info in dict_iter(self._clusters, 'items'):
+            labels = [('cluster', name)]
+            add('dispy_jobs_submitted_total', labels, cluster_info.jobs_submitted)
+            add('dispy_jobs_done_total', labels, cluster_info.jobs_done)
+            add('dispy_jobs_failed_total', labels, cluster_info.jobs_failed)
+            add('dispy_jobs_running', labels, len(cluster_info.jobs))
+            cluster = cluster_info.cluster
+            pending = getattr(cluster, '_pending_jobs', getattr(cluster, 'pending_jobs', 0))
+            add('dispy_jobs_queued', labels, max(0, pending - len(cluster_info.jobs)))
+            if cluster_info.worker_Q is not None:
+                add('dispy_callback_backlog', labels, cluster_info.worker_Q.qsize())
+            for ip_addr, node in dict_iter(cluster_info.status, 'items'):
+                node_labels = [('cluster', name), ('node', ip_addr)]
+                add('dispy_node_cpus', node_labels, node.cpus)
+                add('dispy_node_busy', node_labels, node.busy)
+                add('dispy_node_jobs_done_total', node_labels, node.jobs_done)
+                add('dispy_node_tx_bytes_total', node_labels, node.tx)
+                add('dispy_node_rx_bytes_total', node_labels, node.rx)
+            if cluster_info.job_stats:
+                job_stats.append((labels, cluster_info.job_stats))
+        self._cluster_lock.release()
+
+        # percentiles are computed without holding cluster lock (histograms
+        # have their own locks)
+        for labels, stage_stats in job_stats:
+            for stage in stage_stats.Stages:
+                stats = stage_stats.histograms[stage].summary(percentiles=(50, 90, 99))
+                for pct in (50, 90, 99):
+                    add('dispy_job_stage_seconds', labels + [('stage', stage),
+                                                             ('quantile', pct / 100.0)],
+                        stats['p%s' % pct])
+                add('dispy_job_stage_seconds', labels + [('stage', stage)],
+                    stats['total'], suffix='_sum')
+                add('dispy_job_stage_seconds', labels + [('stage', stage)],
+                    stats['count'], suffix='_count')
+
+        lines = []
+        for metric, kind, doc in metrics:
+            lines.append('# HELP %s %s' % (metric, doc))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            lines.extend(samples[metric])
+        lines.append('')
+        return '\n'.join(lines)
+
     def shutdown(self, wait=True):
         """This method should be called by user program to close the
         http server.
@@ -18,11 +18,14 @@ import ssl
 import hashlib
 import traceback
 import shelve
+import tempfile
+import sqlite3
 import datetime
 import atexit
 import functools
 import queue
 import numbers
+import math
 import collections
 import struct
 import errno
@@ -30,6 +33,8 @@ import platform
 import itertools
 import copy
 import types
+import marshal
+import pickle
 try:
     import netifaces
 except ImportError:
@@ -50,7 +55,8 @@ __url__ = "http://dispy.sourceforge.net"
 __status__ = "Production"
 __version__ = "4.11.0"
 
-__all__ = ['logger', 'DispyJob', 'DispyNode', 'NodeAllocate', 'JobCluster', 'SharedJobCluster']
+__all__ = ['logger', 'DispyJob', 'DispyNode', 'NodeAllocate', 'RetryPolicy', 'RemoteResult',
+           'JobCluster', 'SharedJobCluster', 'register_serializer']
 
 _dispy_version = __version__
 logger = pycos.Logger('dispy')
@@ -69,7 +75,10 @@ class DispyJob(object):
     complete. The result of the call (either the return value in case
     of python methods or the exit value in case of programs) will be
     returned; the result is also available as .result member if
-    needed.  In addition, any output, error, exception messages from
+    needed. The result received from node is deserialized only when
+    .result is used first time; .result_bytes gives the result as
+    serialized (e.g., to store or forward it without deserializing
+    it).  In addition, any output, error, exception messages from
     the job will be available as .stdout, .stderr and .exception
     members. The time when the job was submitted for execution on a
     node will be available as .start_time and when the job results
@@ -80,21 +89,33 @@ class DispyJob(object):
     to distinguish one job from another.
 
     .status is read-only field; it is set to one of Created, Running,
-    Finished, Cancelled, Terminated and ProvisionalResult, indicating
-    current status of job.  If job is created for SharedJobCluster,
-    status is not updated to Running when job is actually running.
+    Finished, Cancelled, Terminated, TimedOut and ProvisionalResult,
+    indicating current status of job. TimedOut indicates that node
+    terminated job because it ran longer than its timeout (see
+    'dispy_timeout' in 'submit' and 'job_timeout' in JobCluster).  If
+    job is created for SharedJobCluster, status is not updated to
+    Running when job is actually running.
 
     .ip_addr is read-inly field; it is set to IP address of node that
     executed job.
 
     .finish is a read-only event that is set when a job's results are
-    available.
+    available. The event is created when it is first used, so jobs
+    that are never waited on don't take up memory for it.
+
+    Provisional results sent by job can be iterated with
+    'iter_provisional' method.
+
+    .attempts is a tuple of JobAttempt, one for each earlier attempt to
+    run job that failed and was retried (see RetryPolicy); it is empty
+    if job was not retried.
 
     """
 
-    __slots__ = ('id', 'result', 'stdout', 'stderr', 'exception',
+    __slots__ = ('id', 'stdout', 'stderr', 'exception',
                  'submit_time', 'start_time', 'end_time', 'status',
-                 'ip_addr', 'finish', '_args', '_kwargs', '_dispy_job_', '_uid')
+                 'ip_addr', 'attempts', '_args', '_kwargs', '_dispy_job_', '_uid',
+                 '_provisional', '_result', '_result_bytes', '_finish')
 
     Created = 5
     Running = 6
@@ -108,8 +129,11 @@ class DispyJob(object):
     Terminated = 9
     Abandoned = 10
     Finished = 11
+    TimedOut = 12
 
     id_iter = itertools.count(start=1)
+    # guards creating 'finish' event of jobs
+    _finish_lock = threading.Lock()
 
     def __init__(self, job_id, args, kwargs):
         # id can be assigned by user as appropriate (e.g., to distinguish jobs)
@@ -118,7 +142,9 @@ class DispyJob(object):
         else:
             self.id = next(DispyJob.id_iter)
         # rest are read-only
-        self.result = None
+        self._result = None
+        # serialized result (as received from node), until it is deserialized
+        self._result_bytes = None
         self.stdout = None
         self.stderr = None
         self.exception = None
@@ -127,13 +153,37 @@ class DispyJob(object):
         self.end_time = None
         self.status = DispyJob.Created
         self.ip_addr = None
-        self.finish = threading.Event()
+        self.attempts = ()
 
         # rest are for dispy implementation only - these are opaque to clients
         self._args = args
         self._kwargs = kwargs
         self._dispy_job_ = None
         self._uid = id(self)
+        self._provisional = None
+        # None until job is done or 'finish' is used, then True
+        # (if job is done) or 'finish' event
+        self._finish = None
+
+    @property
+    def finish(self):
+        DispyJob._finish_lock.acquire()
+        event = self._finish
+        if event is None or event is True:
+            self._finish = threading.Event()
+            if event is True:
+                self._finish.set()
+            event = self._finish
+        DispyJob._finish_lock.release()
+        return event
+
+    def _set_finish(self):
+        DispyJob._finish_lock.acquire()
+        if self._finish is None:
+            self._finish = True
+        elif self._finish is not True:
+            self._finish.set()
+        DispyJob._finish_lock.release()
 
     def __call__(self, clear=False):
         self.finish.wait()
@@ -141,6 +191,48 @@ class DispyJob(object):
             self.finish.clear()
         return self.result
 
+    @property
+    def result(self):
+        if self._result_bytes is not None:
+            self._result, self._result_bytes = _Serializer.loads(self._result_bytes), None
+        return self._result
+
+    @result.setter
+    def result(self, value):
+        self._result = value
+        self._result_bytes = None
+
+    @property
+    def result_bytes(self):
+        """Result of job serialized. If result hasn't been used yet,
+        this is as received from node (so it is not deserialized).
+        """
+        if self._result_bytes is not None:
+            return self._result_bytes
+        return serialize(self._result)
+
+    def iter_provisional(self, timeout=None):
+        """Generator that yields provisional results of job (sent with
+        'dispy_provisional_result' or 'dispy_result_stream') as they
+        are received, until job is finished. Only results received
+        after this method is called are yielded. If 'timeout' is not
+        None, iteration stops if no result is received in that many
+        seconds.
+        """
+        if self._provisional is None:
+            self._provisional = queue.Queue()
+        if self.finish.is_set():
+            return
+        while 1:
+            try:
+                item = self._provisional.get(timeout=timeout)
+            except queue.Empty:
+                return
+            if item is None:
+                # job is done
+                return
+            yield _Serializer.loads(item[0])
+
     def __lt__(self, other):
         if isinstance(self._dispy_job_, _DispyJob_):
             if isinstance(other._dispy_job_, _DispyJob_):
@@ -249,6 +341,118 @@ class NodeAllocate(object):
         return 0
 
 
+# 'attempts' of a job retried by RetryPolicy is tuple of these
+JobAttempt = collections.namedtuple('JobAttempt', ['ip_addr', 'status', 'start_time',
+                                                   'end_time', 'exception'])
+
+
+class RetryPolicy(object):
+    """If 'retry' is given to JobCluster, it must be an instance of
+    this class. A job that fails with one of the statuses in
+    'retry_on' is run again, up to 'max_attempts' times in total,
+    avoiding (if possible) the node where it failed. The retried job
+    keeps the same DispyJob object, so no changes are needed to wait
+    for it; earlier attempts are recorded in its 'attempts'. Callbacks
+    are called only for the final attempt.
+
+    @max_attempts is maximum number of times a job is run (including
+    first time).
+
+    @backoff is number of seconds to wait before retrying a job the
+    first time; the wait is doubled with each retry, up to
+    'max_backoff' seconds (if it is not None).
+
+    @retry_on is either a tuple of DispyJob status values or a
+    function that is called with the failed job (with its 'status',
+    'exception' etc. set) and returns True if the job should be
+    retried. Status is DispyJob.Cancelled if the job couldn't be sent
+    to a node, DispyJob.Terminated if it was terminated (e.g., due to
+    an exception) and DispyJob.TimedOut if it ran longer than its
+    timeout.
+
+    This class can be specialized (inherited) to override, for
+    example, 'retry' or 'delay' methods.
+    """
+    def __init__(self, max_attempts=3, backoff=1.0, max_backoff=None,
+                 retry_on=(DispyJob.Cancelled, DispyJob.Terminated, DispyJob.TimedOut)):
+        try:
+            max_attempts = int(max_attempts)
+            assert max_attempts >= 1
+            backoff = float(backoff)
+            assert backoff >= 0
+            if max_backoff is not None:
+                max_backoff = float(max_backoff)
+                assert max_backoff >= 0
+        except Exception:
+            raise Exception('Invalid max_attempts / backoff / max_backoff')
+        if not (callable(retry_on) or isinstance(retry_on, (tuple, list))):
+            raise Exception('"retry_on" must be either tuple of status values or a function')
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+
+    def retry(self, job):
+        """Return True if 'job' that failed should be run again.
+        """
+        if (len(job.attempts) + 1) >= self.max_attempts:
+            return False
+        if callable(self.retry_on):
+            return self.retry_on(job)
+        return job.status in self.retry_on
+
+    def delay(self, attempt):
+        """Return number of seconds to wait before running job again
+        after 'attempt' number of attempts failed.
+        """
+        delay = self.backoff * (2 ** (attempt - 1))
+        if self.max_backoff is not None:
+            delay = min(delay, self.max_backoff)
+        return delay
+
+
+class RemoteResult(object):
+    """Result of a job submitted with 'dispy_keep_result=True' is an
+    instance of this class, instead of the result itself: the result
+    is kept at the node that ran the job (until the computation is
+    closed, or it is removed to make room for newer results) and
+    'fetch' method gets it from that node. If a RemoteResult is passed
+    as an argument to another job (i.e., as one of the arguments, not
+    within other objects), the node running that job fetches the
+    result (directly from the node keeping it) before running the
+    job.
+
+    .ip_addr and .port are address of the node keeping the result and
+    .size is size of the result (serialized) in bytes.
+    """
+
+    def __init__(self, ip_addr, port, key, size):
+        self.ip_addr = ip_addr
+        self.port = port
+        self.size = size
+        # key also authorizes fetching result from node
+        self._key = key
+
+    def fetch(self, keyfile=None, certfile=None, timeout=MsgTimeout):
+        """Get result from node keeping it. If nodes use SSL,
+        'keyfile' and 'certfile' should be given (as for the
+        cluster). Raises exception if result is not available.
+        """
+        sock = socket.socket(socket.getaddrinfo(self.ip_addr, None)[0][0], socket.SOCK_STREAM)
+        sock = AsyncSocket(sock, blocking=True, keyfile=keyfile, certfile=certfile)
+        sock.settimeout(timeout)
+        try:
+            sock.connect((self.ip_addr, self.port))
+            sock.sendall(self._key.encode())
+            sock.send_msg(b'FETCH_RESULT:')
+            data = sock.recv_msg()
+        finally:
+            sock.close()
+        if not data or data == b'NAK':
+            raise Exception('Result is not available at %s' % self.ip_addr)
+        return _Serializer.loads(data)
+
+
 # a cluster's "status" function (not "cluster_status" callback)
 # returns this structure; "nodes" is list of DispyNode objects and
 # "jobs_pending" is number of jobs that are not done yet
@@ -508,6 +712,311 @@ def host_addrinfo(host=None, socket_family=None, ipv4_multicast=False):
     return best
 
 
+class _MsgFrame(object):
+    """Internal use only.
+
+    Message sent over TCP as binary frame: fixed header (magic byte,
+    version, opcode, flags, length of data following header and request
+    id) followed by data. With flag 'Buffers', data is number of buffers
+    and their lengths, followed by the buffers; otherwise data is one
+    buffer. Opcode is index (starting at 1) of message name in
+    'Opcodes'; new messages must only be appended to it. Request id is
+    not used yet (it is 0).
+
+    Only JOB, JOB_REPLY and PULSE messages are sent as frames, and only
+    to peers that announce version of frames they parse (as 'frames' in
+    node's pong, in scheduler's reply to client and in computation);
+    other messages, and messages to peers of earlier versions, are sent
+    in earlier format (name, ':' and data). 'parse' accepts both.
+    """
+
+    Magic = b'\xd7'
+    Version = 1
+    Header = struct.Struct('!cBHHIQ')
+    Buffers = 0x1
+    Opcodes = (b'JOB', b'JOB_REPLY', b'JOB_STATUS', b'JOBS', b'PENDING_JOBS', b'RETRIEVE_JOB',
+               b'RETRIEVE_JOBS', b'RESEND_JOB_RESULTS', b'TERMINATE_JOB', b'COMPUTE', b'SETUP',
+               b'CLOSE', b'FILEXFER', b'SENDFILE', b'PING', b'PONG', b'PULSE', b'TERMINATED',
+               b'NODE_INFO', b'NODE_STATUS', b'NODE_CPUS', b'NODE_JOBS', b'SET_CPUS',
+               b'SERVICE_TIME', b'SERVE_CLIENTS', b'RELAY_INFO', b'CLIENT', b'SCHEDULE',
+               b'SCHEDULED', b'ALLOCATE_NODE', b'DEALLOCATE_NODE', b'CLOSE_NODE',
+               b'SET_NODE_CPUS', b'FETCH_RESULT')
+    Opcode = dict((name, i + 1) for i, name in enumerate(Opcodes))
+
+    __slots__ = ('name', 'buffers', 'req_id', 'flags')
+
+    def __init__(self, name, buffers, req_id=0, flags=0):
+        self.name = name
+        if isinstance(buffers, bytes):
+            buffers = [buffers]
+        self.buffers = buffers
+        self.req_id = req_id
+        self.flags = flags
+
+    @property
+    def payload(self):
+        if self.buffers:
+            return self.buffers[0]
+        return b''
+
+    def pack(self, version=Version):
+        """Returns message to send to peer that parses frames of given
+        'version'; if it is 0, message (with one buffer) is in earlier
+        format.
+        """
+        if not version:
+            return self.name + b':' + self.payload
+        flags = self.flags
+        if len(self.buffers) == 1:
+            flags &= ~_MsgFrame.Buffers
+            data = self.buffers
+        else:
+            flags |= _MsgFrame.Buffers
+            data = [struct.pack('!H%dI' % len(self.buffers), len(self.buffers),
+                                *[len(buf) for buf in self.buffers])]
+            data.extend(self.buffers)
+        header = _MsgFrame.Header.pack(_MsgFrame.Magic, _MsgFrame.Version,
+                                       _MsgFrame.Opcode[self.name], flags,
+                                       sum(len(buf) for buf in data), self.req_id)
+        return b''.join([header] + data)
+
+    @staticmethod
+    def parse(msg):
+        """Returns frame for given message. If message is not valid,
+        name of frame is empty.
+        """
+        if not msg:
+            return _MsgFrame(b'', [b''])
+        if msg[:1] != _MsgFrame.Magic:
+            i = msg.find(b':')
+            if i < 0:
+                return _MsgFrame(msg, [b''])
+            return _MsgFrame(msg[:i], [msg[i+1:]])
+        try:
+            _, version, opcode, flags, length, req_id = _MsgFrame.Header.unpack_from(msg)
+            assert version == _MsgFrame.Version
+            assert 0 < opcode <= len(_MsgFrame.Opcodes)
+            offset = _MsgFrame.Header.size
+            assert len(msg) == offset + length
+            if flags & _MsgFrame.Buffers:
+                n, = struct.unpack_from('!H', msg, offset)
+                sizes = struct.unpack_from('!%dI' % n, msg, offset + 2)
+                offset += 2 + 4 * n
+                buffers = []
+                for size in sizes:
+                    buffers.append(msg[offset:offset + size])
+                    offset += size
+                assert offset == len(msg)
+            else:
+                buffers = [msg[offset:]]
+        except Exception:
+            return _MsgFrame(b'', [msg])
+        return _MsgFrame(_MsgFrame.Opcodes[opcode - 1], buffers, req_id=req_id, flags=flags)
+
+
+class _Serializer(object):
+    """Internal use only.
+
+    Serializers for job arguments and results (see
+    'register_serializer'). Data serialized with a serializer other than
+    'pickle' is prefixed with Tag, length of serializer's name and the
+    name, so 'loads' can find the serializer; data without the prefix is
+    pickle (with pycos 'serialize'), as in earlier versions.
+    """
+
+    Tag = b'\x00'
+    registry = {'pickle': (serialize, deserialize)}
+
+    @staticmethod
+    def dumps(obj, name='pickle'):
+        if name != 'pickle':
+            try:
+                data = _Serializer.registry[name][0](obj)
+            except Exception:
+                # e.g., marshal can't serialize instances of classes
+                pass
+            else:
+                name = name.encode()
+                return b''.join((_Serializer.Tag, struct.pack('!B', len(name)), name, data))
+        return serialize(obj)
+
+    @staticmethod
+    def loads(data):
+        if data[:1] == _Serializer.Tag:
+            n = struct.unpack_from('!B', data, 1)[0]
+            name = data[2:2 + n].decode()
+            return _Serializer.registry[name][1](data[2 + n:])
+        return deserialize(data)
+
+
+def register_serializer(name, dumps, loads):
+    """Register serializer 'name' that can be used with 'serializer'
+    option of JobCluster to serialize job arguments and results.
+    'dumps' is called with an object and must return bytes; 'loads' is
+    called with those bytes and must return the object. If 'dumps' fails
+    for an object, it is serialized with pickle instead.
+
+    The serializer must be registered on nodes as well (e.g., in a
+    module imported by dispynode); nodes that don't have the serializer
+    decline the computation.
+    """
+    if not isinstance(name, str) or not (0 < len(name) < 256):
+        raise Exception('Invalid serializer name: %s' % name)
+    if not callable(dumps) or not callable(loads):
+        raise Exception('"dumps" and "loads" must be functions')
+    _Serializer.registry[name] = (dumps, loads)
+
+
+register_serializer('marshal', marshal.dumps, marshal.loads)
+if pickle.HIGHEST_PROTOCOL >= 5:
+    register_serializer('pickle5', functools.partial(pickle.dumps, protocol=5), pickle.loads)
+
+
+# PULSE messages are sent periodically by nodes, so they are encoded with
+# struct: port, number of busy CPUs, whether availability info is given and
+# the info, followed by node's and scheduler's IP addresses as buffers
+_PulseStruct = struct.Struct('!IIBdQQd')
+
+
+def _pack_pulse(info, version=_MsgFrame.Version):
+    if not version:
+        return b'PULSE:' + serialize(info)
+    avail_info = info['avail_info']
+    if avail_info:
+        fields = (1, avail_info.cpu, int(avail_info.memory), int(avail_info.disk),
+                  avail_info.swap)
+    else:
+        fields = (0, 0.0, 0, 0, 0.0)
+    data = _PulseStruct.pack(info['port'], info['cpus'], *fields)
+    return _MsgFrame(b'PULSE', [data, info['ip_addr'].encode(),
+                                info['scheduler_ip_addr'].encode()]).pack()
+
+
+def _unpack_pulse(frame):
+    if len(frame.buffers) != 3:
+        # sent as dictionary by earlier versions
+        return deserialize(frame.payload)
+    port, cpus, avail, cpu, memory, disk, swap = _PulseStruct.unpack(frame.buffers[0])
+    if avail:
+        avail_info = DispyNodeAvailInfo(cpu, memory, disk, swap)
+    else:
+        avail_info = None
+    return {'ip_addr': frame.buffers[1].decode(), 'port': port, 'cpus': cpus,
+            'scheduler_ip_addr': frame.buffers[2].decode(), 'avail_info': avail_info}
+
+
+class _TLSSessions(object):
+    """Internal use only.
+
+    With 'certfile', pycos does full TLS handshake (key exchange and
+    certificate verification) for every connection. This class keeps TLS
+    session of last connection to each peer so next connection to that peer
+    resumes it, which needs only symmetric crypto. TCP connection is made
+    asynchronously, but handshake with 'ssl' module is blocking, so it is
+    done in threads.
+
+    With TLS 1.3, resumed handshake still does key exchange and session can
+    be resumed only after server has sent ticket. If
+    'dispy.config.TLSSessionReuseV12' is True, connections are limited to TLS
+    1.2 to avoid that; this is a downgrade, so it is not done by default.
+    """
+
+    Threads = 4
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, keyfile, certfile):
+        self.keyfile = keyfile
+        self.certfile = certfile
+        # verify server as pycos does (with 'certfile' as CA certificates)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_REQUIRED
+        self.context.load_verify_locations(cafile=certfile)
+        if dispy.config.TLSSessionReuseV12 and hasattr(ssl, 'TLSVersion'):
+            self.context.maximum_version = ssl.TLSVersion.TLSv1_2
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        self.thread_pool = None
+
+    @staticmethod
+    def get(keyfile, certfile):
+        """Returns instance for given files or None if sessions can't be resumed.
+        """
+        if not certfile or not dispy.config.TLSSessionReuse or \
+           not hasattr(ssl, 'SSLSession'):
+            return None
+        _TLSSessions._lock.acquire()
+        tls = _TLSSessions._instances.get((keyfile, certfile), None)
+        if not tls:
+            try:
+                tls = _TLSSessions(keyfile, certfile)
+            except Exception:
+                logger.warning('TLS sessions are not resumed: %s', traceback.format_exc())
+                tls = False
+            _TLSSessions._instances[(keyfile, certfile)] = tls
+        _TLSSessions._lock.release()
+        return tls if tls else None
+
+    def _handshake(self, sock, addr, timeout):
+        sock.settimeout(timeout)
+        try:
+            self.sessions_lock.acquire()
+            session = self.sessions.get(addr, None)
+            self.sessions_lock.release()
+            # if server doesn't accept session, full handshake is done
+            sock = self.context.wrap_socket(sock, session=session)
+        except Exception:
+            sock.close()
+            raise
+        if not sock.session_reused:
+            self.sessions_lock.acquire()
+            self.sessions[addr] = sock.session
+            self.sessions_lock.release()
+        return sock
+
+    def connect(self, addr, family, timeout=MsgTimeout, task=None):
+        # generator
+        if not self.thread_pool:
+            self.thread_pool = pycos.AsyncThreadPool(_TLSSessions.Threads)
+        # connect without blocking a thread, so unreachable peers don't
+        # delay connections to other peers
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        conn = AsyncSocket(sock)
+        conn.settimeout(timeout)
+        try:
+            yield conn.connect(addr)
+        except Exception:
+            conn.close()
+            raise
+        # 'conn' is not used anymore; its socket is given to thread for handshake
+        conn.setblocking(True)
+        sock = yield self.thread_pool.async_task(self._handshake, sock, addr, timeout)
+        sock = AsyncSocket(sock, keyfile=self.keyfile, certfile=self.certfile)
+        sock.settimeout(timeout)
+        raise StopIteration(sock)
+
+
+def _connect(addr, family, keyfile=None, certfile=None, timeout=MsgTimeout, task=None):
+    # generator
+    """Returns AsyncSocket connected to 'addr'; with 'certfile', TLS session of
+    earlier connection to 'addr' is resumed (if possible).
+    """
+    tls = _TLSSessions.get(keyfile, certfile)
+    if tls:
+        sock = yield tls.connect(addr, family, timeout)
+        raise StopIteration(sock)
+    sock = AsyncSocket(socket.socket(family, socket.SOCK_STREAM),
+                       keyfile=keyfile, certfile=certfile)
+    sock.settimeout(timeout)
+    try:
+        yield sock.connect(addr)
+    except Exception:
+        sock.close()
+        raise
+    raise StopIteration(sock)
+
+
 class _Compute(object):
     """Internal use only.
     """
@@ -534,6 +1043,12 @@ class _Compute(object):
         self.job_result_port = None
         self.pulse_interval = None
         self.client_reply_addr = None
+        self.jobs_per_cpu = 1
+        self.execution = 'process'
+        self.job_timeout = None
+        self.serializer = 'pickle'
+        # version of frames parsed by client (and scheduler) getting replies
+        self.frames = _MsgFrame.Version
 
 
 class _XferFile(object):
@@ -567,12 +1082,63 @@ class _XferFile(object):
         self.sep = os.sep
 
 
+class _PhiAccrual(object):
+    """Internal use only.
+
+    Phi accrual failure detector: intervals between pulses from a node are
+    kept and 'phi' is suspicion that node has failed, given time since it
+    was last heard from, as -log10 of probability that it would be heard
+    from even later (with intervals assumed to be normally distributed).
+    Suspicion grows slower for nodes whose pulses vary more (e.g., when
+    they are loaded).
+    """
+
+    __slots__ = ['intervals', 'last']
+
+    Window = 100
+    # with fewer intervals than this, nodes are suspected with fixed timeout
+    MinSamples = 3
+    # nodes with 'phi' at least this are suspected; 8 is chance of 1e-8
+    # that node is wrongly suspected
+    Threshold = 8.0
+
+    def __init__(self):
+        self.intervals = collections.deque(maxlen=_PhiAccrual.Window)
+        self.last = None
+
+    def pulse(self, now, pulse_interval=None):
+        if self.last is not None:
+            interval = now - self.last
+            if pulse_interval and interval > (5 * pulse_interval):
+                # pulses stopped for a while (e.g., node was suspended), so
+                # earlier intervals are not used
+                self.intervals.clear()
+            else:
+                self.intervals.append(interval)
+        self.last = now
+
+    def phi(self, elapsed):
+        n = len(self.intervals)
+        if n < _PhiAccrual.MinSamples:
+            return None
+        mean = sum(self.intervals) / float(n)
+        var = sum((interval - mean) ** 2 for interval in self.intervals) / n
+        # pulses are periodic, so deviation is kept at least quarter of
+        # interval to not suspect nodes for small delays
+        dev = max(math.sqrt(var), mean / 4.0, 1e-3)
+        prob = 0.5 * math.erfc((elapsed - mean) / (dev * math.sqrt(2)))
+        if prob < 1e-300:
+            return float('inf')
+        return -math.log10(prob)
+
+
 class _Node(object):
     """Internal use only.
     """
     __slots__ = ['ip_addr', 'port', 'name', 'cpus', 'avail_cpus', 'busy', 'cpu_time', 'clusters',
                  'auth', 'secret', 'keyfile', 'certfile', 'last_pulse', 'scheduler_ip_addr',
-                 'pending_jobs', 'avail_info', 'platform', 'sock_family', 'tx', 'rx']
+                 'pending_jobs', 'avail_info', 'platform', 'sock_family', 'tx', 'rx',
+                 'pulses', 'probing', 'frames']
 
     def __init__(self, ip_addr, port, cpus, sign, secret, platform='',
                  keyfile=None, certfile=None):
@@ -599,6 +1165,47 @@ class _Node(object):
         self.platform = platform
         self.tx = 0
         self.rx = 0
+        self.pulses = _PhiAccrual()
+        self.probing = False
+        # version of frames parsed by node; 0 if it is of earlier version
+        self.frames = 0
+
+    def suspected(self, now, pulse_interval):
+        """Returns True if node has not been heard from for long enough to
+        suspect that it has failed.
+        """
+        if self.last_pulse is None:
+            return False
+        phi = self.pulses.phi(now - self.last_pulse)
+        if phi is None:
+            # not enough pulses yet to estimate their intervals
+            return (self.last_pulse + (5 * pulse_interval)) <= now
+        return phi >= _PhiAccrual.Threshold
+
+    def probe(self, task=None):
+        # generator
+        """Returns True if node responds to (lightweight) status request.
+        """
+        try:
+            resp = yield self.send(b'NODE_STATUS:', timeout=MsgTimeout, task=task)
+        except Exception:
+            resp = None
+        if resp:
+            self.last_pulse = time.time()
+            raise StopIteration(True)
+        raise StopIteration(False)
+
+    def job_slots(self, cluster=None):
+        """Number of jobs that can run on this node at the same time;
+        computations may run more than one job per CPU (see
+        'jobs_per_cpu' of JobCluster). With 'cluster', number of jobs of
+        that cluster.
+        """
+        if cluster is not None:
+            return self.cpus * cluster._compute.jobs_per_cpu
+        if self.clusters:
+            return self.cpus * max(cluster._compute.jobs_per_cpu for cluster in self.clusters)
+        return self.cpus
 
     def setup(self, depends, setup_args, compute, exclusive=True, task=None):
         # generator
@@ -662,11 +1269,10 @@ class _Node(object):
 
     def send(self, msg, reply=True, timeout=MsgTimeout, task=None):
         # generator
-        sock = socket.socket(self.sock_family, socket.SOCK_STREAM)
-        sock = AsyncSocket(sock, keyfile=self.keyfile, certfile=self.certfile)
-        sock.settimeout(timeout)
+        sock = None
         try:
-            yield sock.connect((self.ip_addr, self.port))
+            sock = yield _connect((self.ip_addr, self.port), self.sock_family,
+                                  self.keyfile, self.certfile, timeout)
             yield sock.sendall(self.auth)
             yield sock.send_msg(msg)
             if reply:
@@ -679,7 +1285,8 @@ class _Node(object):
             # TODO: mark this node down, reschedule on different node?
             raise
         finally:
-            sock.close()
+            if sock is not None:
+                sock.close()
 
         if resp == b'ACK':
             resp = len(msg)
@@ -688,11 +1295,10 @@ class _Node(object):
 
     def xfer_file(self, xf, task=None):
         # generator
-        sock = socket.socket(self.sock_family, socket.SOCK_STREAM)
-        sock = AsyncSocket(sock, keyfile=self.keyfile, certfile=self.certfile)
-        sock.settimeout(MsgTimeout)
+        sock = None
         try:
-            yield sock.connect((self.ip_addr, self.port))
+            sock = yield _connect((self.ip_addr, self.port), self.sock_family,
+                                  self.keyfile, self.certfile)
             yield sock.sendall(self.auth)
             yield sock.send_msg(b'FILEXFER:' + serialize(xf))
             recvd = yield sock.recv_msg()
@@ -717,7 +1323,8 @@ class _Node(object):
             # TODO: mark this node down, reschedule on different node?
             resp = -1
         finally:
-            sock.close()
+            if sock is not None:
+                sock.close()
         raise StopIteration(resp)
 
     def close(self, compute, terminate_pending=False, task=None):
@@ -739,10 +1346,19 @@ class _DispyJob_(object):
     """
 
     __slots__ = ('job', 'uid', 'compute_id', 'hash', 'node', 'pinned',
-                 'xfer_files', '_args', '_kwargs', 'code')
+                 'xfer_files', '_args', '_kwargs', 'code', 'memo_key',
+                 'dispatch_time', 'sent_time', 'batch', 'timeout', 'avoid', 'keep_result')
 
     def __init__(self, compute_id, job_id, args, kwargs):
         job_deps = kwargs.pop('dispy_job_depends', [])
+        timeout = kwargs.pop('dispy_timeout', None)
+        keep_result = kwargs.pop('dispy_keep_result', False)
+        if timeout is not None:
+            try:
+                timeout = float(timeout)
+                assert timeout > 0
+            except Exception:
+                raise Exception('Invalid dispy_timeout; must be a positive number')
         self.job = DispyJob(job_id, args, kwargs)
         self.job._dispy_job_ = self
         self._args = self.job._args
@@ -754,6 +1370,17 @@ class _DispyJob_(object):
         self.pinned = None
         self.xfer_files = []
         self.code = ''
+        self.memo_key = None
+        self.dispatch_time = None
+        self.sent_time = None
+        # jobs (instances of DispyJob) run by this job with 'submit_batch'
+        self.batch = None
+        # if not None, node terminates job if it runs longer than this many seconds
+        self.timeout = timeout
+        # IP addresses of nodes where job failed (when retried)
+        self.avoid = None
+        # if True, node keeps result and sends RemoteResult instead
+        self.keep_result = bool(keep_result)
         for dep in job_deps:
             if isinstance(dep, str) or inspect.ismodule(dep):
                 self.xfer_files.append(_XferFile(dep, compute_id))
@@ -778,10 +1405,21 @@ class _DispyJob_(object):
                  '_args': self._args if isinstance(self._args, bytes) else serialize(self._args),
                  '_kwargs': self._kwargs if isinstance(self._kwargs, bytes)
                                          else serialize(self._kwargs),
-                 'xfer_files': self.xfer_files, 'code': self.code}
+                 'xfer_files': self.xfer_files, 'code': self.code, 'batch': bool(self.batch),
+                 'timeout': self.timeout, 'keep_result': self.keep_result}
         return state
 
+    def serialize_args(self, serializer='pickle'):
+        """Serialize arguments (in user's thread, when job is
+        submitted), so scheduler only sends bytes when running job.
+        """
+        if not isinstance(self._args, bytes):
+            self._args = _Serializer.dumps(self._args, serializer)
+        if not isinstance(self._kwargs, bytes):
+            self._kwargs = _Serializer.dumps(self._kwargs, serializer)
+
     def __setstate__(self, state):
+        self.dispatch_time = self.sent_time = self.avoid = None
         for k, v in state.items():
             setattr(self, k, v)
 
@@ -802,7 +1440,8 @@ class _DispyJob_(object):
                 logger.warning('Transfer of file "%s" to %s failed', xf.name, self.node.ip_addr)
                 raise Exception(-1)
             tx += sent
-        resp = yield self.node.send(b'JOB:' + serialize(self), task=task)
+        resp = yield self.node.send(_MsgFrame(b'JOB', serialize(self)).pack(self.node.frames),
+                                    task=task)
         # TODO: deal with NAKs (reschedule?)
         if isinstance(resp, int) and resp >= 0:
             tx += resp
@@ -819,7 +1458,38 @@ class _DispyJob_(object):
             job._kwargs = {}
             self.job._dispy_job_ = None
             self.job = None
-        job.finish.set()
+        job._set_finish()
+        if status != DispyJob.ProvisionalResult and job._provisional is not None:
+            job._provisional.put(None)
+
+    def finish_batch(self, job):
+        """Set status, result etc. of jobs in batch from 'job' that ran
+        them and return them.
+        """
+        jobs, self.batch = self.batch, None
+        results = job.result
+        if (job.status == DispyJob.Finished and isinstance(results, list) and
+            len(results) == len(jobs)):
+            for batch_job, result in zip(jobs, results):
+                (batch_job.status, batch_job.result, batch_job.exception, batch_job.stdout,
+                 batch_job.stderr, batch_job.start_time, batch_job.end_time) = result
+        else:
+            for batch_job in jobs:
+                batch_job.status = job.status
+                batch_job.exception = job.exception
+                batch_job.stdout = job.stdout
+                batch_job.stderr = job.stderr
+                batch_job.start_time = job.start_time
+                batch_job.end_time = job.end_time
+        for batch_job in jobs:
+            batch_job.ip_addr = job.ip_addr
+            batch_job._args = ()
+            batch_job._kwargs = {}
+            batch_job._dispy_job_ = None
+            batch_job._set_finish()
+            if batch_job._provisional is not None:
+                batch_job._provisional.put(None)
+        return jobs
 
 
 class _JobReply(object):
@@ -835,13 +1505,727 @@ class _JobReply(object):
         self.stderr = None
         self.exception = None
         self.start_time = 0
+        self.exec_start_time = 0
         self.end_time = 0
 
 
+class _LatencyHistogram(object):
+    """Internal use only.
+
+    Histogram of latencies (in seconds), in the style of HDR
+    histograms: values are kept (in microseconds) in buckets that are
+    at most 1/64 of value wide, so percentiles are within ~1.6% of
+    actual values and memory used doesn't depend on number of values.
+    Values are added by scheduler and callback threads and summaries
+    may be computed in other threads (e.g., httpd), so these are done
+    under lock.
+    """
+
+    SigBits = 7
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        if value < 0:
+            value = 0.0
+        usec = int(value * 1e6)
+        shift = usec.bit_length() - _LatencyHistogram.SigBits
+        if shift > 0:
+            usec = (usec >> shift) << shift
+        with self._lock:
+            self.buckets[usec] = self.buckets.get(usec, 0) + 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def summary(self, percentiles=(50, 99)):
+        """Returns dictionary with 'count', 'total', 'mean', 'max' and
+        'p<N>' for each of given percentiles (values in seconds).
+        """
+        with self._lock:
+            count, total, max_value = self.count, self.total, self.max
+            buckets = list(self.buckets.items())
+        info = {'count': count, 'total': total, 'mean': 0.0, 'max': max_value}
+        for pct in percentiles:
+            info['p%s' % pct] = 0.0
+        if not count:
+            return info
+        info['mean'] = total / count
+        targets = [(pct, max(1, (count * pct + 99) // 100)) for pct in percentiles]
+        n = 0
+        for usec, usec_count in sorted(buckets):
+            n += usec_count
+            while targets and n >= targets[0][1]:
+                info['p%s' % targets.pop(0)[0]] = min(usec / 1e6, max_value)
+            if not targets:
+                break
+        return info
+
+
+class _JobStats(object):
+    """Internal use only.
+
+    Latency histograms for stages of jobs: 'queue' (waiting to be
+    scheduled), 'send' (transferring files and job to node),
+    'node_queue' (at node before computation starts), 'execute',
+    'reply' (transferring job to node and result back, not counting
+    time at node), 'callback' (waiting for callback to be called) and
+    'total' (from submission until result is received). Durations at
+    node are computed with node's clock and others with local clock,
+    so clocks don't need to be synchronized.
+    """
+
+    Stages = ('queue', 'send', 'node_queue', 'execute', 'reply', 'callback', 'total')
+
+    def __init__(self):
+        self.histograms = dict((stage, _LatencyHistogram()) for stage in _JobStats.Stages)
+
+    def add(self, stage, value):
+        self.histograms[stage].add(value)
+
+    def job_sent(self, _job, submit_time):
+        self.histograms['queue'].add(_job.dispatch_time - submit_time)
+        self.histograms['send'].add(_job.sent_time - _job.dispatch_time)
+
+    def job_done(self, _job, submit_time, reply):
+        now = time.time()
+        exec_start_time = getattr(reply, 'exec_start_time', 0) or reply.start_time
+        self.histograms['node_queue'].add(exec_start_time - reply.start_time)
+        self.histograms['execute'].add(reply.end_time - exec_start_time)
+        if _job.sent_time:
+            self.histograms['reply'].add((now - _job.sent_time) -
+                                         (reply.end_time - reply.start_time))
+        if submit_time:
+            self.histograms['total'].add(now - submit_time)
+
+    def summary(self):
+        return dict((stage, histogram.summary())
+                    for stage, histogram in self.histograms.items())
+
+    def print_stats(self):
+        info = self.summary()
+        if not any(info[stage]['count'] for stage in _JobStats.Stages):
+            return
+        heading = ' %10s | %8s | %10s | %10s | %10s | %10s' % \
+                  ('Stage', 'Jobs', 'Mean ms', 'p50 ms', 'p99 ms', 'Max ms')
+        print(heading)
+        print('-' * len(heading))
+        for stage in _JobStats.Stages:
+            stats = info[stage]
+            if not stats['count']:
+                continue
+            print(' %10s | %8s | %10.2f | %10.2f | %10.2f | %10.2f' %
+                  (stage, stats['count'], 1000 * stats['mean'], 1000 * stats['p50'],
+                   1000 * stats['p99'], 1000 * stats['max']))
+        print('')
+
+
+class _RecoverStore(object):
+    """Internal use only.
+
+    Information needed to recover jobs (see 'recover_jobs') is stored
+    in SQLite database (in WAL mode). Entries are updated
+    incrementally, so saving information about a node doesn't depend
+    on number of nodes already saved. A recover file created (with
+    'shelve') by earlier versions is converted when opened.
+    """
+
+    file_exts = ('', '-wal', '-shm', '.db', '.bak', '.dat', '.dir')
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if _RecoverStore.is_legacy(path):
+            self._migrate()
+        self._db = self._connect(path)
+
+    @staticmethod
+    def is_legacy(path):
+        for ext in ('.db', '.dat', '.dir'):
+            if os.path.isfile(path + ext):
+                return True
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as fd:
+                return fd.read(16) != b'SQLite format 3\x00'
+        return False
+
+    @staticmethod
+    def _connect(path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS cluster (key TEXT PRIMARY KEY, value BLOB)')
+        db.execute('CREATE TABLE IF NOT EXISTS computes (id INTEGER PRIMARY KEY, value BLOB)')
+        db.execute('CREATE TABLE IF NOT EXISTS nodes (ip_addr TEXT PRIMARY KEY, value BLOB)')
+        db.execute('CREATE TABLE IF NOT EXISTS compute_nodes (compute_id INTEGER, ip_addr TEXT, '
+                   'PRIMARY KEY (compute_id, ip_addr))')
+        db.commit()
+        return db
+
+    def _migrate(self):
+        # convert recover file created with 'shelve'; new database is
+        # created in temporary file first so information is not lost
+        # if conversion fails
+        logger.info('Converting recover file "%s"', self.path)
+        shelf = shelve.open(self.path, flag='r')
+        items = dict(shelf.items())
+        shelf.close()
+        tmp_path = self.path + '.tmp'
+        _RecoverStore.remove_files(tmp_path)
+        self._db = _RecoverStore._connect(tmp_path)
+        for key, val in items.items():
+            if key.startswith('node_'):
+                self.set_node(key[len('node_'):], val)
+            elif key.startswith('compute_'):
+                cid = int(key[len('compute_'):])
+                self.set_compute(cid, val)
+                for ip_addr in val.get('nodes', []):
+                    self.add_compute_node(cid, ip_addr)
+            elif key == '_cluster':
+                self.set_cluster(val)
+            else:
+                logger.warning('Invalid key "%s" ignored', key)
+        self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self._db.close()
+        for ext in ('', '.db', '.bak', '.dat', '.dir'):
+            if os.path.isfile(self.path + ext):
+                os.remove(self.path + ext)
+        os.rename(tmp_path, self.path)
+        _RecoverStore.remove_files(tmp_path)
+
+    def _execute(self, stmt, params=()):
+        with self._lock:
+            self._db.execute(stmt, params)
+            self._db.commit()
+
+    def set_cluster(self, info):
+        self._execute('INSERT OR REPLACE INTO cluster VALUES (?, ?)',
+                      ('_cluster', sqlite3.Binary(serialize(info))))
+
+    def cluster(self):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM cluster WHERE key=?',
+                                   ('_cluster',)).fetchone()
+        if row:
+            return deserialize(bytes(row[0]))
+        return None
+
+    def set_compute(self, compute_id, info):
+        info = {'name': info['name'], 'auth': info['auth']}
+        self._execute('INSERT OR REPLACE INTO computes VALUES (?, ?)',
+                      (compute_id, sqlite3.Binary(serialize(info))))
+
+    def del_compute(self, compute_id):
+        with self._lock:
+            self._db.execute('DELETE FROM computes WHERE id=?', (compute_id,))
+            self._db.execute('DELETE FROM compute_nodes WHERE compute_id=?', (compute_id,))
+            self._db.commit()
+
+    def set_node(self, ip_addr, info):
+        self._execute('INSERT OR REPLACE INTO nodes VALUES (?, ?)',
+                      (ip_addr, sqlite3.Binary(serialize(info))))
+
+    def del_node(self, ip_addr):
+        with self._lock:
+            self._db.execute('DELETE FROM nodes WHERE ip_addr=?', (ip_addr,))
+            self._db.execute('DELETE FROM compute_nodes WHERE ip_addr=?', (ip_addr,))
+            self._db.commit()
+
+    def add_compute_node(self, compute_id, ip_addr):
+        self._execute('INSERT OR REPLACE INTO compute_nodes VALUES (?, ?)',
+                      (compute_id, ip_addr))
+
+    def load(self):
+        """Returns tuple (cluster, computes, nodes), where 'computes'
+        is dictionary with compute id as key and dictionary with
+        'name', 'auth' and 'nodes' as value, and 'nodes' is
+        dictionary with IP address as key and dictionary with 'port',
+        'auth' (and 'scheduler', if node is scheduler) as value.
+        """
+        computes = {}
+        nodes = {}
+        with self._lock:
+            for cid, value in self._db.execute('SELECT id, value FROM computes'):
+                computes[cid] = deserialize(bytes(value))
+                computes[cid]['nodes'] = []
+            for cid, ip_addr in self._db.execute('SELECT compute_id, ip_addr FROM compute_nodes'):
+                if cid in computes:
+                    computes[cid]['nodes'].append(ip_addr)
+            for ip_addr, value in self._db.execute('SELECT ip_addr, value FROM nodes'):
+                nodes[ip_addr] = deserialize(bytes(value))
+        return (self.cluster(), computes, nodes)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def remove_files(path):
+        for ext in _RecoverStore.file_exts:
+            if os.path.isfile(path + ext):
+                try:
+                    os.remove(path + ext)
+                except Exception:
+                    pass
+
+
+class _ResultCache(object):
+    """Internal use only.
+
+    Persistent cache of job results, keyed by digest of computation and
+    job arguments. At most 'max_size' results are kept (least recently
+    used results are evicted first) and, if 'ttl' is given, results
+    older than 'ttl' seconds are discarded.
+    """
+
+    def __init__(self, path, max_size=1000, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._shelf = shelve.open(path, flag='c')
+        self._lru = collections.OrderedDict()
+        now = time.time()
+        entries = []
+        for key in list(self._shelf.keys()):
+            try:
+                entry = self._shelf[key]
+                assert not self.ttl or (now - entry['ctime']) <= self.ttl
+            except Exception:
+                del self._shelf[key]
+                continue
+            entries.append((entry['atime'], key))
+        for atime, key in sorted(entries):
+            self._lru[key] = atime
+        self._evict()
+
+    def key(self, compute, _job):
+        files = [(xf.name, xf.stat_buf.st_size, xf.stat_buf.st_mtime)
+                 for xf in compute.xfer_files + _job.xfer_files]
+        digest = serialize((compute.type, compute.name, compute.code, _job.code, files,
+                            _job._args, sorted(_job._kwargs.items())))
+        return hashlib.sha1(digest).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if self._shelf is None or key not in self._lru:
+                return None
+            entry = self._shelf.get(key, None)
+            now = time.time()
+            if entry is None or (self.ttl and (now - entry['ctime']) > self.ttl):
+                self._lru.pop(key, None)
+                self._shelf.pop(key, None)
+                return None
+            entry['atime'] = now
+            self._shelf[key] = entry
+            self._lru.pop(key)
+            self._lru[key] = now
+            self.hits += 1
+            return entry
+
+    def put(self, key, result, stdout, stderr):
+        with self._lock:
+            if self._shelf is None:
+                return
+            now = time.time()
+            self._shelf[key] = {'result': result, 'stdout': stdout, 'stderr': stderr,
+                                'ctime': now, 'atime': now}
+            self._lru.pop(key, None)
+            self._lru[key] = now
+            self._evict()
+
+    def _evict(self):
+        while len(self._lru) > self.max_size:
+            key, _ = self._lru.popitem(last=False)
+            self._shelf.pop(key, None)
+
+    def __len__(self):
+        return len(self._lru)
+
+    def close(self):
+        with self._lock:
+            if self._shelf is not None:
+                self._shelf.close()
+                self._shelf = None
+
+
+class _JobQueue(object):
+    """Internal use only.
+
+    Queue of jobs waiting to be scheduled (used for cluster's '_jobs').
+    If 'max_memory' is not None, serialized arguments of jobs queued
+    beyond that many bytes are written to segment files in a temporary
+    directory and read back (in order) before jobs taken off the queue
+    are dispatched. A segment file is removed when all jobs in it are
+    taken off. Files are written with 'spill' (in user's thread, after
+    jobs are submitted) and read with 'load' (in result pool), so
+    scheduler doesn't wait for disk.
+    """
+
+    SegmentSize = 64 * 1024 * 1024
+
+    def __init__(self, max_memory=None, path=None):
+        self.max_memory = max_memory
+        self.path = path
+        self.memory = 0
+        self._tmp_path = None
+        self._jobs = collections.deque()
+        # jobs to be written by 'spill', indexed by uid
+        self._to_spill = {}
+        # jobs being written by 'spill', indexed by uid
+        self._spilling = {}
+        # uid -> (segment, offset, length of args, length of kwargs)
+        self._spilled = {}
+        # segment -> number of jobs spilled in it
+        self._segments = {}
+        self._segment = 0
+        self._write_fd = None
+        self._read_fd = None
+        self._read_segment = None
+        # paths of segment files with no jobs left, to be removed
+        self._drained = []
+        # '_lock' guards queue (held briefly); '_io_lock' guards files
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+
+    def append(self, _job):
+        with self._lock:
+            self._add(_job)
+            self._jobs.append(_job)
+
+    def appendleft(self, _job):
+        with self._lock:
+            self._add(_job)
+            self._jobs.appendleft(_job)
+
+    def popleft(self):
+        with self._lock:
+            _job = self._jobs.popleft()
+            self._discard(_job)
+        return _job
+
+    def remove(self, _job):
+        with self._lock:
+            self._jobs.remove(_job)
+            self._discard(_job)
+            info = self._spilled.pop(_job.uid, None)
+            if info:
+                self._release(info[0])
+
+    def spilled(self, _job):
+        """Returns True if arguments of '_job' are (to be) saved in file;
+        after job is taken off the queue, they must be read back with
+        'load'.
+        """
+        uid = _job.uid
+        return uid in self._spilled or uid in self._to_spill or uid in self._spilling
+
+    def spill(self):
+        """Write arguments of jobs queued beyond 'max_memory' to file.
+        """
+        if not self._to_spill:
+            return
+        with self._io_lock:
+            with self._lock:
+                jobs = list(self._to_spill.values())
+                self._spilling.update(self._to_spill)
+                self._to_spill.clear()
+            for _job in jobs:
+                try:
+                    if not self._write_fd or self._write_fd.tell() >= self.SegmentSize:
+                        if self._write_fd:
+                            self._write_fd.close()
+                            self._write_fd = None
+                        if not self.path:
+                            self.path = self._tmp_path = tempfile.mkdtemp(prefix='dispy_pending_')
+                        elif not os.path.isdir(self.path):
+                            os.makedirs(self.path)
+                        fd = open(os.path.join(self.path, str(self._segment + 1)), 'wb')
+                        with self._lock:
+                            if self._segments.get(self._segment, None) == 0:
+                                del self._segments[self._segment]
+                                self._drained.append(self._segment)
+                            self._segment += 1
+                            self._segments[self._segment] = 0
+                            self._write_fd = fd
+                    offset = self._write_fd.tell()
+                    self._write_fd.write(_job._args)
+                    self._write_fd.write(_job._kwargs)
+                except Exception:
+                    logger.warning('Could not save pending job %s to "%s"; keeping it in memory',
+                                   _job.uid, self.path)
+                    logger.debug(traceback.format_exc())
+                    with self._lock:
+                        if self._spilling.pop(_job.uid, None):
+                            self.memory += self._size(_job)
+                    continue
+                with self._lock:
+                    # job may have been taken off the queue while being written
+                    if self._spilling.pop(_job.uid, None):
+                        self._spilled[_job.uid] = (self._segment, offset, len(_job._args),
+                                                   len(_job._kwargs))
+                        self._segments[self._segment] += 1
+                        _job._args = _job._kwargs = None
+            self._remove_segments()
+
+    def load(self, _job):
+        """Read back arguments of '_job' taken off the queue. Returns
+        False if they couldn't be read.
+        """
+        with self._lock:
+            info = self._spilled.pop(_job.uid, None)
+        if not info:
+            return True
+        segment, offset, args_len, kwargs_len = info
+        with self._io_lock:
+            try:
+                if segment == self._segment and self._write_fd:
+                    self._write_fd.flush()
+                if self._read_segment != segment:
+                    if self._read_fd:
+                        self._read_fd.close()
+                    self._read_fd = self._read_segment = None
+                    self._read_fd = open(os.path.join(self.path, str(segment)), 'rb')
+                    self._read_segment = segment
+                self._read_fd.seek(offset)
+                args = self._read_fd.read(args_len)
+                kwargs = self._read_fd.read(kwargs_len)
+                if len(args) != args_len or len(kwargs) != kwargs_len:
+                    raise Exception('file is truncated')
+            except Exception:
+                logger.warning('Could not read pending job %s from "%s"', _job.uid, self.path)
+                logger.debug(traceback.format_exc())
+                if self._read_fd:
+                    self._read_fd.close()
+                self._read_fd = self._read_segment = None
+                args = kwargs = None
+            with self._lock:
+                self._release(segment)
+            self._remove_segments()
+        if args is None:
+            return False
+        _job._args = args
+        _job._kwargs = kwargs
+        return True
+
+    def clear(self):
+        with self._io_lock:
+            self._remove_segments()
+            with self._lock:
+                self._jobs.clear()
+                self._to_spill.clear()
+                self._spilling.clear()
+                self._spilled.clear()
+                self.memory = 0
+                for fd in (self._write_fd, self._read_fd):
+                    if fd:
+                        fd.close()
+                self._write_fd = self._read_fd = self._read_segment = None
+                for segment in self._segments:
+                    try:
+                        os.remove(os.path.join(self.path, str(segment)))
+                    except Exception:
+                        pass
+                self._segments.clear()
+                if self._tmp_path:
+                    try:
+                        os.rmdir(self._tmp_path)
+                    except Exception:
+                        pass
+                    self.path = self._tmp_path = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        return iter(self._jobs)
+
+    def __contains__(self, _job):
+        return _job in self._jobs
+
+    def _size(self, _job):
+        if isinstance(_job._args, bytes) and isinstance(_job._kwargs, bytes):
+            return len(_job._args) + len(_job._kwargs)
+        return 0
+
+    def _add(self, _job):
+        # called with '_lock' held
+        size = self._size(_job)
+        if self.max_memory is None or (self.memory + size) <= self.max_memory or not size:
+            self.memory += size
+        else:
+            self._to_spill[_job.uid] = _job
+
+    def _discard(self, _job):
+        # called with '_lock' held; arguments of spilled job are read back
+        # (and '_spilled' updated) with 'load'
+        if (self._to_spill.pop(_job.uid, None) is None and
+            self._spilling.pop(_job.uid, None) is None and _job.uid not in self._spilled):
+            self.memory -= self._size(_job)
+
+    def _release(self, segment):
+        # called with '_lock' held
+        self._segments[segment] -= 1
+        if self._segments[segment] == 0 and segment != self._segment:
+            del self._segments[segment]
+            self._drained.append(segment)
+
+    def _remove_segments(self):
+        # called with '_io_lock' held
+        while self._drained:
+            segment = self._drained.pop()
+            if self._read_segment == segment:
+                self._read_fd.close()
+                self._read_fd = self._read_segment = None
+            try:
+                os.remove(os.path.join(self.path, str(segment)))
+            except Exception:
+                pass
+
+
+class _JobJournal(object):
+    """Internal use only.
+
+    Append-only journal of job submissions, dispatches and completions,
+    stored in file '<recover_file>.jobs'. Records are buffered and
+    written (and synced to disk) in batches by a thread, so recording
+    an event doesn't wait for disk.
+    """
+
+    Compute = 1
+    Submit = 2
+    Dispatch = 3
+    Finish = 4
+    Resumed = 5
+
+    def __init__(self, path, flush_interval=0.5, batch_size=4096):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._fd = open(path, 'ab')
+        self._records = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._event = threading.Event()
+        self._terminate = False
+        self._thread = threading.Thread(target=self._flusher)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, record):
+        with self._lock:
+            self._records.append(record)
+            if len(self._records) >= self.batch_size:
+                self._event.set()
+
+    def _flusher(self):
+        while not self._terminate:
+            self._event.wait(self.flush_interval)
+            self._event.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.warning('Could not write job journal "%s": %s',
+                               self.path, traceback.format_exc())
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            if not records or self._fd is None:
+                return
+            data = []
+            for record in records:
+                try:
+                    record = serialize(record)
+                except Exception:
+                    logger.debug('Ignoring journal record that can not be serialized: %s',
+                                 record[:3])
+                    continue
+                data.append(struct.pack('>L', len(record)))
+                data.append(record)
+            self._fd.write(b''.join(data))
+            self._fd.flush()
+            os.fsync(self._fd.fileno())
+
+    def close(self):
+        self._terminate = True
+        self._event.set()
+        self._thread.join()
+        self.flush()
+        with self._write_lock:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+    @staticmethod
+    def write(path, records):
+        """Append 'records' to journal file 'path' (that is not being
+        written by an instance) and sync it. A partially written record
+        at the end of file is removed first, so records appended are
+        read back.
+        """
+        data = []
+        for record in records:
+            record = serialize(record)
+            data.append(struct.pack('>L', len(record)))
+            data.append(record)
+        with open(path, 'r+b') as fd:
+            end = 0
+            while 1:
+                header = fd.read(4)
+                if len(header) < 4:
+                    break
+                size = struct.unpack('>L', header)[0]
+                if len(fd.read(size)) < size:
+                    break
+                end = fd.tell()
+            fd.seek(end)
+            fd.truncate()
+            fd.write(b''.join(data))
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    @staticmethod
+    def records(path):
+        """Generator for records in journal file 'path'; a partially
+        written record at the end (e.g., if client crashed while
+        writing) is ignored.
+        """
+        with open(path, 'rb') as fd:
+            while 1:
+                header = fd.read(4)
+                if len(header) < 4:
+                    break
+                size = struct.unpack('>L', header)[0]
+                data = fd.read(size)
+                if len(data) < size:
+                    break
+                try:
+                    record = deserialize(data)
+                except Exception:
+                    break
+                yield record
+
+
 class _Cluster(object, metaclass=Singleton):
     """Internal use only.
     """
 
+    # results of batches of jobs larger than this many bytes are deserialized in
+    # threads of 'result_pool' instead of in scheduler
+    InlineResultSize = 64 * 1024
+    ResultPoolSize = 2
+
     def __init__(self, ip_addr=None, ext_ip_addr=None, ipv4_udp_multicast=False, shared=False,
                  secret='', keyfile=None, certfile=None, recover_file=None):
         if not hasattr(self, 'pycos'):
@@ -897,6 +2281,8 @@ class _Cluster(object, metaclass=Singleton):
 
             self._clusters = {}
             self._sched_jobs = {}
+            # uids of scheduled jobs, indexed by IP address of node
+            self._node_jobs = {}
             self._sched_event = pycos.Event()
             self._abandoned_jobs = {}
             self.terminate = False
@@ -917,22 +2303,28 @@ class _Cluster(object, metaclass=Singleton):
             self.timer_task = Task(self.timer_proc)
 
             try:
-                self.shelf = shelve.open(self.recover_file, flag='c', writeback=True)
-                self.shelf['_cluster'] = {'ip_addrs': ip_addrs, 'ext_ip_addrs': ext_ip_addrs,
-                                          'port': self.port, 'sign': self.sign,
-                                          'secret': self.secret, 'auth': self.auth,
-                                          'keyfile': self.keyfile, 'certfile': self.certfile}
-                self.shelf.sync()
+                self.recover_store = _RecoverStore(self.recover_file)
+                self.recover_store.set_cluster({'ip_addrs': ip_addrs,
+                                                'ext_ip_addrs': ext_ip_addrs,
+                                                'port': self.port, 'sign': self.sign,
+                                                'secret': self.secret, 'auth': self.auth,
+                                                'keyfile': self.keyfile,
+                                                'certfile': self.certfile})
             except Exception:
                 raise Exception('Could not create fault recover file "%s"' %
                                 self.recover_file)
             logger.info('Storing fault recovery information in "%s"', self.recover_file)
+            try:
+                self.journal = _JobJournal(self.recover_file + '.jobs')
+            except Exception:
+                raise Exception('Could not create job journal "%s.jobs"' % self.recover_file)
 
             self.select_job_node = self.load_balance_schedule
             self._scheduler = Task(self._schedule_jobs)
             self.start_time = time.time()
             self.compute_id = int(1000 * self.start_time)
 
+            self.result_pool = pycos.AsyncThreadPool(_Cluster.ResultPoolSize)
             self.worker_Q = queue.Queue()
             self.worker_thread = threading.Thread(target=self.worker)
             self.worker_thread.daemon = True
@@ -1090,22 +2482,31 @@ class _Cluster(object, metaclass=Singleton):
         # generator
         conn.settimeout(MsgTimeout)
         msg = yield conn.recv_msg()
-        if msg.startswith(b'JOB_REPLY:'):
-            try:
-                info = deserialize(msg[len(b'JOB_REPLY:'):])
-            except Exception:
-                logger.warning('Invalid job reply from %s:%s ignored', addr[0], addr[1])
-            else:
+        frame = _MsgFrame.parse(msg)
+        if frame.name == b'JOB_REPLY':
+            # node may send more than one reply (e.g., when resending
+            # saved replies) over same connection
+            while frame.name == b'JOB_REPLY':
+                try:
+                    info = deserialize(frame.payload)
+                except Exception:
+                    logger.warning('Invalid job reply from %s:%s ignored', addr[0], addr[1])
+                    break
                 yield self.job_reply_process(info, len(msg), conn, addr)
+                try:
+                    msg = yield conn.recv_msg()
+                    frame = _MsgFrame.parse(msg)
+                except Exception:
+                    break
             conn.close()
 
-        elif msg.startswith(b'PULSE:'):
-            msg = msg[len(b'PULSE:'):]
+        elif frame.name == b'PULSE':
             try:
-                info = deserialize(msg)
+                info = _unpack_pulse(frame)
                 node = self._nodes[info['ip_addr']]
-                assert 0 <= info['cpus'] <= node.cpus
+                assert 0 <= info['cpus'] <= node.job_slots()
                 node.last_pulse = time.time()
+                node.pulses.pulse(node.last_pulse, self.pulse_interval)
                 yield conn.send_msg(b'PULSE')
                 if info['avail_info']:
                     node.avail_info = info['avail_info']
@@ -1123,11 +2524,11 @@ class _Cluster(object, metaclass=Singleton):
                 # logger.debug(traceback.format_exc())
             conn.close()
 
-        elif msg.startswith(b'JOB_STATUS:'):
+        elif frame.name == b'JOB_STATUS':
             conn.close()
             # message from dispyscheduler
             try:
-                info = deserialize(msg[len(b'JOB_STATUS:'):])
+                info = deserialize(frame.payload)
                 _job = self._sched_jobs[info['uid']]
                 assert _job.hash == info['hash']
             except Exception:
@@ -1154,10 +2555,10 @@ class _Cluster(object, metaclass=Singleton):
                             if cluster.status_callback:
                                 self.worker_Q.put((cluster.status_callback,
                                                    (job.status, dispy_node, copy.copy(job))))
-        elif msg.startswith(b'PONG:'):
+        elif frame.name == b'PONG':
             conn.close()
             try:
-                info = deserialize(msg[len(b'PONG:'):])
+                info = deserialize(frame.payload)
                 if info['version'] != _dispy_version:
                     logger.warning('Ignoring node %s due to version mismatch: %s != %s',
                                    info['ip_addr'], info['version'], _dispy_version)
@@ -1170,11 +2571,11 @@ class _Cluster(object, metaclass=Singleton):
             else:
                 self.add_node(info)
 
-        elif msg.startswith(b'PING:'):
+        elif frame.name == b'PING':
             sock_family = conn.family
             conn.close()
             try:
-                info = deserialize(msg[len(b'PING:'):])
+                info = deserialize(frame.payload)
                 if info['version'] != _dispy_version:
                     logger.warning('Ignoring %s due to version mismatch', addr[0])
                     raise StopIteration
@@ -1205,9 +2606,9 @@ class _Cluster(object, metaclass=Singleton):
             finally:
                 sock.close()
 
-        elif msg.startswith(b'FILEXFER:'):
+        elif frame.name == b'FILEXFER':
             try:
-                xf = deserialize(msg[len(b'FILEXFER:'):])
+                xf = deserialize(frame.payload)
                 msg = yield conn.recv_msg()
                 job_reply = deserialize(msg)
             except Exception:
@@ -1216,10 +2617,10 @@ class _Cluster(object, metaclass=Singleton):
                 yield self.file_xfer_process(job_reply, xf, conn, addr)
             conn.close()
 
-        elif msg.startswith(b'NODE_CPUS:'):
+        elif frame.name == b'NODE_CPUS':
             conn.close()
             try:
-                info = deserialize(msg[len(b'NODE_CPUS:'):])
+                info = deserialize(frame.payload)
                 node = self._nodes.get(info['ip_addr'], None)
                 if not node:
                     raise StopIteration
@@ -1264,10 +2665,10 @@ class _Cluster(object, metaclass=Singleton):
                 if dispy_node:
                     dispy_node.cpus = cpus
 
-        elif msg.startswith(b'TERMINATED:'):
+        elif frame.name == b'TERMINATED':
             conn.close()
             try:
-                info = deserialize(msg[len(b'TERMINATED:'):])
+                info = deserialize(frame.payload)
             except Exception:
                 # logger.debug(traceback.format_exc())
                 pass
@@ -1281,8 +2682,7 @@ class _Cluster(object, metaclass=Singleton):
                     raise StopIteration
                 logger.debug('Removing node %s', node.ip_addr)
                 if node.clusters:
-                    dead_jobs = [_job for _job in self._sched_jobs.values()
-                                 if _job.node is not None and _job.node.ip_addr == node.ip_addr]
+                    dead_jobs = self.node_sched_jobs(node.ip_addr)
                     clusters = list(node.clusters)
                     node.clusters = set()
                     for cluster in clusters:
@@ -1295,11 +2695,11 @@ class _Cluster(object, metaclass=Singleton):
                                                (DispyNode.Closed, dispy_node, None)))
                     self.reschedule_jobs(dead_jobs)
 
-        elif msg.startswith(b'NODE_STATUS:'):
+        elif frame.name == b'NODE_STATUS':
             conn.close()
             # this message is from dispyscheduler for SharedJobCluster
             try:
-                info = deserialize(msg[len(b'NODE_STATUS:'):])
+                info = deserialize(frame.payload)
                 cluster = self._clusters[info['compute_id']]
                 assert info['auth'] == cluster._compute.auth
                 status = info['status']
@@ -1364,9 +2764,9 @@ class _Cluster(object, metaclass=Singleton):
                     logger.warning('Invalid node status %s from %s:%s ignored',
                                    info['status'], addr[0], addr[1])
 
-        elif msg.startswith(b'SCHEDULED:'):
+        elif frame.name == b'SCHEDULED':
             try:
-                info = deserialize(msg[len(b'SCHEDULED:'):])
+                info = deserialize(frame.payload)
                 assert self.shared
                 cluster = self._clusters.get(info['compute_id'], None)
                 assert info['pulse_interval'] is None or info['pulse_interval'] >= 1
@@ -1378,9 +2778,9 @@ class _Cluster(object, metaclass=Singleton):
                 yield conn.send_msg(b'NAK')
             conn.close()
 
-        elif msg.startswith(b'RELAY_INFO:'):
+        elif frame.name == b'RELAY_INFO':
             try:
-                info = deserialize(msg[len(b'RELAY_INFO:'):])
+                info = deserialize(frame.payload)
                 assert info['version'] == _dispy_version
                 msg = {'sign': self.sign, 'ip_addrs': [info['scheduler_ip_addr']],
                        'port': self.port}
@@ -1431,29 +2831,10 @@ class _Cluster(object, metaclass=Singleton):
                             pass
                         sock.close()
                 else:
-                    dead_nodes = {}
                     for node in self._nodes.values():
-                        if node.busy and node.last_pulse is not None and \
-                           (node.last_pulse + (5 * self.pulse_interval)) <= now:
-                            logger.warning('Node %s is not responding; removing it (%s, %s, %s)',
-                                           node.ip_addr, node.busy, node.last_pulse, now)
-                            dead_nodes[node.ip_addr] = node
-                    if dead_nodes:
-                        for node in dead_nodes.values():
-                            clusters = list(node.clusters)
-                            node.clusters = set()
-                            for cluster in clusters:
-                                dispy_node = cluster._dispy_nodes.pop(node.ip_addr, None)
-                                if not dispy_node:
-                                    continue
-                                dispy_node.avail_cpus = dispy_node.cpus = dispy_node.busy = 0
-                                if cluster.status_callback:
-                                    self.worker_Q.put((cluster.status_callback,
-                                                       (DispyNode.Closed, dispy_node, None)))
-                            del self._nodes[node.ip_addr]
-                        dead_jobs = [_job for _job in self._sched_jobs.values()
-                                     if _job.node is not None and _job.node.ip_addr in dead_nodes]
-                        self.reschedule_jobs(dead_jobs)
+                        if node.busy and not node.probing and \
+                           node.suspected(now, self.pulse_interval):
+                            Task(self.probe_node, node)
 
             if self.ping_interval and (now - last_ping_time) >= self.ping_interval:
                 last_ping_time = now
@@ -1465,6 +2846,31 @@ class _Cluster(object, metaclass=Singleton):
                 for cluster in self._clusters.values():
                     Task(self.poll_job_results, cluster)
 
+    def probe_node(self, node, task=None):
+        # generator
+        # node is suspected to have failed; it is removed (and its jobs
+        # rescheduled) only if it doesn't respond to probe either, so nodes
+        # whose pulses are delayed (e.g., due to load) are not removed
+        node.probing = True
+        alive = yield node.probe(task=task)
+        node.probing = False
+        if alive or self._nodes.get(node.ip_addr, None) != node:
+            raise StopIteration
+        logger.warning('Node %s is not responding; removing it (%s, %s, %s)',
+                       node.ip_addr, node.busy, node.last_pulse, time.time())
+        clusters = list(node.clusters)
+        node.clusters = set()
+        for cluster in clusters:
+            dispy_node = cluster._dispy_nodes.pop(node.ip_addr, None)
+            if not dispy_node:
+                continue
+            dispy_node.avail_cpus = dispy_node.cpus = dispy_node.busy = 0
+            if cluster.status_callback:
+                self.worker_Q.put((cluster.status_callback,
+                                   (DispyNode.Closed, dispy_node, None)))
+        del self._nodes[node.ip_addr]
+        self.reschedule_jobs(self.node_sched_jobs(node.ip_addr))
+
     def file_xfer_process(self, job_reply, xf, sock, addr):
         _job = self._sched_jobs.get(job_reply.uid, None)
         if _job is None or _job.hash != job_reply.hash:
@@ -1488,6 +2894,9 @@ class _Cluster(object, metaclass=Singleton):
                     break
                 fd.write(data)
                 recvd += len(data)
+                # data from node shows it is alive, even if its pulses are delayed
+                if node:
+                    node.last_pulse = time.time()
             yield sock.send_msg(serialize(recvd))
         if node:
             node.rx += recvd
@@ -1584,6 +2993,12 @@ class _Cluster(object, metaclass=Singleton):
             finally:
                 sock.close()
 
+            if not reply['done']:
+                continue
+            retrieved = yield self.retrieve_job_results(cluster, node)
+            if retrieved:
+                continue
+            # node doesn't support 'RETRIEVE_JOBS'; get results one at a time
             for uid in reply['done']:
                 _job = self._sched_jobs.get(uid, None)
                 if _job is None:
@@ -1611,6 +3026,46 @@ class _Cluster(object, metaclass=Singleton):
                 finally:
                     conn.close()
 
+    def retrieve_job_results(self, cluster, node, task=None):
+        # generator
+        # retrieves all results saved at node in one connection (with
+        # 'RETRIEVE_JOBS'); if connection is broken, retrieval is resumed
+        # after last result received. Returns False if node doesn't support it.
+        cursor = None
+        supported = False
+        while 1:
+            conn = AsyncSocket(socket.socket(node.sock_family, socket.SOCK_STREAM),
+                               keyfile=self.keyfile, certfile=self.certfile)
+            conn.settimeout(MsgTimeout)
+            reply = None
+            resume = False
+            try:
+                yield conn.connect((node.ip_addr, node.port))
+                yield conn.sendall(node.auth)
+                req = {'compute_id': cluster._compute.id, 'auth': cluster._compute.auth,
+                       'cursor': cursor}
+                yield conn.send_msg(b'RETRIEVE_JOBS:' + serialize(req))
+                while 1:
+                    msg = yield conn.recv_msg()
+                    reply = deserialize(msg)
+                    if not isinstance(reply, _JobReply):
+                        break
+                    supported = True
+                    cursor = reply.uid
+                    yield self.job_reply_process(reply, len(msg), conn,
+                                                 (node.ip_addr, node.port))
+            except Exception:
+                logger.debug(traceback.format_exc())
+                resume = isinstance(reply, _JobReply)
+            else:
+                if reply is None:
+                    supported = True
+            finally:
+                conn.close()
+            if not resume:
+                break
+        raise StopIteration(supported)
+
     def add_cluster(self, cluster, task=None):
         compute = cluster._compute
         if self.shared:
@@ -1625,16 +3080,16 @@ class _Cluster(object, metaclass=Singleton):
             dispy_node = DispyNode(cluster.scheduler_ip_addr, None, 0)
             dispy_node.avail_info = node.avail_info
             cluster._dispy_nodes[dispy_node.ip_addr] = dispy_node
-            info = self.shelf['_cluster']
+            info = self.recover_store.cluster()
             info['port'] = self.port
-            self.shelf['_cluster'] = info
-            info = {'name': compute.name, 'auth': compute.auth,
-                    'nodes': [cluster.scheduler_ip_addr]}
-            self.shelf['compute_%s' % compute.id] = info
+            self.recover_store.set_cluster(info)
+            self.recover_store.set_compute(compute.id, {'name': compute.name,
+                                                        'auth': compute.auth})
             info = {'port': cluster.scheduler_port, 'auth': cluster._scheduler_auth,
                     'scheduler': True}
-            self.shelf['node_%s' % (cluster.scheduler_ip_addr)] = info
-            self.shelf.sync()
+            self.recover_store.set_node(cluster.scheduler_ip_addr, info)
+            self.recover_store.add_compute_node(compute.id, cluster.scheduler_ip_addr)
+            self.journal.append((_JobJournal.Compute, compute.id, compute.name))
             if cluster.poll_interval:
                 self.poll_interval = num_min(self.poll_interval, cluster.poll_interval)
             if self.poll_interval:
@@ -1649,9 +3104,9 @@ class _Cluster(object, metaclass=Singleton):
             self._clusters[compute.id] = cluster
             for xf in compute.xfer_files:
                 xf.compute_id = compute.id
-            info = {'name': compute.name, 'auth': compute.auth, 'nodes': []}
-            self.shelf['compute_%s' % compute.id] = info
-            self.shelf.sync()
+            self.recover_store.set_compute(compute.id, {'name': compute.name,
+                                                        'auth': compute.auth})
+            self.journal.append((_JobJournal.Compute, compute.id, compute.name))
 
             if compute.pulse_interval:
                 self.pulse_interval = num_min(self.pulse_interval, compute.pulse_interval)
@@ -1694,7 +3149,7 @@ class _Cluster(object, metaclass=Singleton):
             sock.close()
         else:
             cid = cluster._compute.id
-            cluster._jobs = []
+            cluster._jobs.clear()
             cluster._pending_jobs = 0
             # remove cluster from all nodes before closing (which uses
             # yield); otherwise, scheduler may access removed cluster
@@ -1718,9 +3173,8 @@ class _Cluster(object, metaclass=Singleton):
                 if cluster.status_callback:
                     self.worker_Q.put((cluster.status_callback,
                                        (DispyNode.Closed, dispy_node, None)))
-        self.shelf.pop('compute_%s' % (cluster._compute.id), None)
-        # TODO: prune nodes in shelf
-        self.shelf.sync()
+        self.recover_store.del_compute(cluster._compute.id)
+        # TODO: prune nodes in recover_store
 
     def setup_node(self, node, setup_computations, task=None):
         # generator
@@ -1740,19 +3194,14 @@ class _Cluster(object, metaclass=Singleton):
                 dispy_node.rx = node.rx
             dispy_node.avail_cpus = node.avail_cpus
             dispy_node.avail_info = node.avail_info
-            self.shelf['node_%s' % (node.ip_addr)] = {'port': node.port, 'auth': node.auth}
-            shelf_compute = self.shelf['compute_%s' % compute.id]
-            shelf_compute['nodes'].append(node.ip_addr)
-            self.shelf['compute_%s' % compute.id] = shelf_compute
-            self.shelf.sync()
+            self.recover_store.set_node(node.ip_addr, {'port': node.port, 'auth': node.auth})
+            self.recover_store.add_compute_node(compute.id, node.ip_addr)
             res = yield node.setup(depends, setup_args, compute, exclusive=True, task=task)
             if res or compute.id not in self._clusters:
                 cluster._dispy_nodes.pop(node.ip_addr, None)
                 logger.warning('Failed to setup %s for compute "%s": %s',
                                node.ip_addr, compute.name, res)
-                # TODO: delete node from shelf's cluster._dispy_nodes
-                del self.shelf['node_%s' % (node.ip_addr)]
-                self.shelf.sync()
+                self.recover_store.del_node(node.ip_addr)
                 yield node.close(compute, task=task)
             else:
                 dispy_node.update_time = time.time()
@@ -1779,6 +3228,7 @@ class _Cluster(object, metaclass=Singleton):
                          keyfile=self.keyfile, certfile=self.certfile)
             node.name = info['name']
             node.avail_info = info['avail_info']
+            node.frames = info.get('frames', 0)
             self._nodes[node.ip_addr] = node
         else:
             node.last_pulse = time.time()
@@ -1798,8 +3248,7 @@ class _Cluster(object, metaclass=Singleton):
             logger.debug('Node %s rediscovered', info['ip_addr'])
             node.port = info['port']
             if node.auth is not None:
-                dead_jobs = [_job for _job in self._sched_jobs.values()
-                             if _job.node is not None and _job.node.ip_addr == node.ip_addr]
+                dead_jobs = self.node_sched_jobs(node.ip_addr)
                 self.reschedule_jobs(dead_jobs)
                 node.busy = 0
                 node.auth = auth
@@ -1858,7 +3307,10 @@ class _Cluster(object, metaclass=Singleton):
             if item is None:
                 self.worker_Q.task_done()
                 break
-            func, args = item
+            func, args = item[0], item[1]
+            if len(item) > 2:
+                # job stats and time when callback was queued
+                item[2].add('callback', time.time() - item[3])
             try:
                 func(*args)
             except Exception:
@@ -1874,21 +3326,96 @@ class _Cluster(object, metaclass=Singleton):
     def finish_job(self, cluster, _job, status):
         # assert status in (DispyJob.Finished, DispyJob.Terminated, DispyJob.Abandoned)
         job = _job.job
+        batch = _job.batch
         _job.finish(status)
+        if not batch:
+            jobs = [job]
+        elif status != DispyJob.ProvisionalResult:
+            jobs = _job.finish_batch(job)
+        else:
+            jobs = []
         if cluster.callback:
-            self.worker_Q.put((cluster.callback, (copy.copy(job),)))
+            for done_job in jobs:
+                self.worker_Q.put((cluster.callback, (copy.copy(done_job),), cluster._job_stats,
+                                   time.time()))
         if status != DispyJob.ProvisionalResult:
+            # jobs in batch are not recorded in journal
+            if not batch:
+                self.journal.append((_JobJournal.Finish, _job.compute_id, _job.uid, status,
+                                     job.result_bytes, job.stdout, job.stderr, job.exception,
+                                     job.start_time, job.end_time, job.ip_addr))
             # assert cluster._pending_jobs > 0
             cluster._pending_jobs -= 1
             if cluster._pending_jobs == 0:
                 cluster.end_time = time.time()
                 cluster._complete.set()
 
+    def retry_job(self, cluster, _job):
+        """If job that failed should be run again as per cluster's
+        retry policy, queue it (after backoff) and return True.
+        """
+        policy = cluster._retry_policy
+        job = _job.job
+        if not policy or not job or not policy.retry(job):
+            return False
+        attempt = JobAttempt(job.ip_addr, job.status, job.start_time, job.end_time,
+                             job.exception)
+        job.attempts += (attempt,)
+        if _job.batch:
+            for batch_job in _job.batch:
+                batch_job.attempts += (attempt,)
+        if job.ip_addr:
+            if _job.avoid is None:
+                _job.avoid = set()
+            _job.avoid.add(job.ip_addr)
+        job.status = DispyJob.Created
+        job.ip_addr = job.result = job.exception = None
+        job.stdout = job.stderr = None
+        _job.node = None
+        # replies from earlier attempt are ignored
+        _job.hash = ''.join(hex(_)[2:] for _ in os.urandom(10))
+        delay = policy.delay(len(job.attempts))
+        logger.debug('Retrying job %s / %s (attempt %s) in %.2f sec',
+                     job.id, _job.uid, len(job.attempts) + 1, delay)
+        Task(self.requeue_job, cluster, _job, delay)
+        return True
+
+    def requeue_job(self, cluster, _job, delay, task=None):
+        # generator
+        if delay:
+            yield task.sleep(delay)
+        # job may have been cancelled or cluster closed while waiting
+        if (not _job.job or _job.job.status != DispyJob.Created or
+            self._clusters.get(_job.compute_id, None) != cluster):
+            raise StopIteration
+        if _job.pinned:
+            _job.pinned.pending_jobs.append(_job)
+        else:
+            cluster._jobs.appendleft(_job)
+        self._sched_event.set()
+
+    def retry_node(self, cluster, _job, node):
+        # job being retried avoids nodes where it failed, if another
+        # node can run it now
+        host = None
+        load = 1.0
+        for ip_addr in cluster._dispy_nodes:
+            if ip_addr in _job.avoid:
+                continue
+            other = self._nodes.get(ip_addr, None)
+            if not other or cluster not in other.clusters:
+                continue
+            slots = other.job_slots()
+            if other.busy < slots and (other.busy / slots) < load:
+                load = other.busy / slots
+                host = other
+        return host or node
+
     def job_reply_process(self, reply, msg_len, sock, addr):
-        _job = self._sched_jobs.pop(reply.uid, None)
+        _job = self.pop_sched_job(reply.uid)
         if _job:
             if reply.hash != _job.hash:
-                self._sched_jobs[reply.uid] = _job
+                self.add_sched_job(_job)
                 logger.warning('Ignoring invalid reply for job %s from %s', reply.uid, addr[0])
                 yield sock.send_msg('NAK'.encode())
                 raise StopIteration
@@ -1936,8 +3463,18 @@ class _Cluster(object, metaclass=Singleton):
             else:
                 logger.warning('Invalid job reply? %s: %s', job.id, job.status)
 
-        job.result, reply.result = deserialize(reply.result), None
+        result, reply.result = reply.result, None
+        if not _job.batch:
+            # result is deserialized when it is used (see DispyJob.result)
+            job._result, job._result_bytes = None, result
+        elif len(result) > _Cluster.InlineResultSize:
+            # results of jobs in batch are needed to finish them
+            job.result = yield self.result_pool.async_task(_Serializer.loads, result)
+        else:
+            job.result = _Serializer.loads(result)
         job.start_time = reply.start_time
+        # job is cancelled by user
+        cancelled = job.status == DispyJob.Cancelled
         job.status = reply.status
         logger.debug('Received reply for job %s / %s from %s', job.id, _job.uid, job.ip_addr)
         if node:
@@ -1946,12 +3483,15 @@ class _Cluster(object, metaclass=Singleton):
         if dispy_node:
             dispy_node.rx += msg_len
         if reply.status == DispyJob.ProvisionalResult:
-            self._sched_jobs[_job.uid] = _job
+            self.add_sched_job(_job)
+            if job._provisional is not None:
+                job._provisional.put((result,))
             if cluster.callback:
-                self.worker_Q.put((cluster.callback, (copy.copy(job),)))
+                self.worker_Q.put((cluster.callback, (copy.copy(job),), cluster._job_stats,
+                                   time.time()))
         else:
             if node and dispy_node:
-                if reply.status == DispyJob.Finished or reply.status == DispyJob.Terminated:
+                if reply.status in (DispyJob.Finished, DispyJob.Terminated, DispyJob.TimedOut):
                     node.busy -= 1
                     node.cpu_time += reply.end_time - reply.start_time
                     dispy_node.busy -= 1
@@ -1971,6 +3511,18 @@ class _Cluster(object, metaclass=Singleton):
             job.stderr = reply.stderr
             job.exception = reply.exception
             job.end_time = reply.end_time
+            if (cluster._retry_policy and not cancelled and reply.status != DispyJob.Finished and
+                self.retry_job(cluster, _job)):
+                self._sched_event.set()
+                yield sock.send_msg(b'ACK')
+                raise StopIteration
+            if reply.status in (DispyJob.Finished, DispyJob.Terminated, DispyJob.TimedOut):
+                cluster._job_stats.job_done(_job, job.submit_time, reply)
+            if (cluster._result_cache is not None and _job.memo_key and
+                reply.status == DispyJob.Finished and not reply.exception):
+                # shelve is written in result pool instead of in scheduler
+                yield self.result_pool.async_task(cluster._result_cache.put, _job.memo_key,
+                                                  result, reply.stdout, reply.stderr)
             self.finish_job(cluster, _job, reply.status)
             if cluster.status_callback:
                 self.worker_Q.put((cluster.status_callback, (reply.status, dispy_node,
@@ -1978,12 +3530,45 @@ class _Cluster(object, metaclass=Singleton):
             self._sched_event.set()
         yield sock.send_msg(b'ACK')
 
+    def add_sched_job(self, _job):
+        self._sched_jobs[_job.uid] = _job
+        if _job.node:
+            self._node_jobs.setdefault(_job.node.ip_addr, set()).add(_job.uid)
+
+    def pop_sched_job(self, uid):
+        _job = self._sched_jobs.pop(uid, None)
+        if _job and _job.node:
+            uids = self._node_jobs.get(_job.node.ip_addr, None)
+            if uids:
+                uids.discard(uid)
+                if not uids:
+                    del self._node_jobs[_job.node.ip_addr]
+        return _job
+
+    def node_sched_jobs(self, ip_addr):
+        # jobs scheduled on node; this doesn't go through all scheduled jobs
+        return [self._sched_jobs[uid] for uid in self._node_jobs.get(ip_addr, ())]
+
+    def job_slot_free(self, node, cluster):
+        """Returns True if job of 'cluster' can run on 'node' now; jobs of
+        each computation are limited by its own 'jobs_per_cpu', even if
+        other computations on node run more jobs per CPU.
+        """
+        slots = node.job_slots(cluster)
+        if slots >= node.job_slots():
+            # checked with node's slots already
+            return True
+        compute_id = cluster._compute.id
+        busy = sum(1 for _job in self.node_sched_jobs(node.ip_addr)
+                   if _job.compute_id == compute_id)
+        return busy < slots
+
     def reschedule_jobs(self, dead_jobs):
         if not dead_jobs:
             return
         for _job in dead_jobs:
             cluster = self._clusters[_job.compute_id]
-            del self._sched_jobs[_job.uid]
+            self.pop_sched_job(_job.uid)
             dispy_node = cluster._dispy_nodes.get(_job.node.ip_addr, None)
             if dispy_node:
                 dispy_node.cpus = 0
@@ -2017,6 +3602,24 @@ class _Cluster(object, metaclass=Singleton):
         # generator
         node = _job.node
         dispy_node = cluster._dispy_nodes[node.ip_addr]
+        if cluster._jobs.spilled(_job):
+            loaded = yield self.result_pool.async_task(cluster._jobs.load, _job)
+            if not loaded:
+                # arguments are lost, so job can't be run (or retried)
+                if self.pop_sched_job(_job.uid) == _job:
+                    dispy_job = _job.job
+                    dispy_job.ip_addr = node.ip_addr
+                    dispy_job.end_time = time.time()
+                    dispy_job.exception = ('Could not read arguments of job %s from "%s"' %
+                                           (_job.uid, cluster._jobs.path))
+                    self.finish_job(cluster, _job, DispyJob.Terminated)
+                    if cluster.status_callback and dispy_node:
+                        dispy_node.update_time = time.time()
+                        self.worker_Q.put((cluster.status_callback,
+                                           (DispyJob.Terminated, dispy_node, dispy_job)))
+                    node.busy -= 1
+                self._sched_event.set()
+                raise StopIteration
         try:
             tx = yield _job.run(task=task)
             dispy_node.tx += tx
@@ -2025,19 +3628,27 @@ class _Cluster(object, metaclass=Singleton):
                            _job.uid, node.ip_addr, cluster._compute.name)
             logger.debug(traceback.format_exc())
             self.delete_node(node)
-            if self._sched_jobs.pop(_job.uid, None) == _job:
+            if self.pop_sched_job(_job.uid) == _job:
                 if not _job.pinned:
-                    cluster._jobs.insert(0, _job)
+                    cluster._jobs.appendleft(_job)
                 node.busy -= 1
             self._sched_event.set()
         except Exception:
             logger.warning('Failed to run job %s on %s for computation %s',
                            _job.uid, node.ip_addr, cluster._compute.name)
             logger.debug(traceback.format_exc())
-            # TODO: delay executing again for some time?
             # this job might have been deleted already due to timeout
-            if self._sched_jobs.pop(_job.uid, None) == _job:
+            if self.pop_sched_job(_job.uid) == _job:
                 dispy_job = _job.job
+                if cluster._retry_policy and dispy_job.status != DispyJob.Cancelled:
+                    dispy_job.status = DispyJob.Cancelled
+                    dispy_job.ip_addr = node.ip_addr
+                    dispy_job.end_time = time.time()
+                    dispy_job.exception = traceback.format_exc()
+                    if self.retry_job(cluster, _job):
+                        node.busy -= 1
+                        self._sched_event.set()
+                        raise StopIteration
                 self.finish_job(cluster, _job, DispyJob.Cancelled)
                 if cluster.status_callback and dispy_node:
                     dispy_node.update_time = time.time()
@@ -2052,7 +3663,15 @@ class _Cluster(object, metaclass=Singleton):
                 logger.debug('Running job %s / %s on %s (busy: %d / %d)',
                              _job.job.id, _job.uid, node.ip_addr, node.busy, node.cpus)
                 _job.job.status = DispyJob.Running
-                _job.job.start_time = time.time()
+                _job.job.start_time = _job.sent_time = time.time()
+                if _job.batch:
+                    for batch_job in _job.batch:
+                        batch_job.status = DispyJob.Running
+                        batch_job.ip_addr = node.ip_addr
+                        batch_job.start_time = _job.sent_time
+                cluster._job_stats.job_sent(_job, _job.job.submit_time)
+                self.journal.append((_JobJournal.Dispatch, _job.compute_id, _job.uid,
+                                     node.ip_addr))
                 dispy_node.busy += 1
                 dispy_node.update_time = time.time()
                 if cluster.status_callback:
@@ -2078,15 +3697,17 @@ class _Cluster(object, metaclass=Singleton):
         host = None
         load = 1.0
         for node in self._nodes.values():
-            if node.busy >= node.cpus:
+            slots = node.job_slots()
+            if node.busy >= slots:
                 continue
             if node.pending_jobs:
                 host = node
                 break
-            if not any(cluster._jobs for cluster in node.clusters):
+            if not any(cluster._jobs and self.job_slot_free(node, cluster)
+                       for cluster in node.clusters):
                 continue
-            if (node.busy / node.cpus) < load:
-                load = node.busy / node.cpus
+            if (node.busy / slots) < load:
+                load = node.busy / slots
                 host = node
         return host
 
@@ -2106,21 +3727,25 @@ class _Cluster(object, metaclass=Singleton):
                 # TODO: strategy to pick a cluster?
                 for cluster in node.clusters:
                     # assert node.ip_addr in cluster._dispy_nodes
-                    if cluster._jobs:
-                        _job = cluster._jobs.pop(0)
+                    if cluster._jobs and self.job_slot_free(node, cluster):
+                        _job = cluster._jobs.popleft()
+                        if _job.avoid and node.ip_addr in _job.avoid:
+                            node = self.retry_node(cluster, _job, node)
                         break
                 else:
                     self._sched_event.clear()
                     yield self._sched_event.wait()
                     continue
             _job.node = node
+            _job.dispatch_time = time.time()
             # assert node.busy < node.cpus
-            self._sched_jobs[_job.uid] = _job
+            self.add_sched_job(_job)
             node.busy += 1
             Task(self.run_job, _job, cluster)
 
         logger.debug('Scheduler quitting: %s', len(self._sched_jobs))
         self._sched_jobs = {}
+        self._node_jobs = {}
         for udp_task in self.udp_tasks:
             udp_task.terminate()
         for cid in list(self._clusters.keys()):
@@ -2158,7 +3783,7 @@ class _Cluster(object, metaclass=Singleton):
                         self.worker_Q.put((cluster.status_callback,
                                            (status, dispy_node, copy.copy(dispy_job))))
                 node.pending_jobs = []
-            cluster._jobs = []
+            cluster._jobs.clear()
             cluster._pending_jobs = 0
             yield self.del_cluster(cluster, task=task)
         self._clusters = {}
@@ -2175,10 +3800,25 @@ class _Cluster(object, metaclass=Singleton):
                 raise StopIteration(-1)
             node.pending_jobs.append(_job)
             _job.pinned = node
-        else:
-            cluster._jobs.append(_job)
         cluster._pending_jobs += 1
         cluster._complete.clear()
+        if not _job.batch:
+            self.journal.append((_JobJournal.Submit, _job.compute_id, _job.uid, _job.job.id,
+                                 _job._args, _job._kwargs, [xf.name for xf in _job.xfer_files],
+                                 bool(_job.code)))
+        if not _job.pinned:
+            cluster._jobs.append(_job)
+        if not cluster.status_callback and (not cluster._compute.reentrant or
+                                            cluster._jobs.spilled(_job)):
+            # arguments are kept serialized in '_job' (or in pending queue's
+            # file), so jobs don't need to keep them
+            if _job.job:
+                _job.job._args = ()
+                _job.job._kwargs = {}
+            if _job.batch:
+                for batch_job in _job.batch:
+                    batch_job._args = ()
+                    batch_job._kwargs = {}
         if cluster.status_callback:
             self.worker_Q.put((cluster.status_callback, (DispyJob.Created, None,
                                                          copy.copy(_job.job))))
@@ -2198,9 +3838,16 @@ class _Cluster(object, metaclass=Singleton):
         # assert cluster._pending_jobs >= 1
         if _job.job.status == DispyJob.Created:
             if _job.pinned:
-                _job.pinned.pending_jobs.remove(_job)
+                pending_jobs = _job.pinned.pending_jobs
             else:
-                cluster._jobs.remove(_job)
+                pending_jobs = cluster._jobs
+            if _job in pending_jobs:
+                pending_jobs.remove(_job)
+            elif _job.node:
+                logger.warning('Job %s is being sent to %s; it can\'t be cancelled now',
+                               job.id, _job.node.ip_addr)
+                raise StopIteration(-1)
+            # else job is waiting to be retried (see 'retry_job')
             dispy_job = _job.job
             self.finish_job(cluster, _job, DispyJob.Cancelled)
             if cluster.status_callback:
@@ -2362,7 +4009,7 @@ class _Cluster(object, metaclass=Singleton):
                 jobs = []
             sock.close()
         else:
-            jobs = [_job.job for _job in self._sched_jobs.values()
+            jobs = [_job.job for _job in self.node_sched_jobs(node.ip_addr)
                     if _job.node == node and _job.compute_id == cluster._compute.id]
 
         raise StopIteration(jobs)
@@ -2384,16 +4031,17 @@ class _Cluster(object, metaclass=Singleton):
             self.worker_Q.put(None)
             self._scheduler.value()
             self.worker_Q.join()
-        if self.shelf:
+        if self.recover_store:
             # TODO: need to check all clusters are deleted?
-            self.shelf.close()
-            self.shelf = None
-            for ext in ('', '.db', '.bak', '.dat', '.dir'):
-                if os.path.isfile(self.recover_file + ext):
-                    try:
-                        os.remove(self.recover_file + ext)
-                    except Exception:
-                        pass
+            self.recover_store.close()
+            self.recover_store = None
+            self.journal.close()
+            _RecoverStore.remove_files(self.recover_file)
+            try:
+                os.remove(self.journal.path)
+            except Exception:
+                pass
+        self.result_pool.terminate()
         if self.pycos:
             self.pycos.finish()
             self.pycos = None
@@ -2408,8 +4056,10 @@ class JobCluster(object):
                  ip_addr=None, dispy_port=None, ext_ip_addr=None,
                  ipv4_udp_multicast=False, dest_path=None, loglevel=logger.INFO,
                  setup=None, cleanup=True, ping_interval=None, pulse_interval=None,
-                 poll_interval=None, reentrant=False, secret='', keyfile=None, certfile=None,
-                 recover_file=None):
+                 poll_interval=None, reentrant=False, jobs_per_cpu=1, execution='process',
+                 job_timeout=None, retry=None, secret='', keyfile=None, certfile=None,
+                 recover_file=None, memoize=None, memoize_size=1000, memoize_ttl=None,
+                 pending_memory=None, pending_path=None, serializer='pickle'):
         """Create an instance of cluster for a specific computation.
 
         @computation is either a string (which is name of program, possibly
@@ -2514,6 +4164,36 @@ class JobCluster(object):
         reentrant is True, then jobs scheduled for a dead node are
         resubmitted to other eligible nodes.
 
+        @jobs_per_cpu is number of jobs of this computation a node
+        runs at the same time for each CPU it serves (default 1). If
+        jobs spend most of their time waiting for I/O (e.g., disk or
+        subprocesses), using a value greater than 1 keeps the CPUs
+        busy. If a node is used for more than one computation, the
+        largest jobs_per_cpu of those computations applies to it.
+
+        @execution must be either 'process' (default) or 'thread'. With
+        'process', each job is run in a new process. With 'thread',
+        jobs are run in a pool of threads in a process started on each
+        node for this computation, so jobs share the globals set up by
+        computation (e.g., with 'setup') and there is no cost of
+        creating a process for each job. This is suitable only for
+        functions that release the GIL most of the time (e.g., with
+        numpy). Jobs run in threads can't be stopped; if a job is
+        cancelled, its result is discarded when it finishes.
+
+        @job_timeout, if not None, is number of seconds jobs of this
+        computation are allowed to run; a job running longer is
+        terminated by node and its status is set to DispyJob.TimedOut
+        (in which case the job may be resubmitted, if necessary). A
+        job can override this with 'dispy_timeout' keyword argument to
+        'submit'. Jobs run in threads (see 'execution' above) can't be
+        stopped, so only their results are discarded.
+
+        @retry, if not None, must be an instance of RetryPolicy; jobs
+        that fail (e.g., due to exceptions or timeouts) are then run
+        again as per that policy. See RetryPolicy for details. This is
+        not supported with SharedJobCluster.
+
         @recover_file must be either None (default) or file path. If
         this is None, dispy stores information about cluster in a file
         of the form '_dispy_YYYYMMDDHHMMSS' in current directory. If
@@ -2522,6 +4202,44 @@ class JobCluster(object):
         as raising an exception), it is possible to retrieve results
         of scheduled jobs later (after they are finished) by calling
         'recover' function (implemented in this file) with this file.
+        Submissions, dispatches and completions of jobs are also
+        recorded in file '<recover_file>.jobs', so jobs of a client
+        that terminated can be continued with 'resume' method.
+
+        @memoize must be either None (default), True or file path. If
+        it is not None, results of jobs are saved in a persistent
+        cache, keyed by computation (code and dependencies) and job
+        arguments; a job submitted later with same arguments is
+        finished with cached result without being sent to any
+        node. Only jobs that finish without exception are
+        cached. Computation must be a pure function of its arguments
+        for this to be useful. If @memoize is True, the cache is
+        stored in file '_dispy_cache_<computation name>' in current
+        directory.
+
+        @memoize_size is maximum number of results kept in cache;
+        least recently used results are evicted first.
+
+        @memoize_ttl is number of seconds cached results are valid
+        for. If it is None (default), results don't expire.
+
+        @pending_memory, if not None, is number of megabytes of
+        (serialized) arguments of jobs waiting to be scheduled that are
+        kept in memory; arguments of jobs submitted beyond that are
+        saved in files (in directory @pending_path, or a temporary
+        directory if that is None) and read back when the jobs are
+        scheduled. Arguments of such jobs are not kept with DispyJob
+        instances unless 'cluster_status' is given. This is not
+        supported with SharedJobCluster.
+
+        @serializer is name of serializer used for job arguments and
+        results: 'pickle' (default), 'marshal' (faster for built-in
+        types, such as numbers, strings, lists and dictionaries),
+        'pickle5' (pickle protocol 5, with Python 3.8 or later) or a
+        serializer registered with 'register_serializer'. Objects the
+        serializer can't handle are pickled. Nodes check the serializer
+        when computation is sent to them and decline the computation if
+        they don't have it.
         """
 
         logger.setLevel(loglevel)
@@ -2737,10 +4455,66 @@ class JobCluster(object):
         compute.job_result_port = self._cluster.port
         compute.reentrant = reentrant
         compute.pulse_interval = pulse_interval
+        try:
+            jobs_per_cpu = int(jobs_per_cpu)
+            assert jobs_per_cpu >= 1
+        except Exception:
+            raise Exception('Invalid jobs_per_cpu; must be a positive integer')
+        compute.jobs_per_cpu = jobs_per_cpu
+        if execution not in ('process', 'thread'):
+            raise Exception('Invalid execution; must be either "process" or "thread"')
+        if execution == 'thread' and compute.type != _Compute.func_type:
+            raise Exception('"execution" can be "thread" only for Python functions')
+        compute.execution = execution
+        if job_timeout is not None:
+            try:
+                job_timeout = float(job_timeout)
+                assert job_timeout > 0
+            except Exception:
+                raise Exception('Invalid job_timeout; must be a positive number')
+        compute.job_timeout = job_timeout
+        if retry is not None and not isinstance(retry, RetryPolicy):
+            raise Exception('"retry" must be an instance of RetryPolicy')
+        self._retry_policy = retry
+        if serializer not in _Serializer.registry:
+            raise Exception('Serializer "%s" is not registered' % serializer)
+        compute.serializer = serializer
+
+        if memoize:
+            if memoize is True:
+                memoize = '_dispy_cache_%s' % compute.name
+            elif not isinstance(memoize, str):
+                raise Exception('"memoize" must be either True or file path')
+            try:
+                memoize_size = int(memoize_size)
+                assert memoize_size > 0
+            except Exception:
+                raise Exception('Invalid memoize_size; must be a positive number')
+            if memoize_ttl is not None:
+                try:
+                    memoize_ttl = float(memoize_ttl)
+                    assert memoize_ttl > 0
+                except Exception:
+                    raise Exception('Invalid memoize_ttl; must be a positive number')
+            try:
+                self._result_cache = _ResultCache(memoize, max_size=memoize_size,
+                                                  ttl=memoize_ttl)
+            except Exception:
+                raise Exception('Could not open result cache "%s"' % memoize)
+            logger.debug('Caching results of "%s" in "%s"', compute.name, memoize)
+        else:
+            self._result_cache = None
 
         self._compute = compute
+        self._job_stats = _JobStats()
         self._pending_jobs = 0
-        self._jobs = []
+        if pending_memory is not None:
+            try:
+                pending_memory = int(float(pending_memory) * 1024 * 1024)
+                assert pending_memory >= 0
+            except Exception:
+                raise Exception('Invalid pending_memory; must be a non-negative number')
+        self._jobs = _JobQueue(max_memory=pending_memory, path=pending_path)
         self._complete = threading.Event()
         self._complete.set()
         self.cpu_time = 0
@@ -2754,6 +4528,12 @@ class JobCluster(object):
 
         Arguments should be serializable and should correspond to
         arguments for computation used when cluster is created.
+
+        Keyword argument 'dispy_timeout', if given, is number of
+        seconds job is allowed to run (overriding 'job_timeout' of
+        cluster) and is not passed to computation. If keyword argument
+        'dispy_keep_result' is True, result of job is kept at the node
+        and job's result is a RemoteResult (see RemoteResult).
         """
         return self.submit_job_id(None, *args, **kwargs)
 
@@ -2769,7 +4549,14 @@ class JobCluster(object):
                            str(args), str(kwargs), traceback.format_exc())
             return None
 
+        if self._result_cache is not None and not _job.keep_result:
+            job = self._cached_job(_job)
+            if job:
+                return job
+        _job.serialize_args(self._compute.serializer)
+
         if Task(self._cluster.submit_job, _job).value() == 0:
+            self._jobs.spill()
             return _job.job
         else:
             return None
@@ -2807,11 +4594,196 @@ class JobCluster(object):
                            str(args), str(kwargs), traceback.format_exc())
             return None
 
+        if self._result_cache is not None and not _job.keep_result:
+            job = self._cached_job(_job)
+            if job:
+                return job
+        _job.serialize_args(self._compute.serializer)
+
         if Task(self._cluster.submit_job, _job, ip_addr=node.ip_addr).value() == 0:
+            self._jobs.spill()
             return _job.job
         else:
             return None
 
+    def submit_batch(self, args_list, batch_size=100):
+        """Submit a job for each element of 'args_list', which is a
+        tuple of arguments (or an argument, if it is not a tuple) for
+        computation. Jobs are sent to nodes in batches of 'batch_size'
+        jobs; a node runs all jobs in a batch one after another in one
+        process, so cost of scheduling, transferring and starting jobs
+        is shared by all jobs in the batch. This is useful for many
+        short jobs. Computation must be a Python function.
+
+        Returns list of jobs (instances of DispyJob); each job has its
+        own status, result, output, exception and times. Jobs in a
+        batch are not recorded in job journal (so they can't be
+        resumed) nor cached with 'memoize', and cancelling a job
+        cancels all jobs in its batch. If a batch can't be submitted,
+        its jobs and jobs in later batches are not run; their status
+        is set to DispyJob.Abandoned.
+        """
+        if self._compute.type != _Compute.func_type:
+            raise Exception('"submit_batch" can be used only with Python functions')
+        try:
+            batch_size = int(batch_size)
+            assert batch_size > 0
+        except Exception:
+            raise Exception('Invalid batch_size; must be a positive integer')
+        jobs = []
+        failed = False
+        for i in range(0, len(args_list), batch_size):
+            batch = []
+            for args in args_list[i:i + batch_size]:
+                if not isinstance(args, tuple):
+                    args = (args,)
+                batch.append(DispyJob(None, args, {}))
+            if not failed:
+                # job running the batch is given id of first job in batch,
+                # so ids of jobs given to user are consecutive
+                _job = _DispyJob_(self._compute.id, batch[0].id,
+                                  [job._args for job in batch], {})
+                _job.serialize_args(self._compute.serializer)
+                _job.batch = batch
+                for job in batch:
+                    job._dispy_job_ = _job
+                if Task(self._cluster.submit_job, _job).value() == 0:
+                    self._jobs.spill()
+                else:
+                    logger.warning('Submitting batch of %s jobs failed; %s jobs are abandoned',
+                                   len(batch), len(args_list) - i)
+                    failed = True
+            if failed:
+                for job in batch:
+                    job._dispy_job_ = None
+                    job.status = DispyJob.Abandoned
+                    job.end_time = time.time()
+                    job._set_finish()
+            jobs.extend(batch)
+        return jobs
+
+    def resume(self, recover_file):
+        """Resume jobs of this computation recorded in job journal of
+        'recover_file' by an earlier client (e.g., one that
+        crashed). Jobs are matched to this cluster by name of
+        computation. Jobs that were finished (or cancelled /
+        terminated) are not run again; their status, results, output
+        etc. are reloaded from the journal. All other jobs (whether
+        they were queued or running at the time) are submitted
+        again. Only files in 'dispy_job_depends' of a job are
+        submitted again; code (e.g., functions) in 'dispy_job_depends'
+        are not.
+
+        Returns list of jobs (instances of DispyJob) in the order they
+        were submitted originally.
+        """
+        path = recover_file + '.jobs'
+        if not os.path.isfile(path):
+            logger.warning('Job journal "%s" is not found', path)
+            return []
+        computes = set()
+        submitted = {}
+        infos = []
+        for record in _JobJournal.records(path):
+            if record[0] == _JobJournal.Compute:
+                if record[2] == self._compute.name and record[1] != self._compute.id:
+                    computes.add(record[1])
+                continue
+            if record[1] not in computes:
+                continue
+            key = (record[1], record[2])
+            if record[0] == _JobJournal.Submit:
+                info = {'submit': record, 'finish': None, 'resumed': False}
+                submitted[key] = info
+                infos.append(info)
+            elif record[0] == _JobJournal.Finish:
+                info = submitted.get(key, None)
+                if info:
+                    info['finish'] = record
+            elif record[0] == _JobJournal.Resumed:
+                info = submitted.get(key, None)
+                if info:
+                    info['resumed'] = True
+
+        jobs = []
+        resumed = []
+        for info in infos:
+            if info['resumed']:
+                continue
+            _, cid, uid, job_id, args, kwargs, files, code = info['submit']
+            # arguments are journaled as serialized by 'submit'
+            if isinstance(args, bytes):
+                args = _Serializer.loads(args)
+            if isinstance(kwargs, bytes):
+                kwargs = _Serializer.loads(kwargs)
+            finish = info['finish']
+            if finish:
+                job = DispyJob(job_id, args, kwargs)
+                # result is journaled serialized
+                (job.status, job._result_bytes, job.stdout, job.stderr, job.exception,
+                 job.start_time, job.end_time, job.ip_addr) = finish[3:]
+                job._set_finish()
+            else:
+                if code:
+                    logger.warning('Code dependencies of job %s are not resumed', job_id)
+                if files:
+                    kwargs = dict(kwargs)
+                    kwargs['dispy_job_depends'] = files
+                job = self.submit_job_id(job_id, *args, **kwargs)
+                if job is None:
+                    logger.warning('Could not resume job %s', job_id)
+                    continue
+                resumed.append((_JobJournal.Resumed, cid, uid))
+            jobs.append(job)
+        if resumed:
+            # record jobs resumed in journal read, so they are not resumed
+            # (submitted) again from it
+            journal = self._cluster.journal
+            if os.path.abspath(journal.path) == os.path.abspath(path):
+                for record in resumed:
+                    journal.append(record)
+            else:
+                try:
+                    _JobJournal.write(path, resumed)
+                except Exception:
+                    logger.warning('Could not record resumed jobs in "%s"; they will be '
+                                   'resumed again if it is used again', path)
+                    logger.debug(traceback.format_exc())
+        logger.debug('Resumed %s jobs from "%s"', len(jobs), path)
+        return jobs
+
+    def _cached_job(self, _job):
+        """Internal use only.
+
+        Finish job with result from cache if available. Returns the
+        (finished) job if result is found in cache, None otherwise.
+        """
+        try:
+            _job.memo_key = self._result_cache.key(self._compute, _job)
+        except Exception:
+            logger.debug('Job %s can not be cached: %s', _job.job.id, traceback.format_exc())
+            return None
+        entry = self._result_cache.get(_job.memo_key)
+        if entry is None:
+            return None
+        job = _job.job
+        try:
+            job.result = _Serializer.loads(entry['result'])
+        except Exception:
+            logger.debug('Invalid cached result for job %s', job.id)
+            return None
+        job.stdout = entry['stdout']
+        job.stderr = entry['stderr']
+        job.start_time = job.end_time = time.time()
+        logger.debug('Job %s finished with cached result', job.id)
+        _job.finish(DispyJob.Finished)
+        if self.callback:
+            self._cluster.worker_Q.put((self.callback, (copy.copy(job),)))
+        if self.status_callback:
+            self._cluster.worker_Q.put((self.status_callback,
+                                        (DispyJob.Finished, None, copy.copy(job))))
+        return job
+
     def cancel(self, job):
         """Cancel given job. If the job is not yet running on any
         node, it is simply removed from scheduler's queue. If the job
@@ -2945,16 +4917,36 @@ class JobCluster(object):
         print('')
         if info.jobs_pending:
             print('Jobs pending: %s' % info.jobs_pending)
+        if self._result_cache is not None:
+            print('Cache hits: %s, cached results: %s' %
+                  (self._result_cache.hits, len(self._result_cache)))
         msg = 'Total job time: %.3f sec' % cpu_time
         if not wall_time:
             wall_time = time.time() - self.start_time
         msg += ', wall time: %.3f sec, speedup: %.3f' % (wall_time, cpu_time / wall_time)
         print(msg)
         print('')
+        self._job_stats.print_stats()
 
-    # for backward compatibility
     stats = print_status
 
+    def latency_stats(self):
+        """
+        Returns latencies of stages of jobs done so far, as dictionary
+        with name of stage as key and dictionary with 'count',
+        'mean', 'p50', 'p99' and 'max' (latencies in seconds) as
+        value. The stages are 'queue' (waiting in scheduler's queue),
+        'send' (transferring files and job to node), 'node_queue' (at
+        node before computation starts), 'execute' (computation at
+        node), 'reply' (network transfers of job and result, not
+        counting time at node), 'callback' (waiting for 'callback' to
+        be called) and 'total' (from submission until result is
+        received). With SharedJobCluster, only 'node_queue',
+        'execute', 'callback' and 'total' are available in client;
+        dispyscheduler shows other stages in its status.
+        """
+        return self._job_stats.summary()
+
     def wait(self, timeout=None):
         """Wait for scheduled jobs to complete.
         """
@@ -2978,6 +4970,8 @@ class JobCluster(object):
                 return False
             self._complete.set()
             Task(self._cluster.del_cluster, self).value()
+            if self._result_cache is not None:
+                self._result_cache.close()
             self._compute = None
             return True
 
@@ -3013,8 +5007,10 @@ class SharedJobCluster(JobCluster):
     def __init__(self, computation, nodes=None, depends=[], callback=None, cluster_status=None,
                  ip_addr=None, dispy_port=None, client_port=None, scheduler_node=None,
                  ext_ip_addr=None, loglevel=logger.INFO, setup=None, cleanup=True, dest_path=None,
-                 poll_interval=None, reentrant=False, exclusive=False,
-                 secret='', keyfile=None, certfile=None, recover_file=None):
+                 poll_interval=None, reentrant=False, exclusive=False, jobs_per_cpu=1,
+                 execution='process', job_timeout=None, secret='', keyfile=None, certfile=None,
+                 recover_file=None, memoize=None, memoize_size=1000, memoize_ttl=None,
+                 serializer='pickle'):
 
         self.scheduler_ip_addr = _node_ipaddr(scheduler_node)
         self.addrinfo = host_addrinfo(host=ip_addr)
@@ -3040,8 +5036,11 @@ class SharedJobCluster(JobCluster):
                             cluster_status=cluster_status, ip_addr=ip_addr, ext_ip_addr=ext_ip_addr,
                             loglevel=loglevel, setup=setup, cleanup=cleanup, dest_path=dest_path,
                             poll_interval=poll_interval, reentrant=reentrant,
-                            secret=secret, keyfile=keyfile, certfile=certfile,
-                            recover_file=recover_file)
+                            jobs_per_cpu=jobs_per_cpu, execution=execution,
+                            job_timeout=job_timeout, secret=secret, keyfile=keyfile,
+                            certfile=certfile, recover_file=recover_file, memoize=memoize,
+                            memoize_size=memoize_size, memoize_ttl=memoize_ttl,
+                            serializer=serializer)
 
         def _terminate_scheduler(self, task=None):
             yield self._cluster._sched_event.set()
@@ -3070,6 +5069,9 @@ class SharedJobCluster(JobCluster):
             raise Exception('dispyscheduler version "%s" is different from dispy version "%s"' %
                             reply['version'], _dispy_version)
         ext_ip_addr = reply['ip_addr']
+        # scheduler of earlier version doesn't parse frames
+        self._scheduler_frames = reply.get('frames', 0)
+        self._compute.frames = min(self._compute.frames, self._scheduler_frames)
 
         self.scheduler_port = reply['port']
         self._scheduler_auth = auth_code(secret, reply['sign'])
@@ -3179,6 +5181,11 @@ class SharedJobCluster(JobCluster):
         """
         return self.submit_job_id_node(None, node, *args, **kwargs)
 
+    def submit_batch(self, args_list, batch_size=100):
+        """Not supported with SharedJobCluster.
+        """
+        raise Exception('"submit_batch" is not supported with SharedJobCluster')
+
     def submit_job_id_node(self, job_id, node, *args, **kwargs):
         """Same as 'submit_node' but job's 'id' is initialized to 'job_id'.
         """
@@ -3201,6 +5208,11 @@ class SharedJobCluster(JobCluster):
                            str(args), str(kwargs), traceback.format_exc())
             return None
 
+        if self._result_cache is not None:
+            job = self._cached_job(_job)
+            if job:
+                return job
+
         job = None
         try:
             for xf in _job.xfer_files:
@@ -3233,14 +5245,18 @@ class SharedJobCluster(JobCluster):
             sock.connect((self.scheduler_ip_addr, self.scheduler_port))
             sock.sendall(self._scheduler_auth)
             req = {'node': node, 'job': _job, 'auth': self._compute.auth}
-            sock.send_msg(b'JOB:' + serialize(req))
+            sock.send_msg(_MsgFrame(b'JOB', serialize(req)).pack(self._scheduler_frames))
             msg = sock.recv_msg()
             _job.uid = deserialize(msg)
             if _job.uid:
                 job = _job.job
-                self._cluster._sched_jobs[_job.uid] = _job
+                self._cluster.add_sched_job(_job)
                 self._pending_jobs += 1
                 self._complete.clear()
+                self._cluster.journal.append((_JobJournal.Submit, _job.compute_id, _job.uid,
+                                              job.id, _job._args, _job._kwargs,
+                                              [xf.name for xf in _job.xfer_files],
+                                              bool(_job.code)))
                 sock.send_msg(b'ACK')
                 if self.status_callback:
                     self._cluster.worker_Q.put((self.status_callback,
@@ -3506,45 +5522,30 @@ def recover_jobs(recover_file=None, timeout=None, terminate_pending=False):
 
     if not recover_file:
         import glob
-        recover_file = sorted(glob.glob('_dispy_*'))
+        recover_file = sorted(path for path in glob.glob('_dispy_*')
+                              if re.match(r'_dispy_\d{14}$', os.path.basename(path)))
         if recover_file:
             recover_file = recover_file[-1]
         else:
             print('Could not find recover file of the form "_dispy_*"')
             return []
 
-    shelf_nodes = {}
-    computes = {}
-    cluster = None
     pycos_scheduler = pycos.Pycos.instance()
 
     try:
-        shelf = shelve.open(recover_file, flag='r')
+        store = _RecoverStore(recover_file)
+        cluster, computes, store_nodes = store.load()
+        store.close()
     except Exception:
         print('Could not open recover file "%s"' % recover_file)
         return []
 
-    for key, val in shelf.items():
-        if key.startswith('node_'):
-            shelf_nodes[key[len('node_'):]] = val
-        elif key.startswith('compute_'):
-            computes[int(key[len('compute_'):])] = val
-        elif key == '_cluster':
-            cluster = val
-        else:
-            logger.warning('Invalid key "%s" ignored', key)
-    shelf.close()
-    if not cluster or not computes or not shelf_nodes:
-        for ext in ('', '.db', '.bak', '.dat', '.dir'):
-            if os.path.isfile(recover_file + ext):
-                try:
-                    os.remove(recover_file + ext)
-                except Exception:
-                    pass
+    if not cluster or not computes or not store_nodes:
+        _RecoverStore.remove_files(recover_file)
         return []
 
     nodes = {}
-    for ip_addr, info in shelf_nodes.items():
+    for ip_addr, info in store_nodes.items():
         node = _Node(ip_addr, info['port'], 0, '', cluster['secret'], platform='',
                      keyfile=cluster['keyfile'], certfile=cluster['certfile'])
         node.auth = info['auth']
@@ -3556,17 +5557,20 @@ def recover_jobs(recover_file=None, timeout=None, terminate_pending=False):
         # generator
         conn.settimeout(MsgTimeout)
         msg = yield conn.recv_msg()
-        if msg.startswith(b'JOB_REPLY:'):
+        frame = _MsgFrame.parse(msg)
+        if not frame.name == b'JOB_REPLY':
+            logger.debug('Invalid TCP message from %s ignored', addr[0])
+        # node may send more than one reply over same connection
+        while frame.name == b'JOB_REPLY':
             try:
-                reply = deserialize(msg[len(b'JOB_REPLY:'):])
+                reply = deserialize(frame.payload)
             except Exception:
                 logger.warning('Invalid job reply from %s:%s ignored', addr[0], addr[1])
-                conn.close()
-                raise StopIteration
+                break
             yield conn.send_msg(b'ACK')
             logger.debug('Received reply for job %s', reply.uid)
             job = DispyJob(None, (), {})
-            job.result = deserialize(reply.result)
+            job.result = _Serializer.loads(reply.result)
             job.stdout = reply.stdout
             job.stderr = reply.stderr
             job.exception = reply.exception
@@ -3574,13 +5578,16 @@ def recover_jobs(recover_file=None, timeout=None, terminate_pending=False):
             job.end_time = reply.end_time
             job.status = reply.status
             job.ip_addr = reply.ip_addr
-            job.finish.set()
+            job._set_finish()
             pending['jobs'].append(job)
             pending['count'] -= 1
             if pending['count'] == 0 and pending['resend_req_done'] is True:
                 pending['complete'].set()
-        else:
-            logger.debug('Invalid TCP message from %s ignored', addr[0])
+            try:
+                msg = yield conn.recv_msg()
+                frame = _MsgFrame.parse(msg)
+            except Exception:
+                break
         conn.close()
 
     def tcp_server(ip_addr, pending, task=None):
@@ -3680,10 +5687,5 @@ def recover_jobs(recover_file=None, timeout=None, terminate_pending=False):
     pycos_scheduler.finish()
 
     if pending['count'] == 0 and pending['resend_req_done'] is True:
-        for ext in ('', '.db', '.bak', '.dat', '.dir'):
-            if os.path.isfile(recover_file + ext):
-                try:
-                    os.remove(recover_file + ext)
-                except Exception:
-                    pass
+        _RecoverStore.remove_files(recover_file)
     return pending['jobs']
@@ -4,6 +4,17 @@ IPv6MulticastGroup = 'ff05::b409:3171:9705:5134:6159'
 IPv4MulticastGroup = '239.255.61.59'
 MsgTimeout = 10
 MaxFileSize = 0
+# If True, TLS sessions are resumed when connecting to same peer again
+TLSSessionReuse = True
+# If True (and TLSSessionReuse is True), TLS connections are limited to
+# TLS 1.2, where resumed handshake has no key exchange; by default
+# highest version supported is used
+TLSSessionReuseV12 = False
+# Messages (job replies) larger than BulkMsgSize bytes are bulk data; nodes send
+# at most BulkStreams of them to a client at a time, so that control messages
+# (pulses, status) sent on their own connections don't wait behind bulk data
+BulkMsgSize = 1048576
+BulkStreams = 2
 # Settings below are evaluated so must be expressions
 ClientPort = 'dispy.config.DispyPort'
 NodePort = 'dispy.config.DispyPort + 1'
@@ -35,7 +35,7 @@ import dispy.config
 from dispy.config import MsgTimeout, MaxFileSize
 from dispy import _Compute, DispyJob, _DispyJob_, _Node, DispyNode, NodeAllocate, \
     _JobReply, auth_code, num_min, _parse_node_allocs, _XferFile, _dispy_version, \
-    _same_file, _node_ipaddr, logger
+    _same_file, _node_ipaddr, _JobStats, _MsgFrame, _unpack_pulse, logger
 
 __author__ = "Giridhar Pemmasani (pgiri@yahoo.com)"
 __email__ = "pgiri@yahoo.com"
@@ -88,10 +88,12 @@ class _Cluster(object):
         self.ip_addr = None
         self.dest_path = None
         self.file_uses = {}
+        self.job_stats = _JobStats()
 
     def __getstate__(self):
         state = dict(self.__dict__)
-        for var in ('_node_allocs', 'scheduler', 'status_callback', '_jobs', '_dispy_nodes'):
+        for var in ('_node_allocs', 'scheduler', 'status_callback', '_jobs', '_dispy_nodes',
+                    'job_stats'):
             state.pop(var, None)
         return state
 
@@ -207,6 +209,8 @@ class _Scheduler(object, metaclass=Singleton):
         self.unsched_clusters = []
         self.pending_clusters = {}
         self._sched_jobs = {}
+        # uids of scheduled jobs, indexed by IP address of node
+        self._node_jobs = {}
         self._sched_event = pycos.Event()
         # once a _job is done (i.e., final result for it is
         # received from node), it is added to done_jobs, so same
@@ -382,27 +386,36 @@ class _Scheduler(object, metaclass=Singleton):
         # generator
         conn.settimeout(MsgTimeout)
         msg = yield conn.recv_msg()
-        if msg.startswith(b'JOB_REPLY:'):
-            try:
-                info = deserialize(msg[len(b'JOB_REPLY:'):])
-            except Exception:
-                logger.warning('Invalid job reply from %s:%s ignored', addr[0], addr[1])
-            else:
+        frame = _MsgFrame.parse(msg)
+        if frame.name == b'JOB_REPLY':
+            # node may send more than one reply (e.g., when resending
+            # saved replies) over same connection
+            while frame.name == b'JOB_REPLY':
+                try:
+                    info = deserialize(frame.payload)
+                except Exception:
+                    logger.warning('Invalid job reply from %s:%s ignored', addr[0], addr[1])
+                    break
                 yield self.job_reply_process(info, len(msg), conn, addr)
+                try:
+                    msg = yield conn.recv_msg()
+                    frame = _MsgFrame.parse(msg)
+                except Exception:
+                    break
             conn.close()
 
-        elif msg.startswith(b'PULSE:'):
-            msg = msg[len(b'PULSE:'):]
+        elif frame.name == b'PULSE':
             try:
-                info = deserialize(msg)
+                info = _unpack_pulse(frame)
             except Exception:
                 logger.warning('Ignoring pulse message from %s', addr[0])
                 conn.close()
                 raise StopIteration
             node = self._nodes.get(info['ip_addr'], None)
             if node:
-                # assert 0 <= info['cpus'] <= node.cpus
+                # assert 0 <= info['cpus'] <= node.job_slots()
                 node.last_pulse = time.time()
+                node.pulses.pulse(node.last_pulse, self.pulse_interval)
                 yield conn.send_msg(b'PULSE')
                 if info['avail_info']:
                     node.avail_info = info['avail_info']
@@ -416,21 +429,21 @@ class _Scheduler(object, metaclass=Singleton):
                                 cluster.status_callback(DispyNode.AvailInfo, dispy_node, None)
             conn.close()
 
-        elif msg.startswith(b'PONG:'):
+        elif frame.name == b'PONG':
             conn.close()
             try:
-                info = deserialize(msg[len(b'PONG:'):])
+                info = deserialize(frame.payload)
                 assert info['auth'] == self.node_auth
             except Exception:
                 logger.warning('Ignoring node %s due to "secret" mismatch', addr[0])
             else:
                 self.add_node(info)
 
-        elif msg.startswith(b'PING:'):
+        elif frame.name == b'PING':
             sock_family = conn.family
             conn.close()
             try:
-                info = deserialize(msg[len(b'PING:'):])
+                info = deserialize(frame.payload)
                 if info['version'] != _dispy_version:
                     logger.warning('Ignoring node %s due to version mismatch', addr[0])
                     raise Exception('')
@@ -460,9 +473,9 @@ class _Scheduler(object, metaclass=Singleton):
                 finally:
                     sock.close()
 
-        elif msg.startswith(b'FILEXFER:'):
+        elif frame.name == b'FILEXFER':
             try:
-                xf = deserialize(msg[len(b'FILEXFER:'):])
+                xf = deserialize(frame.payload)
                 msg = yield conn.recv_msg()
                 job_reply = deserialize(msg)
                 yield self.xfer_to_client(job_reply, xf, conn, addr)
@@ -470,10 +483,10 @@ class _Scheduler(object, metaclass=Singleton):
                 logger.debug(traceback.format_exc())
             conn.close()
 
-        elif msg.startswith(b'TERMINATED:'):
+        elif frame.name == b'TERMINATED':
             conn.close()
             try:
-                info = deserialize(msg[len(b'TERMINATED:'):])
+                info = deserialize(frame.payload)
                 node = self._nodes.get(info['ip_addr'], None)
                 if not node:
                     raise StopIteration
@@ -484,8 +497,7 @@ class _Scheduler(object, metaclass=Singleton):
                 logger.debug('Removing node %s', node.ip_addr)
                 del self._nodes[node.ip_addr]
                 if node.clusters:
-                    dead_jobs = [_job for _job in self._sched_jobs.values()
-                                 if _job.node is not None and _job.node.ip_addr == node.ip_addr]
+                    dead_jobs = self.node_sched_jobs(node.ip_addr)
                     clusters = list(node.clusters)
                     node.clusters.clear()
                     for cluster in clusters:
@@ -498,10 +510,10 @@ class _Scheduler(object, metaclass=Singleton):
                 # logger.debug(traceback.format_exc())
                 pass
 
-        elif msg.startswith(b'NODE_CPUS:'):
+        elif frame.name == b'NODE_CPUS':
             conn.close()
             try:
-                info = deserialize(msg[len(b'NODE_CPUS:'):])
+                info = deserialize(frame.payload)
                 node = self._nodes.get(info['ip_addr'], None)
                 if not node:
                     raise StopIteration
@@ -546,9 +558,9 @@ class _Scheduler(object, metaclass=Singleton):
                 if dispy_node:
                     dispy_node.cpus = cpus
 
-        elif msg.startswith(b'RELAY_INFO:'):
+        elif frame.name == b'RELAY_INFO':
             try:
-                info = deserialize(msg[len(b'RELAY_INFO:'):])
+                info = deserialize(frame.payload)
                 assert info['version'] == _dispy_version
                 msg = {'sign': self.sign, 'ip_addrs': [info['scheduler_ip_addr']],
                        'port': self.port}
@@ -692,6 +704,7 @@ class _Scheduler(object, metaclass=Singleton):
             cluster.client_port = compute.scheduler_port
             cluster.client_sock_family = conn.family
             cluster.client_auth = compute.auth
+            cluster.client_frames = getattr(compute, 'frames', 0)
             compute.job_result_port = self.port
             compute.scheduler_port = self.port
             compute.auth = hashlib.sha1(os.urandom(10)).hexdigest()
@@ -831,16 +844,18 @@ class _Scheduler(object, metaclass=Singleton):
 
         if req != self.cluster_auth:
             msg = yield conn.recv_msg()
-            if msg.startswith(b'CLIENT:'):
+            frame = _MsgFrame.parse(msg)
+            if frame.name == b'CLIENT':
                 try:
-                    req = deserialize(msg[len(b'CLIENT:'):])
+                    req = deserialize(frame.payload)
                     if req['version'] != _dispy_version:
                         logger.warning('Ignoring %s due to version mismatch', addr[0])
                         raise Exception('')
                     if not req['ip_addr']:
                         req['ip_addr'] = addr[0]
                     reply = {'ip_addr': req['ip_addr'], 'port': self.scheduler_port,
-                             'sign': self.sign, 'version': _dispy_version}
+                             'sign': self.sign, 'version': _dispy_version,
+                             'frames': _MsgFrame.Version}
                     yield conn.send_msg(serialize(reply))
                 except Exception:
                     pass
@@ -849,13 +864,14 @@ class _Scheduler(object, metaclass=Singleton):
             conn.close()
             raise StopIteration
         msg = yield conn.recv_msg()
+        frame = _MsgFrame.parse(msg)
         if not msg:
             logger.info('Closing connection')
             conn.close()
             raise StopIteration
 
-        if msg.startswith(b'JOB:'):
-            msg = msg[len(b'JOB:'):]
+        if frame.name == b'JOB':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 _job = req['job']
@@ -870,8 +886,8 @@ class _Scheduler(object, metaclass=Singleton):
                 yield _job_request(self, cluster, node, _job)
             resp = None
 
-        elif msg.startswith(b'PULSE:'):
-            msg = msg[len(b'PULSE:'):]
+        elif frame.name == b'PULSE':
+            msg = frame.payload
             try:
                 info = deserialize(msg)
             except Exception:
@@ -885,12 +901,12 @@ class _Scheduler(object, metaclass=Singleton):
                         cluster.last_pulse = time.time()
             conn.close()
 
-        elif msg.startswith(b'COMPUTE:'):
-            msg = msg[len(b'COMPUTE:'):]
+        elif frame.name == b'COMPUTE':
+            msg = frame.payload
             resp = _compute_req(self, msg)
 
-        elif msg.startswith(b'SCHEDULE:'):
-            msg = msg[len(b'SCHEDULE:'):]
+        elif frame.name == b'SCHEDULE':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 cluster = self.pending_clusters[req['compute_id']]
@@ -906,8 +922,8 @@ class _Scheduler(object, metaclass=Singleton):
                 resp = 'ACK'.encode()
                 Task(self.schedule_cluster)
 
-        elif msg.startswith(b'CLOSE:'):
-            msg = msg[len(b'CLOSE:'):]
+        elif frame.name == b'CLOSE':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 auth = req['auth']
@@ -924,16 +940,16 @@ class _Scheduler(object, metaclass=Singleton):
             terminate_pending = req.get('terminate_pending', False)
             Task(self.cleanup_computation, cluster, terminate_pending=bool(terminate_pending))
 
-        elif msg.startswith(b'FILEXFER:'):
-            msg = msg[len(b'FILEXFER:'):]
+        elif frame.name == b'FILEXFER':
+            msg = frame.payload
             resp = yield xfer_from_client(self, msg)
 
-        elif msg.startswith(b'SENDFILE:'):
-            msg = msg[len(b'SENDFILE:'):]
+        elif frame.name == b'SENDFILE':
+            msg = frame.payload
             resp = yield send_file(self, msg)
 
-        elif msg.startswith(b'NODE_JOBS:'):
-            msg = msg[len(b'NODE_JOBS:'):]
+        elif frame.name == b'NODE_JOBS':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 cluster = self._clusters.get(req['compute_id'], None)
@@ -949,8 +965,8 @@ class _Scheduler(object, metaclass=Singleton):
                 job_uids = []
             resp = serialize(job_uids)
 
-        elif msg.startswith(b'TERMINATE_JOB:'):
-            msg = msg[len(b'TERMINATE_JOB:'):]
+        elif frame.name == b'TERMINATE_JOB':
+            msg = frame.payload
             try:
                 req = deserialize(msg)
                 uid = req['uid']
@@ -962,8 +978,8 @@ class _Scheduler(object, metaclass=Singleton):
                 raise StopIteration
             self.cancel_job(cluster, uid)
 
-        elif msg.startswith(b'RESEND_JOB_RESULTS:'):
-            msg = msg[len(b'RESEND_JOB_RESULTS:'):]
+        elif frame.name == b'RESEND_JOB_RESULTS':
+            msg = frame.payload
             try:
                 info = deserialize(msg)
                 compute_id = info['compute_id']
@@ -989,8 +1005,8 @@ class _Scheduler(object, metaclass=Singleton):
                 yield self.resend_job_results(cluster, task=task)
             raise StopIteration
 
-        elif msg.startswith(b'PENDING_JOBS:'):
-            msg = msg[len(b'PENDING_JOBS:'):]
+        elif frame.name == b'PENDING_JOBS':
+            msg = frame.payload
             reply = {'done': [], 'pending': 0}
             try:
                 info = deserialize(msg)
@@ -1023,12 +1039,12 @@ class _Scheduler(object, metaclass=Singleton):
                     reply['pending'] = cluster.pending_jobs
             resp = serialize(reply)
 
-        elif msg.startswith(b'RETRIEVE_JOB:'):
-            msg = msg[len(b'RETRIEVE_JOB:'):]
+        elif frame.name == b'RETRIEVE_JOB':
+            msg = frame.payload
             yield self.retrieve_job_req(conn, msg)
 
-        elif msg.startswith(b'ALLOCATE_NODE:'):
-            req = msg[len(b'ALLOCATE_NODE:'):]
+        elif frame.name == b'ALLOCATE_NODE':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1038,8 +1054,8 @@ class _Scheduler(object, metaclass=Singleton):
             except Exception:
                 resp = serialize(-1)
 
-        elif msg.startswith(b'DEALLOCATE_NODE:'):
-            req = msg[len(b'DEALLOCATE_NODE:'):]
+        elif frame.name == b'DEALLOCATE_NODE':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1049,8 +1065,8 @@ class _Scheduler(object, metaclass=Singleton):
             except Exception:
                 resp = serialize(-1)
 
-        elif msg.startswith(b'CLOSE_NODE:'):
-            req = msg[len(b'CLOSE_NODE:'):]
+        elif frame.name == b'CLOSE_NODE':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1061,8 +1077,8 @@ class _Scheduler(object, metaclass=Singleton):
             except Exception:
                 resp = serialize(-1)
 
-        elif msg.startswith(b'SET_NODE_CPUS:'):
-            req = msg[len(b'SET_NODE_CPUS:'):]
+        elif frame.name == b'SET_NODE_CPUS':
+            req = frame.payload
             try:
                 req = deserialize(req)
                 cluster = self._clusters[req['compute_id']]
@@ -1106,6 +1122,27 @@ class _Scheduler(object, metaclass=Singleton):
                 if status:
                     break
 
+    def probe_node(self, node, task=None):
+        # generator
+        # node is suspected to have failed; it is removed (and its jobs
+        # rescheduled) only if it doesn't respond to probe either
+        node.probing = True
+        alive = yield node.probe(task=task)
+        node.probing = False
+        if alive or self._nodes.get(node.ip_addr, None) != node:
+            raise StopIteration
+        logger.warning('Node %s is not responding; removing it (%s, %s, %s)',
+                       node.ip_addr, node.busy, node.last_pulse, time.time())
+        del self._nodes[node.ip_addr]
+        clusters = list(node.clusters)
+        node.clusters.clear()
+        for cluster in clusters:
+            dispy_node = cluster._dispy_nodes.pop(node.ip_addr, None)
+            if not dispy_node:
+                continue
+            Task(self.send_node_status, cluster, dispy_node, DispyNode.Closed)
+        self.reschedule_jobs(self.node_sched_jobs(node.ip_addr))
+
     def timer_proc(self, task=None):
         task.set_daemon()
         reset = True
@@ -1121,25 +1158,10 @@ class _Scheduler(object, metaclass=Singleton):
             now = time.time()
             if self.pulse_interval and (now - last_pulse_time) >= self.pulse_interval:
                 last_pulse_time = now
-                dead_nodes = {}
                 for node in self._nodes.values():
-                    if node.busy and (node.last_pulse + (5 * self.pulse_interval)) < now:
-                        logger.warning('Node %s is not responding; removing it (%s, %s, %s)',
-                                       node.ip_addr, node.busy, node.last_pulse, now)
-                        dead_nodes[node.ip_addr] = node
-                for ip_addr in dead_nodes:
-                    node = self._nodes.pop(ip_addr, None)
-                    clusters = list(node.clusters)
-                    node.clusters.clear()
-                    for cluster in clusters:
-                        dispy_node = cluster._dispy_nodes.pop(node.ip_addr, None)
-                        if not dispy_node:
-                            continue
-                        Task(self.send_node_status, cluster, dispy_node, DispyNode.Closed)
-
-                dead_jobs = [_job for _job in self._sched_jobs.values()
-                             if _job.node is not None and _job.node.ip_addr in dead_nodes]
-                self.reschedule_jobs(dead_jobs)
+                    if node.busy and not node.probing and \
+                       node.suspected(now, self.pulse_interval):
+                        Task(self.probe_node, node)
                 resend = [resend_cluster for resend_cluster in self._clusters.values()
                           if resend_cluster.pending_results and not resend_cluster.zombie]
                 for cluster in resend:
@@ -1208,6 +1230,7 @@ class _Scheduler(object, metaclass=Singleton):
                 data = yield conn.recvall(min(xf.stat_buf.st_size-recvd, 1024000))
                 if not data:
                     break
+                node.last_pulse = time.time()
                 yield client_sock.sendall(data)
                 recvd = yield client_sock.recv_msg()
                 recvd = deserialize(recvd)
@@ -1417,6 +1440,7 @@ class _Scheduler(object, metaclass=Singleton):
                          keyfile=self.node_keyfile, certfile=self.node_certfile)
             node.name = info['name']
             node.avail_info = info['avail_info']
+            node.frames = info.get('frames', 0)
             self._nodes[node.ip_addr] = node
         else:
             node.last_pulse = time.time()
@@ -1431,8 +1455,7 @@ class _Scheduler(object, metaclass=Singleton):
             logger.debug('Node %s rediscovered', info['ip_addr'])
             node.port = info['port']
             if node.auth is not None:
-                dead_jobs = [_job for _job in self._sched_jobs.values()
-                             if _job.node is not None and _job.node.ip_addr == node.ip_addr]
+                dead_jobs = self.node_sched_jobs(node.ip_addr)
                 node.busy = 0
                 node.auth = auth
                 clusters = list(node.clusters)
@@ -1470,7 +1493,8 @@ class _Scheduler(object, metaclass=Singleton):
         sock.settimeout(MsgTimeout)
         try:
             yield sock.connect((cluster.client_ip_addr, cluster.client_job_result_port))
-            yield sock.send_msg(b'JOB_REPLY:' + serialize(result))
+            yield sock.send_msg(_MsgFrame(b'JOB_REPLY', serialize(result)).pack(
+                cluster.client_frames))
             ack = yield sock.recv_msg()
             assert ack == b'ACK'
         except Exception:
@@ -1638,7 +1662,8 @@ class _Scheduler(object, metaclass=Singleton):
         job.end_time = reply.end_time
         if reply.status != DispyJob.ProvisionalResult:
             self.done_jobs[_job.uid] = _job
-            del self._sched_jobs[_job.uid]
+            self.pop_sched_job(_job.uid)
+            cluster.job_stats.job_done(_job, job.submit_time, reply)
             node.busy -= 1
             node.cpu_time += reply.end_time - reply.start_time
             if cluster.status_callback:
@@ -1665,12 +1690,45 @@ class _Scheduler(object, metaclass=Singleton):
                     logger.warning('Could not remove "%s"', xf.name)
         Task(self.send_job_result, _job.uid, cluster, reply, resending=False)
 
+    def add_sched_job(self, _job):
+        self._sched_jobs[_job.uid] = _job
+        if _job.node:
+            self._node_jobs.setdefault(_job.node.ip_addr, set()).add(_job.uid)
+
+    def pop_sched_job(self, uid):
+        _job = self._sched_jobs.pop(uid, None)
+        if _job and _job.node:
+            uids = self._node_jobs.get(_job.node.ip_addr, None)
+            if uids:
+                uids.discard(uid)
+                if not uids:
+                    del self._node_jobs[_job.node.ip_addr]
+        return _job
+
+    def node_sched_jobs(self, ip_addr):
+        # jobs scheduled on node; this doesn't go through all scheduled jobs
+        return [self._sched_jobs[uid] for uid in self._node_jobs.get(ip_addr, ())]
+
+    def job_slot_free(self, node, cluster):
+        """Returns True if job of 'cluster' can run on 'node' now; jobs of
+        each computation are limited by its own 'jobs_per_cpu', even if
+        other computations on node run more jobs per CPU.
+        """
+        slots = node.job_slots(cluster)
+        if slots >= node.job_slots():
+            # checked with node's slots already
+            return True
+        compute_id = cluster._compute.id
+        busy = sum(1 for _job in self.node_sched_jobs(node.ip_addr)
+                   if _job.compute_id == compute_id)
+        return busy < slots
+
     def reschedule_jobs(self, dead_jobs):
         if not dead_jobs:
             return
         for _job in dead_jobs:
             cluster = self._clusters[_job.compute_id]
-            del self._sched_jobs[_job.uid]
+            self.pop_sched_job(_job.uid)
             if cluster._compute.reentrant and not _job.pinned:
                 logger.debug('Rescheduling job %s from %s', _job.uid, _job.node.ip_addr)
                 _job.job.status = DispyJob.Created
@@ -1694,15 +1752,17 @@ class _Scheduler(object, metaclass=Singleton):
         node = None
         load = 1.0
         for host in self._nodes.values():
-            if host.busy >= host.cpus:
+            slots = host.job_slots()
+            if host.busy >= slots:
                 continue
             if host.pending_jobs:
                 return host
-            if not any(cluster._jobs for cluster in host.clusters):
+            if not any(cluster._jobs and self.job_slot_free(host, cluster)
+                       for cluster in host.clusters):
                 continue
-            if (host.busy / host.cpus) < load:
+            if (host.busy / slots) < load:
                 node = host
-                load = host.busy / host.cpus
+                load = host.busy / slots
         return node
 
     def fsfs_job_schedule(self):
@@ -1714,8 +1774,8 @@ class _Scheduler(object, metaclass=Singleton):
             return (None, None, None)
         _job = cluster = lrs = None
         for cluster in node.clusters:
-            if cluster._jobs and (not lrs or
-                                  cluster._jobs[0].job.submit_time < lrs._jobs[0].job.submit_time):
+            if (cluster._jobs and self.job_slot_free(node, cluster) and
+                (not lrs or cluster._jobs[0].job.submit_time < lrs._jobs[0].job.submit_time)):
                 lrs = cluster
         if lrs:
             if node.pending_jobs:
@@ -1739,7 +1799,8 @@ class _Scheduler(object, metaclass=Singleton):
             return (None, None, None)
         _job = cluster = lrs = None
         for cluster in node.clusters:
-            if cluster._jobs and (not lrs or cluster.job_sched_time < lrs.job_sched_time):
+            if (cluster._jobs and self.job_slot_free(node, cluster) and
+                (not lrs or cluster.job_sched_time < lrs.job_sched_time)):
                 lrs = cluster
         if lrs:
             if node.pending_jobs:
@@ -1769,7 +1830,8 @@ class _Scheduler(object, metaclass=Singleton):
             return (None, None, None)
         _job = cluster = lrs = None
         for cluster in node.clusters:
-            if cluster._jobs and (not lrs or cluster.start_time < lrs.start_time):
+            if (cluster._jobs and self.job_slot_free(node, cluster) and
+                (not lrs or cluster.start_time < lrs.start_time)):
                 lrs = cluster
         if lrs:
             if node.pending_jobs:
@@ -1801,7 +1863,7 @@ class _Scheduler(object, metaclass=Singleton):
             logger.warning('Failed to run job %s on %s for computation %s; removing this node',
                            _job.uid, node.ip_addr, cluster._compute.name)
             self.delete_node(node)
-            if self._sched_jobs.pop(_job.uid, None) == _job:
+            if self.pop_sched_job(_job.uid) == _job:
                 if not _job.pinned:
                     cluster._jobs.insert(0, _job)
                 node.busy -= 1
@@ -1812,7 +1874,7 @@ class _Scheduler(object, metaclass=Singleton):
             # logger.debug(traceback.format_exc())
             # TODO: delay executing again for some time?
             # this job might have been deleted already due to timeout
-            if self._sched_jobs.pop(_job.uid, None) == _job:
+            if self.pop_sched_job(_job.uid) == _job:
                 if cluster.status_callback:
                     if dispy_node:
                         dispy_node.update_time = time.time()
@@ -1825,8 +1887,9 @@ class _Scheduler(object, metaclass=Singleton):
                 logger.debug('Running job %s on %s (busy: %d / %d)',
                              _job.uid, node.ip_addr, node.busy, node.cpus)
                 _job.job.status = DispyJob.Running
-                _job.job.start_time = time.time()
+                _job.job.start_time = _job.sent_time = time.time()
                 cluster = self._clusters[_job.compute_id]
+                cluster.job_stats.job_sent(_job, _job.job.submit_time)
                 # TODO/Note: It is likely that this job status may arrive at
                 # the client before the job is done and the node's status
                 # arrives. Either use queing for messages (ideally with
@@ -1848,8 +1911,9 @@ class _Scheduler(object, metaclass=Singleton):
                 yield self._sched_event.wait()
                 continue
             _job.node = node
+            _job.dispatch_time = time.time()
             # assert node.busy < node.cpus
-            self._sched_jobs[_job.uid] = _job
+            self.add_sched_job(_job)
             node.busy += 1
             Task(self.run_job, _job, cluster)
 
@@ -1873,6 +1937,7 @@ class _Scheduler(object, metaclass=Singleton):
             yield self.cleanup_computation(cluster)
         self._clusters = {}
         self._sched_jobs = {}
+        self._node_jobs = {}
         self.done_jobs = {}
         logger.debug('Scheduler quit')
 
@@ -2039,10 +2104,10 @@ class _Scheduler(object, metaclass=Singleton):
                         ]
         else:
             if get_uids:
-                jobs = [_job.uid for _job in self._sched_jobs.values() if _job.node == node
+                jobs = [_job.uid for _job in self.node_sched_jobs(node.ip_addr) if _job.node == node
                         and _job.compute_id == cluster._compute.id]
             else:
-                jobs = [_job.job for _job in self._sched_jobs.values() if _job.node == node
+                jobs = [_job.job for _job in self.node_sched_jobs(node.ip_addr) if _job.node == node
                         and _job.compute_id == cluster._compute.id]
 
         raise StopIteration(jobs)
@@ -2125,6 +2190,9 @@ class _Scheduler(object, metaclass=Singleton):
         if self.unsched_clusters:
             print('Pending clients: %s' % (len(self.unsched_clusters)))
         print('')
+        for cluster in self._clusters.values():
+            print('Job latencies for %s:\n' % cluster.name)
+            cluster.job_stats.print_stats()
         yield 0
 
 